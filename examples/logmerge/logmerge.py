@@ -16,6 +16,7 @@
 # You should have received a copy of the GNU General Public License
 # along with loglab.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import sys
 import time
 import datetime
@@ -23,7 +24,9 @@ import datetime
 from loglab.file_sources import GZipLogFile, LogFile
 from loglab.adapters import LogMultiplexer
 from loglab.date_splitter import LogSplitter
+from loglab.incremental import IncrementalSplitter
 from loglab.utils import LineDisplay
+from loglab.metrics import Metrics
 from loglab.filters import DateRangeFilter
 from loglab.dateglob import candidate_logs
 
@@ -47,6 +50,9 @@ parser.add_option('-c', '--config', help='Job config file (default logs.ini)', d
 parser.add_option('-s', '--start-date', help="Only output logs since DATE (in YYYY-MM-DD format, inclusive)", metavar='DATE')
 parser.add_option('-e', '--end-date', help="Only output logs up to DATE (in YYYY-MM-DD format, exclusive)", metavar='DATE')
 parser.add_option('-n', '--no-act', help="Don't merge; just print what would be done", action="store_true")
+parser.add_option('-i', '--incremental', help="Only process logs that are new or have changed since the last run (recorded in the job's manifest file)", action="store_true")
+parser.add_option('-S', '--stats', help="Report throughput statistics to stderr every SECONDS", type='float', metavar='SECONDS')
+parser.add_option('-z', '--compressor', help="How to compress output: threaded (default), subproc or gzip", default='threaded', choices=['threaded', 'subproc', 'gzip'])
 
 options, args = parser.parse_args()
 
@@ -108,22 +114,52 @@ for section in sections:
             print "%s: no logs to merge." % section
         continue
 
-    sources = []
-    for l in logs:
+    def open_log(l):
         if l.endswith('.gz'):
-            sources.append(GZipLogFile(l, window_size=WINDOW_SIZE))
+            return GZipLogFile(l, window_size=WINDOW_SIZE)
         else:
-            sources.append(UncompressedLogFile(l, window_size=WINDOW_SIZE))
+            return LogFile(l, window_size=WINDOW_SIZE)
 
+    def pipeline(source):
+        if start or end:
+            source = DateRangeFilter(source, start_date=start, end_date=end, ordered=True)
+        return source
+
+    splitter = LogSplitter(dest, compressor=options.compressor)
+
+    if options.incremental:
+        if config.has_option(section, 'manifest'):
+            manifest = config.get(section, 'manifest')
+        else:
+            manifest = section + '.manifest'
+        if not options.quiet:
+            print "Updating %s log..." % section
+        # Inputs split over a different date range must be split again
+        key = [options.start_date, options.end_date] if start or end else None
+        incremental = IncrementalSplitter(splitter, manifest, open_log, pipeline, key)
+        written = incremental.split(logs)
+        if not options.quiet:
+            print "%d files rebuilt" % len(written)
+        continue
+
+    sources = [open_log(l) for l in logs]
     source = LogMultiplexer(*sources)
 
+    reporter = None
+    if options.stats:
+        metrics = Metrics()
+        for l, s in zip(logs, sources):
+            metrics.watch_failures(s)
+            metrics.watch_buffer(os.path.basename(l), s)
+        source = metrics.count(source)
+        reporter = metrics.report_every(options.stats)
+
     if not options.quiet:
         print "Splitting %s log..." % section
         print "Initialising %d log buffers..." % len(sources)
         source = LineDisplay(source)
 
-    if start or end:
-        source = DateRangeFilter(source, start_date=start, end_date=end)
+    splitter.split(pipeline(source))
 
-    splitter = LogSplitter(dest)
-    splitter.split(source)
+    if reporter:
+        reporter.stop()
@@ -20,35 +20,21 @@
 
 import datetime
 
+from loglab.aggregate import Aggregator, Count, CountWhere
+
+
 class ServiceUnavailableReport(object):
     """Log consumer that produces a report of total requests, versus 503 errors."""
 
     def __init__(self, iterable, interval=1):
         self.iterable = iterable
-        self.minute = None
         self.interval = interval
+        self.aggregator = Aggregator([
+            Count('requests'),
+            CountWhere('error503s', code='503'),
+        ], interval=interval * 60)
 
     def scan(self):
-        requests = 0
-        error503s = 0
-        for l in self.iterable:
-            t = l.time()
-            d = datetime.datetime.fromtimestamp(t)
-            minute = d.replace(minute=int(d.minute/self.interval) * self.interval, second=0, microsecond=0)
-            if minute != self.minute:
-                if self.minute is None:
-                    self.minute = minute
-                else:
-                    while minute >= self.minute + datetime.timedelta(seconds=self.interval * 60):
-                        yield self.minute, requests, error503s
-                        self.minute += datetime.timedelta(seconds=self.interval * 60)
-                        requests = 0
-                        error503s = 0
-
-            requests += 1
-            if l.code == '503':
-                error503s += 1
-
-        if self.minute is not None:
-            yield self.minute, requests, error503s
-
+        for start, values in self.aggregator.aggregate(self.iterable):
+            minute = datetime.datetime.fromtimestamp(start)
+            yield minute, values['requests'], values['error503s']
@@ -1,6 +1,7 @@
 from .merge import merge
 from .filters import Filter
 from .lineformats import CombinedLogLine
+from .sources import close_source
 
 
 __all__ = (
@@ -12,11 +13,18 @@ class LogMultiplexer(object):
     """Produce one merged log from many chronologically-ordered logs."""
 
     def __init__(self, *logs):
+        self.logs = logs
         self.iterable = merge(*logs)
 
     def __iter__(self):
         return self.iterable
 
+    def close(self):
+        """Stop merging and close all of the input logs."""
+        self.iterable.close()
+        for log in self.logs:
+            close_source(log)
+
 
 class LogConverter(Filter):
     """Converts log lines to Combined Log Format"""
@@ -0,0 +1,497 @@
+# loglab - A library for stream-based log processing
+# Copyright (c) 2010 Crown copyright
+#
+# This file is part of loglab.
+#
+# loglab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# loglab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with loglab.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Streaming aggregation of log lines into fixed time intervals.
+
+Lines are assigned to buckets by integer division of their timestamp by the
+interval, and each bucket accumulates a set of columns::
+
+    >>> agg = Aggregator([Count('requests'), CountWhere('errors', code='503')], interval=60)
+    >>> for start, values in agg.aggregate(log):
+    ...     print start, values['requests'], values['errors']
+
+Columns hold their state in plain values that can be merged, so partial
+aggregates, for example of different logs, can be combined.
+"""
+
+import heapq
+
+from .lineformats import LogLine
+from .query import where
+from .sketches import QuantileSketch, HyperLogLog, SpaceSaving
+
+__all__ = (
+    'Aggregator', 'Column', 'Count', 'CountWhere', 'Sum', 'Quantiles',
+    'Distinct', 'TopK', 'status_class',
+)
+
+
+class Column(object):
+    """An aggregate of the lines in a bucket.
+
+    Subclasses define how to start, update and merge the column's state, and
+    how to derive its value from the state.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def new(self):
+        """Return the state of an empty bucket."""
+        return 0
+
+    def add(self, state, line):
+        """Return the state updated with line."""
+        raise NotImplementedError("Subclasses must implement add()")
+
+    def merge(self, a, b):
+        """Return the state combining the states a and b."""
+        return a + b
+
+    def value(self, state):
+        """Return the value of the column from its state."""
+        return state
+
+    def dump(self, state):
+        """Return the state as a value that can be serialised as JSON."""
+        return state
+
+    def load(self, data):
+        """Return the state from the output of dump()."""
+        return data
+
+    def params(self):
+        """Return a dictionary, serialisable as JSON, of the parameters that
+        determine the column's state, so that states saved by one column can
+        be checked before they are merged with another's."""
+        return {}
+
+
+def describe(v):
+    """Return a JSON-serialisable description of a column parameter.
+    Functions and classes are described by name."""
+    if v is None or isinstance(v, (basestring, bool, int, long, float)):
+        return v
+    if isinstance(v, (list, tuple)):
+        return [describe(x) for x in v]
+    if isinstance(v, (set, frozenset)):
+        return sorted(describe(x) for x in v)
+    if hasattr(v, 'pattern'):
+        return v.pattern
+    if callable(v):
+        name = getattr(v, '__name__', type(v).__name__)
+        return '%s.%s' % (getattr(v, '__module__', None), name)
+    return repr(v)
+
+
+class Count(Column):
+    """The number of lines."""
+    def __init__(self, name='count'):
+        super(Count, self).__init__(name)
+
+    def add(self, state, line):
+        return state + 1
+
+
+class CountWhere(Column):
+    """The number of lines matching a condition.
+
+    The condition can be given as a predicate, or as keyword arguments as for
+    :py:func:`~loglab.query.where`, such as code='503' or
+    code__startswith='5'.
+    """
+    def __init__(self, name, predicate=None, line_class=LogLine, **conditions):
+        super(CountWhere, self).__init__(name)
+        self.conditions = conditions
+        self.line_class = line_class
+        if predicate is None:
+            predicate = where(line_class=line_class, **conditions).accept
+        self.predicate = predicate
+
+    def params(self):
+        if self.conditions:
+            return {
+                'conditions': describe(sorted(self.conditions.items())),
+                'line_class': describe(self.line_class),
+            }
+        return {'predicate': describe(self.predicate)}
+
+    def add(self, state, line):
+        if self.predicate(line):
+            return state + 1
+        return state
+
+
+class Sum(Column):
+    """The sum of a numeric field, such as size. Values that are not numeric,
+    such as '-', are ignored."""
+    def __init__(self, name, field=None):
+        super(Sum, self).__init__(name)
+        self.field = field or name
+
+    def add(self, state, line):
+        try:
+            return state + int(getattr(line, self.field))
+        except (ValueError, TypeError):
+            return state
+
+    def params(self):
+        return {'field': self.field}
+
+
+def field_getter(field):
+    if callable(field):
+        return field
+    return lambda line: getattr(line, field)
+
+
+class Quantiles(Column):
+    """Estimated quantiles of a numeric field, such as size or an S3 log's
+    total_time, or of a function of each line.
+
+    The value is a dictionary mapping names such as 'p50' and 'p99' to
+    estimates within relative_accuracy, from a
+    :py:class:`~loglab.sketches.QuantileSketch`. Sketches of different
+    buckets, logs or processes merge exactly. Values that are not numeric,
+    such as '-', are ignored.
+    """
+    def __init__(self, name, field=None, quantiles=(0.5, 0.95, 0.99), relative_accuracy=0.01):
+        super(Quantiles, self).__init__(name)
+        self.field = field or name
+        self.get = field_getter(self.field)
+        self.quantiles = quantiles
+        self.relative_accuracy = relative_accuracy
+
+    def new(self):
+        return QuantileSketch(self.relative_accuracy)
+
+    def add(self, state, line):
+        try:
+            state.add(float(self.get(line)))
+        except (ValueError, TypeError):
+            pass
+        return state
+
+    def merge(self, a, b):
+        merged = a.copy()
+        merged.merge(b)
+        return merged
+
+    def value(self, state):
+        return dict(
+            ('p%g' % (q * 100), v)
+            for q, v in zip(self.quantiles, state.quantiles(self.quantiles))
+        )
+
+    def dump(self, state):
+        return state.to_dict()
+
+    def load(self, data):
+        return QuantileSketch.from_dict(data)
+
+    def params(self):
+        # The quantiles reported are read from the sketch, so do not matter
+        return {'field': describe(self.field), 'relative_accuracy': self.relative_accuracy}
+
+
+class Distinct(Column):
+    """The estimated number of distinct values of a field, such as ip or req.
+
+    fields may be the name of a field, a tuple of field names to count
+    distinct combinations, such as ('ip', 'x_forwarded_for'), or a function
+    of a line. Values are counted with a
+    :py:class:`~loglab.sketches.HyperLogLog` of the given precision, which
+    uses fixed memory, and merges exactly, so that daily counts can be
+    combined from hourly ones.
+    """
+    def __init__(self, name, fields=None, precision=14):
+        super(Distinct, self).__init__(name)
+        self.fields = fields = fields or name
+        if isinstance(fields, tuple):
+            getters = [field_getter(f) for f in fields]
+            self.get = lambda line: '\0'.join([g(line) or '' for g in getters])
+        else:
+            self.get = field_getter(fields)
+        self.precision = precision
+
+    def new(self):
+        return HyperLogLog(self.precision)
+
+    def add(self, state, line):
+        state.add(self.get(line) or '')
+        return state
+
+    def merge(self, a, b):
+        merged = a.copy()
+        merged.merge(b)
+        return merged
+
+    def value(self, state):
+        return state.count()
+
+    def dump(self, state):
+        return state.to_dict()
+
+    def load(self, data):
+        return HyperLogLog.from_dict(data)
+
+    def params(self):
+        return {'fields': describe(self.fields), 'precision': self.precision}
+
+
+class TopK(Column):
+    """The k most frequent values of a field, such as req, ref or ip, or of a
+    function of a line.
+
+    Values are counted with a :py:class:`~loglab.sketches.SpaceSaving`
+    sketch of the given capacity, by default 10 * k, which bounds memory
+    however many distinct values there are. The value of the column is a
+    list of (value, count, error) tuples, most frequent first; the true
+    frequency of each value lies between count - error and count.
+    """
+    def __init__(self, name, field=None, k=100, capacity=None):
+        super(TopK, self).__init__(name)
+        self.field = field or name
+        self.get = field_getter(self.field)
+        self.k = k
+        self.capacity = capacity or 10 * k
+
+    def new(self):
+        return SpaceSaving(self.capacity)
+
+    def add(self, state, line):
+        state.add(self.get(line))
+        return state
+
+    def merge(self, a, b):
+        merged = a.copy()
+        merged.merge(b)
+        return merged
+
+    def value(self, state):
+        return state.top(self.k)
+
+    def dump(self, state):
+        return state.to_dict()
+
+    def load(self, data):
+        return SpaceSaving.from_dict(data)
+
+    def params(self):
+        # k only limits the values reported from the sketch
+        return {'field': describe(self.field), 'capacity': self.capacity}
+
+
+def numbered_stream(i, stream):
+    for start, state in stream:
+        yield start, i, state
+
+
+def status_class(line):
+    """Group lines by the class of their status code, eg. '5xx'."""
+    return line.code[:1] + 'xx'
+
+
+class Aggregator(object):
+    """Aggregates a stream of log lines into buckets of interval seconds.
+
+    Buckets start at multiples of interval seconds since the epoch. If
+    group_by is given, as the name of a field or a function of a line,
+    columns are aggregated separately for each group within a bucket.
+
+    Input should be in chronological order, but lines up to lateness
+    seconds out of order are still counted in their bucket; buckets are only
+    output once a line lateness seconds past their end is seen. Lines for
+    buckets that have already been output are counted in the attribute late
+    and otherwise ignored. The timestamp of the newest line seen is kept in
+    the attribute latest.
+
+    If fill_gaps is True, empty buckets are output for intervals with no
+    lines.
+    """
+    def __init__(self, columns, interval=60, group_by=None, lateness=0, fill_gaps=True):
+        self.columns = list(columns)
+        self.interval = interval
+        if isinstance(group_by, basestring):
+            field = group_by
+            group_by = lambda l: getattr(l, field)
+        self.group_by = group_by
+        self.lateness = lateness
+        self.fill_gaps = fill_gaps
+        self.late = 0
+        self.open_buckets = {}
+        self.latest = None
+
+    def new(self):
+        return [c.new() for c in self.columns]
+
+    def values(self, state):
+        return dict((c.name, c.value(s)) for c, s in zip(self.columns, state))
+
+    def merge(self, a, b):
+        """Merge the states of two buckets."""
+        if self.group_by is None:
+            return [c.merge(x, y) for c, x, y in zip(self.columns, a, b)]
+        merged = dict(a)
+        for k, state in b.iteritems():
+            if k in merged:
+                merged[k] = self.merge_columns(merged[k], state)
+            else:
+                merged[k] = state
+        return merged
+
+    def merge_columns(self, a, b):
+        return [c.merge(x, y) for c, x, y in zip(self.columns, a, b)]
+
+    def dump(self, bucket):
+        """Return the state of a bucket as a value that can be serialised as
+        JSON."""
+        if self.group_by is None:
+            return self.dump_columns(bucket)
+        return dict((k, self.dump_columns(s)) for k, s in bucket.iteritems())
+
+    def dump_columns(self, state):
+        return [c.dump(s) for c, s in zip(self.columns, state)]
+
+    def load(self, data):
+        """Return the state of a bucket from the output of :py:meth:`dump`."""
+        if self.group_by is None:
+            return self.load_columns(data)
+        return dict((k, self.load_columns(s)) for k, s in data.iteritems())
+
+    def load_columns(self, data):
+        return [c.load(d) for c, d in zip(self.columns, data)]
+
+    def result(self, bucket):
+        """Return the output values for the state of a bucket."""
+        if self.group_by is None:
+            return self.values(bucket)
+        return dict((k, self.values(s)) for k, s in bucket.iteritems())
+
+    def empty(self):
+        if self.group_by is None:
+            return self.new()
+        return {}
+
+    def partial(self):
+        """Return (start, values) for the newest bucket that has not been
+        output yet, with the lines counted in it so far, or None."""
+        if not self.open_buckets:
+            return None
+        k = max(self.open_buckets)
+        return k * self.interval, self.result(self.open_buckets[k])
+
+    def aggregate(self, lines):
+        """Generate (start, values) for each bucket, in order, where start is
+        the start of the bucket as an integer timestamp.
+
+        values is a dictionary of column values; with group_by, it maps each
+        group to a dictionary of column values.
+        """
+        result = self.result
+        for start, state in self.buckets(lines):
+            yield start, result(state)
+
+    def combine(self, *streams):
+        """Merge streams of (start, state) from :py:meth:`buckets`, such as
+        the results of aggregating different logs in parallel, generating
+        (start, values) as if one aggregator had seen all of the lines."""
+        result = self.result
+        current = None
+        state = None
+        # Streams are numbered so that states are never compared
+        numbered = [numbered_stream(i, stream) for i, stream in enumerate(streams)]
+        for start, i, s in heapq.merge(*numbered):
+            if start != current:
+                if current is not None:
+                    yield current, result(state)
+                current, state = start, s
+            else:
+                state = self.merge(state, s)
+        if current is not None:
+            yield current, result(state)
+
+    def buckets(self, lines):
+        """Generate (start, state) for each bucket, where state holds the
+        column states, which can be merged with :py:meth:`merge`."""
+        interval = self.interval
+        lateness = -(-self.lateness // interval)    # in buckets, rounded up
+        columns = list(enumerate(self.columns))
+        group_by = self.group_by
+        new = self.new
+
+        self.open_buckets = open_buckets = {}
+        emitted = None      # the last bucket output
+        newest = None       # the latest bucket seen
+
+        # Lines in the same second share a date string, so only convert it
+        # to a timestamp when it changes
+        last_date = None
+        b = None
+        state = None
+        for l in lines:
+            date = l.date
+            if date is not last_date and date != last_date:
+                last_date = date
+                secs = int(l.time())
+                if secs > self.latest:
+                    self.latest = secs
+                t = secs // interval
+                if t != b:
+                    b = t
+                    if emitted is not None and b <= emitted:
+                        state = None
+                    else:
+                        try:
+                            state = open_buckets[b]
+                        except KeyError:
+                            state = open_buckets[b] = new() if group_by is None else {}
+                        if newest is None or b > newest:
+                            newest = b
+                            for item in self.flush(open_buckets, emitted, newest - lateness):
+                                emitted = item[0] // interval
+                                yield item
+
+            if state is None:
+                self.late += 1
+                continue
+
+            if group_by is None:
+                s = state
+            else:
+                key = group_by(l)
+                try:
+                    s = state[key]
+                except KeyError:
+                    s = state[key] = new()
+            for i, c in columns:
+                s[i] = c.add(s[i], l)
+
+        for item in self.flush(open_buckets, emitted, None):
+            yield item
+
+    def flush(self, open_buckets, emitted, before):
+        """Generate the output for buckets before the bucket before (or all
+        buckets if before is None), filling gaps since emitted."""
+        ready = sorted(k for k in open_buckets if before is None or k < before)
+        interval = self.interval
+        for k in ready:
+            if self.fill_gaps and emitted is not None:
+                for gap in xrange(emitted + 1, k):
+                    yield gap * interval, self.empty()
+            yield k * interval, open_buckets.pop(k)
+            emitted = k
@@ -0,0 +1,223 @@
+# loglab - A library for stream-based log processing
+# Copyright (c) 2010 Crown copyright
+#
+# This file is part of loglab.
+#
+# loglab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# loglab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with loglab.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Filtering of lines against large lists of IP addresses, paths or user
+agents, such as lists of monitoring probes or known bots."""
+
+import re
+import socket
+import struct
+from bisect import bisect_right
+
+from .lineformats import LogLine
+from .filters import Filter
+from .query import Projection
+
+__all__ = (
+    'IPSet', 'StringSet', 'BlocklistFilter', 'read_list'
+)
+
+
+def read_list(fname):
+    """Read a list of entries from a file, one per line, ignoring blank
+    lines and comments starting with '#'."""
+    entries = []
+    f = open(fname)
+    try:
+        for l in f:
+            l = l.split('#', 1)[0].strip()
+            if l:
+                entries.append(l)
+    finally:
+        f.close()
+    return entries
+
+
+def ip_to_int(ip):
+    """Convert a dotted-quad IPv4 address to an integer."""
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+
+class IPSet(object):
+    """A set of IPv4 addresses and CIDR ranges.
+
+    The entries are compiled into a sorted list of non-overlapping ranges of
+    addresses, so that testing membership is a binary search, taking
+    O(log n) time however many entries there are.
+    """
+    def __init__(self, entries=()):
+        ranges = []
+        for e in entries:
+            if '/' in e:
+                net, bits = e.split('/', 1)
+                bits = int(bits)
+                if not 0 <= bits <= 32:
+                    raise ValueError("Invalid CIDR range %r" % e)
+                size = 1 << (32 - bits)
+                start = ip_to_int(net) & ~(size - 1) & 0xffffffff
+                ranges.append((start, start + size - 1))
+            else:
+                n = ip_to_int(e)
+                ranges.append((n, n))
+
+        # merge overlapping and adjacent ranges
+        ranges.sort()
+        starts = []
+        ends = []
+        for start, end in ranges:
+            if ends and start <= ends[-1] + 1:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self):
+        """Return the number of ranges."""
+        return len(self.starts)
+
+    def __contains__(self, ip):
+        if not isinstance(ip, (int, long)):
+            try:
+                ip = ip_to_int(ip)
+            except (socket.error, TypeError):
+                return False
+        i = bisect_right(self.starts, ip) - 1
+        return i >= 0 and ip <= self.ends[i]
+
+
+def trie_pattern(strings):
+    """Return a regular expression pattern matching any of strings.
+
+    The strings are arranged in a trie so that the regular expression engine
+    never tests more than one alternative for each character. Strings that
+    have another of the strings as a prefix are omitted, as the shorter
+    string matches wherever they would.
+    """
+    trie = {}
+    for s in sorted(strings, key=len):
+        node = trie
+        for c in s:
+            if '' in node:
+                break
+            node = node.setdefault(c, {})
+        else:
+            node.clear()
+            node[''] = True
+
+    def emit(node):
+        if '' in node:
+            return ''
+        alts = [re.escape(c) + emit(child) for c, child in sorted(node.items())]
+        if len(alts) == 1:
+            return alts[0]
+        return '(?:%s)' % '|'.join(alts)
+    return emit(trie)
+
+
+class StringSet(object):
+    """A set of strings, matched against values in one of three modes:
+    'exact', 'prefix' (values starting with any of the strings) or
+    'substring' (values containing any of the strings).
+
+    Prefix and substring sets are compiled into a single regular expression.
+    """
+    def __init__(self, strings=(), mode='exact'):
+        strings = [s for s in strings if s]
+        self.mode = mode
+        if mode == 'exact':
+            self.strings = frozenset(strings)
+            self.match = self.strings.__contains__
+        elif mode in ('prefix', 'substring'):
+            if strings:
+                pattern = re.compile(trie_pattern(strings))
+                search = pattern.match if mode == 'prefix' else pattern.search
+                self.match = lambda v: search(v) is not None
+            else:
+                self.match = lambda v: False
+        else:
+            raise ValueError("Unknown mode %r" % mode)
+
+    def __contains__(self, value):
+        return self.match(value)
+
+
+class BlocklistFilter(Filter):
+    """Filter out lines from blocklisted clients, paths or user agents.
+
+    ips is an :py:class:`IPSet` (or list of addresses and CIDR ranges)
+    checked against the ip and x_forwarded_for fields. paths and uas are
+    :py:class:`StringSet` instances (or lists of path prefixes and user
+    agent substrings) checked against the req and ua fields.
+
+    If exclude is False, the filter instead keeps only the lines that match
+    the blocklist.
+    """
+    stateless = True
+
+    def __init__(self, iterable, ips=None, paths=None, uas=None, exclude=True, line_class=LogLine):
+        super(BlocklistFilter, self).__init__(iterable)
+        if ips is not None and not isinstance(ips, IPSet):
+            ips = IPSet(ips)
+        if paths is not None and not isinstance(paths, StringSet):
+            paths = StringSet(paths, 'prefix')
+        if uas is not None and not isinstance(uas, StringSet):
+            uas = StringSet(uas, 'substring')
+        self.ips = ips
+        self.paths = paths
+        self.uas = uas
+        self.exclude = exclude
+
+        fields = set()
+        if ips is not None:
+            fields.update(['ip', 'x_forwarded_for'])
+        if paths is not None:
+            fields.add('req')
+        if uas is not None:
+            fields.add('ua')
+        self.projection = Projection(line_class, fields)
+
+    def fields(self, line):
+        """Return a dictionary of the fields tested, parsing as little of the
+        line as possible."""
+        if line._parsed is None:
+            mo = self.projection.match(line.line)
+            if mo is not None:
+                return mo.groupdict()
+        return line._parsed or line._full_parse()
+
+    def matches(self, line):
+        """Return True if line matches the blocklist."""
+        fields = self.fields(line)
+        if self.ips is not None:
+            if fields.get('ip') in self.ips:
+                return True
+            xff = fields.get('x_forwarded_for')
+            if xff:
+                for ip in xff.split(','):
+                    if ip.strip() in self.ips:
+                        return True
+        if self.paths is not None and (fields.get('req') or '') in self.paths:
+            return True
+        if self.uas is not None and (fields.get('ua') or '') in self.uas:
+            return True
+        return False
+
+    def accept(self, line):
+        return self.matches(line) != self.exclude
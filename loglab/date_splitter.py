@@ -16,50 +16,271 @@
 # You should have received a copy of the GNU General Public License
 # along with loglab.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import gzip
+import time
 import datetime
+from collections import OrderedDict
 
-class LogSplitter(object):
-    """Date-based splitting and compressing of logs.
+from . import subproc_gzip, threaded_gzip
 
-    LogSplitter will read all input lines and write each lines to a file named
-    according to out_template, which should be in the format of Python's
-    `strftime
-    <http://docs.python.org/2/library/datetime.html#strftime-strptime-behavior>`_.
 
-    This will overwrite any logs files that already exist.
+# Functions to open gzip files for writing, keyed by compressor name
+COMPRESSORS = {
+    'gzip': gzip.GzipFile,
+    'threaded': threaded_gzip.open,
+    'subproc': subproc_gzip.open,
+}
+
+ONE_DAY = datetime.timedelta(days=1)
+ONE_HOUR = datetime.timedelta(hours=1)
+
+# Default number of bytes to buffer for each output file between writes
+FLUSH_SIZE = 256 * 1024
+
+
+class BufferedOutput(object):
+    """Collects lines destined for one file and writes them in large blocks.
+
+    Lines are written to the file when at least flush_size bytes have been
+    collected, and when the output is flushed or closed.
+    """
+    def __init__(self, f, flush_size=FLUSH_SIZE):
+        self.f = f
+        self.flush_size = flush_size
+        self.lines = []
+        self.size = 0
+
+    def write_line(self, line):
+        """Write a line, which should not include a trailing newline."""
+        self.lines.append(line)
+        self.size += len(line) + 1
+        if self.size >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            self.lines.append('')
+            self.f.write('\n'.join(self.lines))
+            self.lines = []
+            self.size = 0
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.f.close()
+
+
+class Partitioner(object):
+    """Partition key function that groups lines by time period and fields.
+
+    period may be 'day', 'hour' or None, and fields is a sequence of names of
+    log line fields (such as 'bucket' or 'code'). Calling a Partitioner with
+    a log line returns a key (when, fields) where when is the start of the
+    line's period (a date for 'day', a datetime for 'hour', otherwise None) and
+    fields is a tuple of (name, value) pairs.
+
+    Custom partition functions may be used with :py:class:`PartitionedWriter`
+    as long as they return keys of the same form.
+    """
+    def __init__(self, period='day', fields=()):
+        if period not in ('day', 'hour', None):
+            raise ValueError("Unknown period %r" % period)
+        self.period = period
+        self.fields = tuple(fields)
+
+        # Lines usually arrive in time order, so the range of timestamps
+        # covered by the current period is remembered to avoid recalculating
+        # the period for every line
+        self.start = self.end = 0
+        self.when = None
+        if period is None:
+            self.start = float('-inf')
+            self.end = float('inf')
+        self.key = (None, ())
+
+    def set_period(self, t):
+        """Update the current period to the one containing timestamp t."""
+        if self.period == 'day':
+            when = datetime.date.fromtimestamp(t)
+            next = when + ONE_DAY
+        else:
+            when = datetime.datetime.fromtimestamp(t).replace(minute=0, second=0, microsecond=0)
+            next = when + ONE_HOUR
+        self.start = time.mktime(when.timetuple())
+        self.end = time.mktime(next.timetuple())
+        self.when = when
+        self.key = (when, ())
+
+    def __call__(self, line):
+        if self.period is not None:
+            t = line.time()
+            if not self.start <= t < self.end:
+                self.set_period(t)
+        if self.fields:
+            return self.when, tuple([(f, getattr(line, f)) for f in self.fields])
+        return self.key
+
+
+def safe_field(v):
+    """Return a field value made safe to use as part of a file name."""
+    v = str(v).replace('/', '_')
+    if v.startswith('.'):
+        v = '_' + v[1:]
+    return v or '-'
+
+
+class PartitionedWriter(object):
+    """Splitting and compressing of logs into partitions.
+
+    PartitionedWriter reads all input lines and writes each line to a file
+    chosen by its partition key, as calculated by the partition function
+    (by default a :py:class:`Partitioner` that partitions by date).
+
+    Files are named according to out_template. The time part of the
+    partition key is substituted using Python's `strftime
+    <http://docs.python.org/2/library/datetime.html#strftime-strptime-behavior>`_
+    and then field values are substituted for named fields in braces, in the
+    format of Python's ``str.format()``. For example, a template of
+    ``/srv/logs/{bucket}/%Y-%m-%d-%H.gz`` could be used with
+    ``Partitioner('hour', ['bucket'])``. Any slashes in field values are
+    replaced with underscores, as is a leading dot, so that values such as
+    '..' cannot name files outside the output directory.
+
+    Files are written under a temporary name, and only renamed into place
+    once all input has been processed, so that a partial run never leaves
+    partial files visible. If the split fails, the temporary files are
+    removed. This will overwrite any logs files that already exist.
 
     If out_template ends with '.gz' the logs will be gzip-compressed.
+
+    At most max_open output files are held open at once. When a line arrives
+    for a partition whose file is not open, the least recently used file is
+    closed to make room. If later lines arrive for a partition that has been
+    closed, its file is reopened in append mode; for gzip output this starts
+    a new gzip member, which gzip readers treat as a continuation of the same
+    stream.
+
+    compressor selects how gzip output is compressed: 'threaded' (the
+    default) compresses blocks in a pool of threads using
+    :py:mod:`loglab.threaded_gzip`, 'subproc' pipes each file through a gzip
+    process using :py:mod:`loglab.subproc_gzip` and 'gzip' uses Python's
+    gzip module in the calling thread.
+
+    Lines for each file are buffered and written in blocks of flush_size
+    bytes.
     """
 
-    def __init__(self, out_template):
-        """Construct a log splitter for splitting logs into files
-        matching out_template, which is interpreter in strftime format.
+    def __init__(self, out_template, partition=None, max_open=32, compressor='threaded', flush_size=FLUSH_SIZE):
+        """Construct a writer for splitting logs into files matching
+        out_template.
         """
         self.out_template = out_template
+        if partition is None:
+            partition = Partitioner()
+        self.partition = partition
+        if max_open < 1:
+            raise ValueError("max_open must be at least 1")
+        self.max_open = max_open
+        try:
+            self.gzip_open = COMPRESSORS[compressor]
+        except KeyError:
+            raise ValueError("Unknown compressor %r" % compressor)
+        self.flush_size = flush_size
+
+    def filename(self, key):
+        """Return the name of the file that lines with partition key key
+        are written to.
+        """
+        when, fields = key
+        fname = self.out_template
+        if when is not None:
+            fname = when.strftime(fname)
+        if fields:
+            values = dict((k, safe_field(v)) for k, v in fields)
+            fname = fname.format(**values)
+        return fname
 
-    def open_file(self, date):
+    def open_file(self, fname, append=False):
+        mode = 'a' if append else 'w'
+        dirname = os.path.dirname(fname)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
         if self.out_template.endswith('.gz'):
-            return gzip.GzipFile(date.strftime(self.out_template), 'w')
+            return self.gzip_open(fname, mode + 'b')
         else:
-            return open(date.strftime(self.out_template), 'w')
+            return open(fname, mode)
 
     def split(self, lines):
-        """Split a sequence of lines among log files by date.
+        """Split a sequence of lines among log files by partition.
 
         This should only be called once; subsequent calls may overwrite files.
 
+        Returns the names of the files written.
+
         """
-        logs = {} # mapping of date -> open file handle
-        for l in lines:
-            d = datetime.date.fromtimestamp(l.time())
+        partition = self.partition
+        logs = OrderedDict() # mapping of key -> BufferedOutput, LRU first
+        tmpnames = {} # mapping of key -> temporary file name for this run
+        last = None
+        try:
             try:
-                log = logs[d]
-            except KeyError:
-                log = self.open_file(d)
-                logs[d] = log
+                for l in lines:
+                    key = partition(l)
+                    # Consecutive lines usually share a key, in which case the
+                    # file is already the most recently used and the LRU
+                    # order need not be touched
+                    if key is not last and key != last:
+                        try:
+                            log = logs.pop(key)
+                        except KeyError:
+                            if len(logs) >= self.max_open:
+                                oldest, f = logs.popitem(last=False)
+                                f.close()
+                            append = key in tmpnames
+                            if not append:
+                                tmpnames[key] = self.filename(key) + '.tmp'
+                            log = BufferedOutput(self.open_file(tmpnames[key], append=append), self.flush_size)
+                        logs[key] = log
+                        write = log.write_line
+                        last = key
+
+                    # LogLine.line only rebuilds the line if a field was modified
+                    write(l.line)
+            finally:
+                while logs:
+                    logs.popitem()[1].close()
+        except:
+            for tmpname in tmpnames.values():
+                try:
+                    os.unlink(tmpname)
+                except OSError:
+                    pass
+            raise
 
-            log.write(str(l) + '\n')
+        written = []
+        for tmpname in tmpnames.values():
+            fname = tmpname[:-len('.tmp')]
+            os.rename(tmpname, fname)
+            written.append(fname)
+        return written
 
-        for log in logs.values():
-            log.close()
+
+class LogSplitter(PartitionedWriter):
+    """Date-based splitting and compressing of logs.
+
+    LogSplitter will read all input lines and write each lines to a file named
+    according to out_template, which should be in the format of Python's
+    `strftime
+    <http://docs.python.org/2/library/datetime.html#strftime-strptime-behavior>`_.
+
+    This is a :py:class:`PartitionedWriter` that partitions by date; it takes
+    the same keyword arguments.
+    """
+
+    def __init__(self, out_template, **kwargs):
+        """Construct a log splitter for splitting logs into files
+        matching out_template, which is interpreter in strftime format.
+        """
+        super(LogSplitter, self).__init__(out_template, Partitioner('day'), **kwargs)
@@ -0,0 +1,246 @@
+# loglab - A library for stream-based log processing
+# Copyright (c) 2010 Crown copyright
+#
+# This file is part of loglab.
+#
+# loglab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# loglab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with loglab.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Detect when a site goes down and comes back up from its access logs.
+
+Detectors consume a log and generate ('up', t) and ('down', t) transitions
+from transitions(); scan() instead calls the on_up() and on_down() methods,
+which subclasses can override.
+
+Each request is classified as showing the server up or down by its status
+code: 5xx responses count as down, client errors are ignored, and anything
+else counts as up.
+"""
+
+from collections import deque
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = (
+    'UnknownStatus', 'check_line', 'DowntimeDetector',
+    'WindowedDowntimeDetector', 'TimeWindowDowntimeDetector',
+    'detect_windowed', 'backfill',
+)
+
+
+class UnknownStatus(Exception):
+    """The state of the server could not be detected from the log line."""
+
+
+def check_line(l):
+    """Return True if the log line shows the server up, False if it shows it
+    down, or raise UnknownStatus."""
+    if len(l.code) != 3:
+        raise UnknownStatus("Invalid HTTP response code")
+    if l.code.startswith('4'):
+        raise UnknownStatus("Client error - cannot detect server state")
+    return not l.code.startswith('5')
+
+
+class DowntimeDetector(object):
+    """Considers the site down if more than timeout seconds pass without a
+    successful request."""
+    def __init__(self, iterable, timeout=45):
+        self.iterable = iterable
+        self.timeout = timeout
+
+    def on_up(self, time):
+        """Handle detection of the site being up as of time in seconds since epoch"""
+
+    def on_down(self, time):
+        """Handle detection of the site being down as of time in seconds since epoch"""
+
+    def check_line(self, l):
+        return check_line(l)
+
+    def scan(self):
+        """Scan the log, calling on_up() and on_down() at each transition."""
+        for state, t in self.transitions():
+            if state == 'up':
+                self.on_up(t)
+            else:
+                self.on_down(t)
+
+    def transitions(self):
+        isup = True
+        lasthit = None
+        timeout = self.timeout
+        for l in self.iterable:
+            t = l.time()
+            if lasthit and (t - lasthit) > timeout:
+                if isup:
+                    yield 'down', lasthit
+                    isup = False
+
+            try:
+                up = self.check_line(l)
+            except UnknownStatus:
+                continue
+
+            if up:
+                if not isup:
+                    yield 'up', t
+                    isup = True
+                lasthit = t
+
+
+class WindowedDowntimeDetector(DowntimeDetector):
+    """Considers the site up while more than threshold of the last
+    window_size requests show it up.
+
+    The window is a ring buffer with a running count, so each request costs
+    the same however large the window.
+    """
+    def __init__(self, iterable, window_size=50, threshold=30):
+        if window_size <= 0:
+            raise ValueError("window_size must be positive")
+        self.iterable = iterable
+        self.window_size = window_size
+        self.threshold = threshold
+
+    def classified(self):
+        check_line = self.check_line
+        for l in self.iterable:
+            try:
+                yield check_line(l), l
+            except UnknownStatus:
+                continue
+
+    def transitions(self):
+        for state, l in ring_transitions(self.classified(), self.window_size, self.threshold):
+            yield state, l.time()
+
+
+class TimeWindowDowntimeDetector(DowntimeDetector):
+    """Considers the site up while more than a fraction threshold of the
+    requests in the last window seconds show it up.
+
+    Unlike a window of a fixed number of requests, this responds as quickly
+    at quiet times as at busy ones.
+    """
+    def __init__(self, iterable, window=60, threshold=0.6):
+        if window <= 0:
+            raise ValueError("window must be positive")
+        self.iterable = iterable
+        self.window = window
+        self.threshold = threshold
+
+    def transitions(self):
+        window = self.window
+        threshold = self.threshold
+        check_line = self.check_line
+
+        requests = deque()
+        ups = 0
+        isup = True
+        for l in self.iterable:
+            try:
+                s = check_line(l)
+            except UnknownStatus:
+                continue
+
+            t = l.time()
+            requests.append((t, s))
+            if s:
+                ups += 1
+
+            cutoff = t - window
+            while requests[0][0] <= cutoff:
+                old_t, old_s = requests.popleft()
+                if old_s:
+                    ups -= 1
+
+            up = ups > threshold * len(requests)
+            if up != isup:
+                yield ('up' if up else 'down'), t
+                isup = up
+
+
+def detect_windowed(times, statuses, window_size=50, threshold=30):
+    """Return the transitions found by :py:class:`WindowedDowntimeDetector`
+    in a whole sequence of requests at once.
+
+    times and statuses are sequences of the time of each request and whether
+    it showed the site up. With numpy, the window counts are computed as
+    differences of a cumulative sum over the whole sequence; without it,
+    the same ring buffer as the streaming detector is used.
+    """
+    if numpy is None:
+        items = ((bool(s), t) for t, s in zip(times, statuses))
+        return list(ring_transitions(items, window_size, threshold))
+
+    statuses = numpy.asarray(statuses, dtype=numpy.int64)
+    if not len(statuses):
+        return []
+    # The window starts full of successful requests
+    padded = numpy.concatenate([numpy.ones(window_size, dtype=numpy.int64), statuses])
+    counts = numpy.concatenate([[0], numpy.cumsum(padded)])
+    ups = counts[window_size + 1:] - counts[1:-window_size]
+    up = ups > threshold
+    previous = numpy.concatenate([[True], up[:-1]])
+    times = numpy.asarray(times)
+    return [
+        ('up' if up[i] else 'down', float(times[i]))
+        for i in numpy.flatnonzero(up != previous)
+    ]
+
+
+def ring_transitions(items, window_size, threshold):
+    """Generate (state, x) at each transition, for (status, x) items, using a
+    ring buffer of the last window_size statuses with a running count of
+    those that are up."""
+    n = window_size
+    # The window starts full of successful requests
+    window = [True] * n
+    ups = n
+    i = 0
+    isup = True
+    for s, x in items:
+        if s != window[i]:
+            if s:
+                ups += 1
+            else:
+                ups -= 1
+            window[i] = s
+        i += 1
+        if i == n:
+            i = 0
+
+        up = ups > threshold
+        if up != isup:
+            yield ('up' if up else 'down'), x
+            isup = up
+
+
+def backfill(lines, window_size=50, threshold=30):
+    """Return the transitions in a historical log as for
+    :py:class:`WindowedDowntimeDetector`, classifying all of the lines
+    before detecting transitions with :py:func:`detect_windowed`."""
+    times = []
+    statuses = []
+    for l in lines:
+        try:
+            s = check_line(l)
+        except UnknownStatus:
+            continue
+        times.append(l.time())
+        statuses.append(s)
+    return detect_windowed(times, statuses, window_size, threshold)
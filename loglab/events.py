@@ -0,0 +1,371 @@
+# loglab - A library for stream-based log processing
+# Copyright (c) 2010 Crown copyright
+#
+# This file is part of loglab.
+#
+# loglab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# loglab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with loglab.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Event-driven, push-based pipelines.
+
+The rest of loglab pulls lines through pipelines of iterators, which
+blocks while a live log is idle. Here a single-threaded
+:py:class:`EventLoop` waits on any number of tailed logs, timers and
+sockets at once, and pushes lines into targets as they arrive.
+
+A target is any object with send() and close() methods, such as a
+generator-based coroutine. Coroutines for filtering and parsing are
+provided here; :py:func:`feed` pushes a pull-based iterable into a target,
+and a :py:class:`Channel` collects pushed lines so that an ordinary
+pull-based pipeline can consume them while driving the loop.
+"""
+
+import time
+import heapq
+import errno
+import select
+from collections import deque
+
+from .lineformats import LogLine, LogLineParseError
+
+__all__ = (
+    'EventLoop', 'TailReader', 'Channel', 'coroutine', 'feed',
+    'filter_lines', 'parse_lines', 'broadcast',
+)
+
+
+def fileno(f):
+    if isinstance(f, (int, long)):
+        return f
+    return f.fileno()
+
+
+class Timer(object):
+    """A callback scheduled on an EventLoop."""
+    def __init__(self, when, callback, args, interval=None):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.interval = interval
+        self.cancelled = False
+        self.loop = None        # the loop whose heap holds this timer
+
+    def cancel(self):
+        if self.cancelled:
+            return
+        self.cancelled = True
+        if self.loop is not None:
+            self.loop.timer_cancelled()
+
+
+class EventLoop(object):
+    """Waits for file descriptors to become readable or writable and for
+    timers to expire, calling their callbacks.
+    """
+    def __init__(self):
+        self.readers = {}
+        self.writers = {}
+        self.timers = []
+        self.cancelled = 0      # cancelled timers still in the heap
+        self.seq = 0
+        self.running = False
+
+    def add_reader(self, f, callback, *args):
+        """Call callback(*args) whenever f, a file descriptor or an object
+        with a fileno() method, is readable."""
+        self.readers[fileno(f)] = (callback, args)
+
+    def remove_reader(self, f):
+        self.readers.pop(fileno(f), None)
+
+    def add_writer(self, f, callback, *args):
+        """Call callback(*args) whenever f is writable."""
+        self.writers[fileno(f)] = (callback, args)
+
+    def remove_writer(self, f):
+        self.writers.pop(fileno(f), None)
+
+    def schedule(self, timer):
+        self.seq += 1
+        timer.loop = self
+        heapq.heappush(self.timers, (timer.when, self.seq, timer))
+        return timer
+
+    def timer_cancelled(self):
+        # Cancelled timers are left in the heap until they are due; if they
+        # come to dominate it, as when timers are frequently rescheduled,
+        # rebuild the heap without them
+        self.cancelled += 1
+        if self.cancelled > 64 and self.cancelled * 2 > len(self.timers):
+            self.timers = [t for t in self.timers if not t[2].cancelled]
+            heapq.heapify(self.timers)
+            self.cancelled = 0
+
+    def pop_timer(self):
+        when, seq, timer = heapq.heappop(self.timers)
+        timer.loop = None
+        if timer.cancelled:
+            self.cancelled -= 1
+        return timer
+
+    def call_later(self, delay, callback, *args):
+        """Call callback(*args) after delay seconds. Returns a Timer that can
+        be cancelled."""
+        return self.schedule(Timer(time.time() + delay, callback, args))
+
+    def call_every(self, interval, callback, *args):
+        """Call callback(*args) every interval seconds. Returns a Timer that
+        can be cancelled."""
+        return self.schedule(Timer(time.time() + interval, callback, args, interval))
+
+    def pending(self):
+        """Return True if there are readers, writers or timers to wait for."""
+        return bool(self.readers or self.writers) or len(self.timers) > self.cancelled
+
+    def run_once(self, timeout=None):
+        """Wait for and dispatch one round of events.
+
+        Waits for at most timeout seconds, or until the next timer is due.
+        """
+        while self.timers and self.timers[0][2].cancelled:
+            self.pop_timer()
+        timers = self.timers
+        if timers:
+            delay = max(timers[0][0] - time.time(), 0)
+            if timeout is None or delay < timeout:
+                timeout = delay
+
+        if self.readers or self.writers:
+            try:
+                if timeout is None:
+                    r, w, x = select.select(self.readers.keys(), self.writers.keys(), [])
+                else:
+                    r, w, x = select.select(self.readers.keys(), self.writers.keys(), [], timeout)
+            except select.error, e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                r = w = []
+            for fds, callbacks in ((r, self.readers), (w, self.writers)):
+                for fd in fds:
+                    try:
+                        callback, args = callbacks[fd]
+                    except KeyError:
+                        # Removed by an earlier callback
+                        continue
+                    callback(*args)
+        elif timeout:
+            time.sleep(timeout)
+
+        now = time.time()
+        while self.timers and self.timers[0][0] <= now:
+            timer = self.pop_timer()
+            if timer.cancelled:
+                continue
+            if timer.interval:
+                timer.when += timer.interval
+                self.schedule(timer)
+            timer.callback(*timer.args)
+
+    def run(self):
+        """Dispatch events until stop() is called or there is nothing left
+        to wait for."""
+        self.running = True
+        while self.running and self.pending():
+            self.run_once()
+
+    def stop(self):
+        self.running = False
+
+
+class TailReader(object):
+    """Pushes lines from a :py:class:`~loglab.tail.TailSource` or
+    :py:class:`~loglab.tail.MultiTailSource` into target as they are written.
+
+    Logs are watched with inotify where it is available, and polled at
+    their poll interval otherwise.
+    """
+    def __init__(self, loop, tail, target):
+        self.loop = loop
+        self.tail = tail
+        self.target = target
+        self.timers = []
+        self.deadline = None    # the timer for the next deadline
+        self.due = None         # when buffered lines are next due
+
+        tails = getattr(tail, 'tails', [tail])
+        self.watched = [t.inotify for t in tails if t.inotify]
+        for ino in self.watched:
+            loop.add_reader(ino, self.notified, ino)
+        polled = [t.poll_interval for t in tails if not t.inotify]
+        if polled:
+            self.timers.append(loop.call_every(min(polled), self.read))
+        self.timers.append(loop.call_later(0, self.read))
+
+    def notified(self, ino):
+        ino.read_events()
+        self.read()
+
+    def read(self):
+        send = self.target.send
+        for l in self.tail.read_lines():
+            send(l)
+
+        # A MultiTailSource may release buffered lines without new input
+        next_deadline = getattr(self.tail, 'next_deadline', None)
+        if next_deadline:
+            now = time.time()
+            delay = next_deadline(now)
+            if delay is None:
+                self.due = None
+            else:
+                self.set_deadline(now + delay)
+
+    def set_deadline(self, when):
+        """Read again at when.
+
+        A single timer is kept for the deadline. If it is already due no
+        later than when, it is left alone and rescheduled once it fires, so
+        that a busy log does not fill the loop with cancelled timers.
+        """
+        self.due = when
+        timer = self.deadline
+        if timer is not None and not timer.cancelled:
+            if timer.when <= when:
+                return
+            timer.cancel()
+        self.deadline = self.loop.call_later(max(when - time.time(), 0), self.deadline_expired)
+
+    def deadline_expired(self):
+        self.deadline = None
+        due = self.due
+        if due is None:
+            return
+        if due > time.time():
+            self.set_deadline(due)
+        else:
+            self.read()
+
+    def close(self):
+        """Stop reading, close the tail and close the target, after sending
+        any lines still buffered."""
+        for ino in self.watched:
+            self.loop.remove_reader(ino)
+        for t in self.timers + [self.deadline]:
+            if t:
+                t.cancel()
+        flush = getattr(self.tail, 'flush', None)
+        if flush:
+            for l in flush():
+                self.target.send(l)
+        self.tail.close()
+        self.target.close()
+
+
+class Channel(object):
+    """A target that collects the lines pushed into it, so that they can be
+    consumed by iterating over the channel.
+
+    Iteration runs the loop whenever the channel is empty, so a pull-based
+    pipeline built on a Channel drives the event loop itself. Iteration ends
+    once the channel is closed and empty, or there is nothing left for the
+    loop to wait for.
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self.items = deque()
+        self.closed = False
+
+    def send(self, item):
+        self.items.append(item)
+
+    def close(self):
+        self.closed = True
+
+    def __iter__(self):
+        items = self.items
+        loop = self.loop
+        while True:
+            while items:
+                yield items.popleft()
+            if self.closed or not loop.pending():
+                return
+            loop.run_once()
+
+
+def coroutine(func):
+    """Decorator that starts a generator-based coroutine, so that it is
+    ready to be sent values."""
+    def start(*args, **kwargs):
+        cr = func(*args, **kwargs)
+        cr.next()
+        return cr
+    start.__name__ = func.__name__
+    start.__doc__ = func.__doc__
+    return start
+
+
+def feed(iterable, target, close=True):
+    """Push every item of a pull-based iterable into target."""
+    send = target.send
+    for item in iterable:
+        send(item)
+    if close:
+        target.close()
+
+
+@coroutine
+def filter_lines(accept, target):
+    """Send on the lines for which accept(line) is true.
+
+    accept may be a predicate, or the accept method of a
+    :py:class:`~loglab.filters.Filter`, query or sampler.
+    """
+    try:
+        while True:
+            line = (yield)
+            if accept(line):
+                target.send(line)
+    except GeneratorExit:
+        target.close()
+
+
+@coroutine
+def parse_lines(target, line_class=LogLine, ignore_invalid=True):
+    """Parse raw lines with line_class and send on the resulting LogLines."""
+    i = 0
+    try:
+        while True:
+            l = (yield)
+            i += 1
+            try:
+                line = line_class(l, line_number=i)
+            except LogLineParseError:
+                if not ignore_invalid:
+                    raise
+                continue
+            target.send(line)
+    except GeneratorExit:
+        target.close()
+
+
+@coroutine
+def broadcast(*targets):
+    """Send every line to each of targets."""
+    try:
+        while True:
+            line = (yield)
+            for t in targets:
+                t.send(line)
+    except GeneratorExit:
+        for t in targets:
+            t.close()
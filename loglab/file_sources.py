@@ -1,35 +1,83 @@
 import loglab.subproc_gzip as gzip
 
-from .sources import OrderedSource
+from .sources import OrderedSource, close_source
 from .lineformats import LogLine
 from .filters import DateFilter
+from .prefilters import PreFilter
+from .prefetch import Prefetch
 
 __all__ = (
     'GZipLogFile', 'DayLogFile', 'LogFile'
 )
 
 
+def prefiltered(f, prefilter):
+    """Wrap file f in a PreFilter if any prefilter predicates are given."""
+    if prefilter:
+        return PreFilter(f, prefilter)
+    return f
+
+
+def prefetched(f, prefetch):
+    """Wrap f in a Prefetch if prefetch is true."""
+    if prefetch:
+        return Prefetch(f)
+    return f
+
+
 class GZipLogFile(object):
-    """Wrapper to construct a LogBuffer from a gzipped file."""
-    def __init__(self, filename, window_size=1000, line_class=LogLine, ignore_invalid=True):
+    """Wrapper to construct a LogBuffer from a gzipped file.
+
+    If prefilter is given, it is a predicate or list of predicates with which
+    to filter the raw lines before they are parsed, as for
+    :py:class:`~loglab.prefilters.PreFilter`.
+
+    If prefetch is True, raw lines are read ahead in a background thread
+    with :py:class:`~loglab.prefetch.Prefetch`.
+    """
+    def __init__(self, filename, window_size=1000, line_class=LogLine, ignore_invalid=True, prefilter=None, prefetch=False):
         self.filename = filename
         self.window_size = window_size
         self.line_class = line_class
         self.ignore_invalid = ignore_invalid
+        self.prefilter = prefilter
+        self.prefetch = prefetch
+        self.reader = None
+        self.ordered = None
+
+    @property
+    def invalid(self):
+        """The number of lines that could not be parsed so far."""
+        if self.ordered is None:
+            return 0
+        return self.ordered.invalid
+
+    @property
+    def buffer(self):
+        """The LogBuffer sorting the lines, once iteration has started."""
+        if self.ordered is None:
+            return None
+        return self.ordered.buffer
 
     def open_file(self):
         self.file = gzip.open(self.filename)
         return self.file
 
     def close(self):
+        if self.reader is not None:
+            # Stop any background thread before closing the file under it
+            close_source(self.reader)
         try:
-            self.file.close()
+            f = self.file
         except AttributeError:
-            pass
+            return
+        if not f.closed:
+            f.close()
 
     def __iter__(self):
-        f = self.open_file()
-        return iter(OrderedSource(f, window_size=self.window_size, line_class=self.line_class, ignore_invalid=self.ignore_invalid))
+        self.reader = prefetched(prefiltered(self.open_file(), self.prefilter), self.prefetch)
+        self.ordered = OrderedSource(self.reader, window_size=self.window_size, line_class=self.line_class, ignore_invalid=self.ignore_invalid)
+        return iter(self.ordered)
 
 
 class DayLogFile(object):
@@ -45,8 +93,9 @@ class DayLogFile(object):
 
 class LogFile(OrderedSource):
     def __init__(self, fname, window_size=1000,
-            line_class=LogLine, ignore_invalid=True):
+            line_class=LogLine, ignore_invalid=True, prefilter=None, prefetch=False):
         super(LogFile, self).__init__(
-            open(fname), window_size, line_class, ignore_invalid
+            prefetched(prefiltered(open(fname), prefilter), prefetch),
+            window_size, line_class, ignore_invalid
         )
 
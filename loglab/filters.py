@@ -1,11 +1,21 @@
 import time
 
 from .lineformats import LogLineParseError
+from .sources import close_source
+
+
+def filter_source(f):
+    """Return the iterable that the filter f reads from.
+
+    Filters that do not call Filter.__init__ may only set iterable.
+    """
+    return getattr(f, 'source', getattr(f, 'iterable', None))
 
 
 class Filter(object):
     """Base class for log filters"""
     def __init__(self, iterable):
+        self.source = iterable
         self.iterable = iter(iterable)
 
     def __iter__(self):
@@ -17,10 +27,30 @@ class Filter(object):
         """Returns True if a log line should be accepted"""
         raise NotImplementedError("Subclasses must implement this method")
 
+    def close(self):
+        """Close the sources feeding this filter."""
+        close_source(filter_source(self))
+
+    #: True if accept() depends only on the line it is given, so that the
+    #: filter gives the same result whichever lines it sees and in whatever
+    #: order it is asked. Subclasses opt in to being fused by setting this.
+    stateless = False
+
+    @property
+    def fusable(self):
+        """True if this filter is stateless and its behaviour is defined
+        entirely by accept(), allowing it to be combined with others by
+        :py:func:`fuse_filters`.
+        """
+        return self.stateless and type(self).__iter__ == Filter.__iter__
+
 
 class DateFilter(Filter):
     """Filter to include only log lines whose date matches the given date."""
+    stateless = True
+
     def __init__(self, iterable, date):
+        self.source = iterable
         self.iterable = iter(iterable)
         self.date = date
         self.prefix = self.date.strftime('%d/%b/%Y')
@@ -35,9 +65,21 @@ class DateRangeFilter(Filter):
     Either start_date or end_date can be omitted in order to include lines from
     only after, or only before the corresponding date.
 
+    If the input is known to be in chronological order, as is the output of
+    :py:class:`~loglab.sources.LogBuffer` or
+    :py:class:`~loglab.adapters.LogMultiplexer`, pass ordered=True. Iteration
+    will then stop at the first line that is more than lateness seconds past
+    end_date, and the input will be closed, rather than reading the input to
+    the end.
+
     """
-    def __init__(self, iterable, start_date=None, end_date=None):
+    stateless = True
+
+    def __init__(self, iterable, start_date=None, end_date=None, ordered=False, lateness=0):
+        self.source = iterable
         self.iterable = iterable
+        self.ordered = ordered
+        self.lateness = lateness
 
         if start_date:
             self.start_date = time.mktime(start_date.timetuple())
@@ -53,6 +95,25 @@ class DateRangeFilter(Filter):
         else:
             raise ValueError("Neither start_date nor end_date given")
 
+    @property
+    def fusable(self):
+        return not (self.ordered and hasattr(self, 'end_date'))
+
+    def __iter__(self):
+        if self.ordered and hasattr(self, 'end_date'):
+            return self.iter_ordered()
+        return super(DateRangeFilter, self).__iter__()
+
+    def iter_ordered(self):
+        stop = self.end_date + self.lateness
+        accept = self.accept
+        for l in self.iterable:
+            if l.time() >= stop:
+                self.close()
+                break
+            if accept(l):
+                yield l
+
     def accept_in(self, line):
         return self.start_date <= line.time() < self.end_date
 
@@ -61,3 +122,121 @@ class DateRangeFilter(Filter):
 
     def accept_to(self, line):
         return line.time() < self.end_date
+
+
+class FusedFilter(Filter):
+    """A single filter that accepts lines accepted by all of predicates.
+
+    Predicates are evaluated cheapest and most selective first. To find this
+    order, every predicate is evaluated for each of the first sample_size
+    lines, measuring how long it takes and how often it rejects a line; from
+    then on predicates are evaluated in order of time taken per rejection,
+    and evaluation of each line stops at the first predicate to reject it.
+
+    """
+    def __init__(self, iterable, predicates, sample_size=1000):
+        super(FusedFilter, self).__init__(iterable)
+        self.predicates = list(predicates)
+        self.sample_size = sample_size
+
+    def accept(self, line):
+        for p in self.predicates:
+            if not p(line):
+                return False
+        return True
+
+    def sample(self):
+        """Evaluate all predicates on the first sample_size lines, yielding
+        accepted lines, then reorder the predicates.
+        """
+        preds = self.predicates
+        n = len(preds)
+        rejects = [0] * n
+        costs = [0.0] * n
+        clock = time.time
+        for count, l in enumerate(self.iterable):
+            accepted = True
+            for i, p in enumerate(preds):
+                start = clock()
+                ok = p(l)
+                costs[i] += clock() - start
+                if not ok:
+                    rejects[i] += 1
+                    accepted = False
+            if accepted:
+                yield l
+            if count + 1 >= self.sample_size:
+                break
+
+        # Order by expected time spent per line rejected; predicates that
+        # never rejected anything go last
+        def rank(i):
+            return costs[i] / (rejects[i] or 0.5)
+        self.predicates = [preds[i] for i in sorted(range(n), key=rank)]
+
+    def __iter__(self):
+        for l in self.sample():
+            yield l
+        for l in compile_loop(len(self.predicates))(self.iterable, *self.predicates):
+            yield l
+
+
+def compile_loop(n):
+    """Return a generator function that takes an iterable and n predicates,
+    and yields the items accepted by all of the predicates.
+
+    The predicates are evaluated in a single expression, avoiding the
+    overhead of an inner loop over them.
+    """
+    try:
+        return _loops[n]
+    except KeyError:
+        pass
+    args = ['p%d' % i for i in range(n)]
+    src = (
+        'def loop(iterable, %s):\n'
+        '    for l in iterable:\n'
+        '        if %s:\n'
+        '            yield l\n'
+    ) % (', '.join(args), ' and '.join('%s(l)' % a for a in args))
+    ns = {}
+    exec src in ns
+    _loops[n] = ns['loop']
+    return ns['loop']
+
+_loops = {}
+
+
+def fuse_filters(pipeline, sample_size=1000):
+    """Collapse a chain of filters into a single :py:class:`FusedFilter`.
+
+    pipeline is the outermost stage of a pipeline. Starting from it, each
+    adjacent :py:class:`Filter` whose behaviour is defined by its accept()
+    method is combined into one stage, which tests each line against all of
+    their predicates in a single loop, instead of passing each line through a
+    generator for each filter. If there is fewer than two such filters, the
+    pipeline is returned unchanged.
+
+    Only filters that declare themselves :py:attr:`~Filter.stateless` are
+    fused, as fusing reorders their predicates and stops testing a line at
+    the first that rejects it; a filter such as
+    :py:class:`~loglab.utils.RandomLineFilter`, whose accept() depends on
+    the lines it has seen before, would select different lines.
+
+    The filters that are fused must not be iterated separately.
+
+    """
+    filters = []
+    stage = pipeline
+    while isinstance(stage, Filter) and stage.fusable:
+        filters.append(stage)
+        stage = filter_source(stage)
+    if len(filters) < 2:
+        return pipeline
+
+    # the innermost filter's iterator is reused, as the source may not
+    # support being iterated more than once
+    innermost = filters[-1]
+    fused = FusedFilter(innermost.iterable, [f.accept for f in reversed(filters)], sample_size)
+    fused.source = filter_source(innermost)
+    return fused
@@ -0,0 +1,211 @@
+# loglab - A library for stream-based log processing
+# Copyright (c) 2010 Crown copyright
+#
+# This file is part of loglab.
+#
+# loglab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# loglab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with loglab.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Incremental splitting of logs, reprocessing only inputs that have changed."""
+
+import os
+import json
+
+from .adapters import LogMultiplexer
+
+__all__ = (
+    'file_signature', 'Manifest', 'IncrementalSplitter'
+)
+
+
+def file_signature(path):
+    """Return a dictionary of the size and modification time of path."""
+    st = os.stat(path)
+    return {'size': st.st_size, 'mtime': st.st_mtime}
+
+
+class Manifest(object):
+    """A record of input files and the output files they produced.
+
+    The manifest is stored as JSON at path, and is loaded if it exists.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.inputs = {}
+        if os.path.exists(path):
+            f = open(path)
+            try:
+                self.inputs = json.load(f)['inputs']
+            finally:
+                f.close()
+
+    def is_unchanged(self, path, signature=None):
+        """Return True if path is recorded with the same
+        :py:func:`file_signature`, by default as it is now."""
+        try:
+            rec = self.inputs[path]
+        except KeyError:
+            return False
+        sig = signature or file_signature(path)
+        return rec['size'] == sig['size'] and rec['mtime'] == sig['mtime']
+
+    def is_current(self, path, key=None):
+        """Return True if path is recorded, has not changed since, and was
+        processed by a pipeline with the same key."""
+        return self.is_unchanged(path) and self.inputs[path].get('key') == key
+
+    def changed(self, paths, key=None):
+        """Return the paths in paths that are new, have changed or were
+        processed with a different key."""
+        return [p for p in paths if not self.is_current(p, key)]
+
+    def outputs(self, path):
+        """Return the set of output files recorded for input path."""
+        try:
+            return set(self.inputs[path]['outputs'])
+        except KeyError:
+            return set()
+
+    def record(self, path, outputs, signature=None, key=None):
+        """Record that input path produced outputs, when processed by a
+        pipeline described by key.
+
+        signature should be the :py:func:`file_signature` of path taken
+        before it was read, so that lines appended while it was being read
+        cause it to be read again next time; by default, path is recorded as
+        it is now.
+        """
+        rec = dict(signature or file_signature(path))
+        rec['outputs'] = sorted(outputs)
+        if key is not None:
+            rec['key'] = key
+        self.inputs[path] = rec
+
+    def prune(self):
+        """Forget inputs that no longer exist. Returns the paths removed."""
+        removed = [p for p in self.inputs if not os.path.exists(p)]
+        for p in removed:
+            del self.inputs[p]
+        return removed
+
+    def save(self):
+        """Write the manifest, replacing the previous version atomically."""
+        tmpname = self.path + '.tmp'
+        f = open(tmpname, 'w')
+        try:
+            json.dump({'inputs': self.inputs}, f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+        os.rename(tmpname, self.path)
+
+
+class IncrementalSplitter(object):
+    """Splits logs with a PartitionedWriter, processing only new or changed
+    inputs and rebuilding only the output files they affect.
+
+    open_log(path) should return an iterable of chronologically ordered log
+    lines for the input file path, such as a
+    :py:class:`~loglab.file_sources.GZipLogFile`. If given, pipeline is
+    called with each stream of lines before it is split, and can be used to
+    wrap the stream with filters such as
+    :py:class:`~loglab.filters.DateRangeFilter`. key is a value that can be
+    serialised as JSON describing what pipeline does, such as its date
+    range; it is recorded with each input, and inputs recorded with a
+    different key are processed again.
+
+    Each new or changed input is first scanned to find which output files
+    its lines belong to. Those files, and any files that the input previously
+    produced, are then rebuilt by merging every recorded input that
+    contributes to them, whether or not it is among the inputs given. Affected
+    files that no longer receive any lines are removed. An input that is
+    unchanged but was processed with a different key only rebuilds the files
+    it now produces, leaving the ones it produced before as they are.
+    """
+
+    def __init__(self, writer, manifest, open_log, pipeline=None, key=None):
+        self.writer = writer
+        if not isinstance(manifest, Manifest):
+            manifest = Manifest(manifest)
+        self.manifest = manifest
+        self.open_log = open_log
+        self.pipeline = pipeline or (lambda source: source)
+        # Compare keys as they will be read back from the manifest
+        self.key = json.loads(json.dumps(key))
+
+    def scan_outputs(self, path):
+        """Return the set of output files that lines from path belong to."""
+        partition = self.writer.partition
+        keys = set()
+        for l in self.pipeline(self.open_log(path)):
+            keys.add(partition(l))
+        return set(self.writer.filename(k) for k in keys)
+
+    def only_outputs(self, lines, outputs):
+        """Filter lines to those belonging to the given output files."""
+        partition = self.writer.partition
+        filename = self.writer.filename
+        wanted = {} # cache of partition key -> whether its output is wanted
+        for l in lines:
+            key = partition(l)
+            try:
+                want = wanted[key]
+            except KeyError:
+                want = wanted[key] = filename(key) in outputs
+            if want:
+                yield l
+
+    def split(self, inputs):
+        """Bring the outputs up to date with the input files inputs.
+
+        Returns the list of output files that were rebuilt.
+        """
+        pruned = self.manifest.prune()
+        changed = self.manifest.changed(inputs, self.key)
+        if not changed:
+            if pruned:
+                self.manifest.save()
+            return []
+
+        # Take each input's signature before reading it, so that lines
+        # appended during the run are picked up by the next one
+        signatures = dict((path, file_signature(path)) for path in changed)
+
+        new_outputs = {}
+        affected = set()
+        for path in changed:
+            new_outputs[path] = self.scan_outputs(path)
+            affected |= new_outputs[path]
+            if self.manifest.is_unchanged(path, signatures[path]):
+                # Only the key differs; the files this input produced
+                # before still hold its lines, so keep recording them
+                new_outputs[path] |= self.manifest.outputs(path)
+            else:
+                affected |= self.manifest.outputs(path)
+
+        # Inputs not given, such as those outside a date range, still
+        # contribute to the files they produced
+        contributors = set(changed)
+        for path in self.manifest.inputs:
+            if self.manifest.outputs(path) & affected:
+                contributors.add(path)
+
+        source = LogMultiplexer(*[self.open_log(p) for p in sorted(contributors)])
+        written = self.writer.split(self.only_outputs(self.pipeline(source), affected))
+        for fname in affected.difference(written):
+            if os.path.exists(fname):
+                os.unlink(fname)
+
+        for path in changed:
+            self.manifest.record(path, new_outputs[path], signatures[path], self.key)
+        self.manifest.save()
+        return written
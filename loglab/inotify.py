@@ -0,0 +1,150 @@
+# loglab - A library for stream-based log processing
+# Copyright (c) 2010 Crown copyright
+#
+# This file is part of loglab.
+#
+# loglab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# loglab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with loglab.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Minimal ctypes binding to the Linux inotify API.
+
+Only what is needed to wake up when a watched file changes is provided:
+events are read and returned, but callers generally only need to know
+that something happened. On systems without inotify, constructing an
+:py:class:`INotify` raises :py:class:`INotifyUnavailable`.
+"""
+
+import os
+import errno
+import struct
+import ctypes
+import ctypes.util
+
+__all__ = (
+    'INotify', 'INotifyUnavailable', 'available',
+    'IN_MODIFY', 'IN_ATTRIB', 'IN_CLOSE_WRITE', 'IN_MOVED_FROM',
+    'IN_MOVED_TO', 'IN_CREATE', 'IN_DELETE', 'IN_DELETE_SELF',
+    'IN_MOVE_SELF',
+)
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+# struct inotify_event: int wd; uint32_t mask, cookie, len; char name[]
+EVENT_HEADER = struct.Struct('iIII')
+
+READ_SIZE = 4096
+
+
+class INotifyUnavailable(OSError):
+    """inotify is not supported on this system."""
+
+
+_libc = None
+
+
+def libc():
+    global _libc
+    if _libc is None:
+        name = ctypes.util.find_library('c')
+        if name is None:
+            raise INotifyUnavailable("Could not find the C library")
+        lib = ctypes.CDLL(name, use_errno=True)
+        try:
+            lib.inotify_init1
+            lib.inotify_add_watch
+            lib.inotify_rm_watch
+        except AttributeError:
+            raise INotifyUnavailable("The C library does not support inotify")
+        lib.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        lib.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        _libc = lib
+    return _libc
+
+
+def available():
+    """Return True if inotify can be used on this system."""
+    try:
+        libc()
+    except (INotifyUnavailable, OSError):
+        return False
+    return True
+
+
+def check(ret):
+    if ret < 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+    return ret
+
+
+class INotify(object):
+    """An inotify instance.
+
+    The instance has a file descriptor, returned by fileno(), that becomes
+    readable when events are pending, so it can be passed to select().
+    """
+    def __init__(self):
+        lib = libc()
+        try:
+            self.fd = check(lib.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+        except OSError, e:
+            raise INotifyUnavailable(e.errno, e.strerror)
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask):
+        """Watch path for the events in mask, returning a watch descriptor."""
+        return check(libc().inotify_add_watch(self.fd, path, mask))
+
+    def rm_watch(self, wd):
+        """Stop watching the watch descriptor wd."""
+        check(libc().inotify_rm_watch(self.fd, wd))
+
+    def read_events(self):
+        """Return a list of pending (wd, mask, cookie, name) events, without
+        blocking."""
+        events = []
+        while True:
+            try:
+                buf = os.read(self.fd, READ_SIZE)
+            except OSError, e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    return events
+                raise
+            if not buf:
+                return events
+            offset = 0
+            while offset < len(buf):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(buf, offset)
+                offset += EVENT_HEADER.size
+                name = buf[offset:offset + length].rstrip('\0')
+                offset += length
+                events.append((wd, mask, cookie, name))
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
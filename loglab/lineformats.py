@@ -73,6 +73,8 @@ class CombinedLogLine(object):
 
     name = "Combined Log Format"
     stamp_pattern = re.compile(r'\[(\d{2}/[A-Za-z]{3}/\d{4}:\d{2}:\d{2}:\d{2} [+-]\d{4})\]')
+    # Compiled patterns tried in order if a line does not match full_pattern
+    fallback_patterns = ()
     full_pattern = (
         r'^(?P<ip>[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}|-|unknown)'
         r'(?P<x_forwarded_for>(?:, ?[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3})*)'
@@ -175,12 +177,13 @@ class ApacheLogLine(CombinedLogLine):
         r'"(?P<ua>.*)"'
         r' "(?P<cookie>.*\*|-)"'
     )
+    fallback_patterns = (CombinedLogLine.full_pattern,)
 
     def _full_parse(self):
         try:
             return super(ApacheLogLine, self)._full_parse()
         except LogLineParseError:
-            self.full_pattern = CombinedLogLine.full_pattern
+            self.full_pattern = self.fallback_patterns[0]
             return super(ApacheLogLine, self)._full_parse()
 
 
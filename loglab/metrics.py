@@ -0,0 +1,236 @@
+# loglab - A library for stream-based log processing
+# Copyright (c) 2010 Crown copyright
+#
+# This file is part of loglab.
+#
+# loglab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# loglab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with loglab.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Low-overhead throughput instrumentation for log processing pipelines.
+
+Stages of a pipeline are wrapped to count the lines, and optionally bytes,
+passing through them. Counting costs an attribute increment per line; rates,
+timestamp lag and buffer occupancies are only calculated when a report is
+made, by a background thread at a fixed interval.
+"""
+
+import sys
+import os
+import time
+import json
+import threading
+
+from .sources import close_source
+
+__all__ = (
+    'Metrics', 'Reporter'
+)
+
+
+class Counter(object):
+    """Counts of lines and bytes through one stage."""
+    def __init__(self, name):
+        self.name = name
+        self.lines = 0
+        self.bytes = 0
+        self.last = None    # most recent item, for calculating lag
+
+
+class MeteredStage(object):
+    """Iterable that counts the items passing through it."""
+    def __init__(self, iterable, counter, count_bytes=False):
+        self.source = iterable
+        self.counter = counter
+        self.count_bytes = count_bytes
+
+    def close(self):
+        close_source(self.source)
+
+    def __iter__(self):
+        c = self.counter
+        if self.count_bytes:
+            for l in self.source:
+                c.lines += 1
+                c.bytes += len(l)
+                yield l
+        else:
+            for l in self.source:
+                c.lines += 1
+                c.last = l
+                yield l
+
+
+class Metrics(object):
+    """Collects throughput metrics from the stages of a pipeline.
+
+    Wrap raw input with :py:meth:`count_raw` to count lines and bytes read,
+    and parsed lines with :py:meth:`count` to count lines processed and
+    track how far the log timestamps lag behind the wall clock. Parse
+    failures from :py:class:`~loglab.sources.LogLineSource` and the number
+    of lines held in :py:class:`~loglab.sources.LogBuffer` windows can also
+    be watched.
+    """
+    def __init__(self):
+        self.counters = []
+        self.failure_sources = []
+        self.gauges = []
+        self.started = time.time()
+        self.last_snapshot = None
+
+    def counter(self, name):
+        c = Counter(name)
+        self.counters.append(c)
+        return c
+
+    def count(self, iterable, name='lines'):
+        """Wrap a stage of LogLines, counting lines and recording the
+        timestamp of the most recent."""
+        return MeteredStage(iterable, self.counter(name))
+
+    def count_raw(self, iterable, name='input'):
+        """Wrap a stage of raw lines of text, counting lines and bytes."""
+        return MeteredStage(iterable, self.counter(name), count_bytes=True)
+
+    def watch_failures(self, source):
+        """Include lines that source could not parse in the count of parse
+        failures. source may be a LogLineSource, or an
+        :py:class:`~loglab.sources.OrderedSource` or file source that
+        constructs one."""
+        self.failure_sources.append(source)
+
+    def watch(self, name, func):
+        """Report the value returned by func() as the gauge name."""
+        self.gauges.append((name, func))
+
+    def watch_buffer(self, name, buf):
+        """Report the number of lines held in a LogBuffer.
+
+        buf may also be an :py:class:`~loglab.sources.OrderedSource` or file
+        source, whose LogBuffer is created when iteration starts, or any
+        object with a depth() method returning its occupancy.
+        """
+        self.watch(name, lambda: occupancy(buf))
+
+    def snapshot(self):
+        """Return a dictionary of the current metrics.
+
+        Rates are calculated over the time since the previous snapshot.
+        """
+        now = time.time()
+        prev = self.last_snapshot
+        if prev:
+            elapsed = now - prev['time']
+            prev_stages = prev['stages']
+        else:
+            elapsed = now - self.started
+            prev_stages = {}
+
+        stages = {}
+        for c in self.counters:
+            stage = {'lines': c.lines, 'bytes': c.bytes}
+            p = prev_stages.get(c.name, {'lines': 0, 'bytes': 0})
+            if elapsed > 0:
+                stage['lines_per_sec'] = (c.lines - p['lines']) / elapsed
+                stage['bytes_per_sec'] = (c.bytes - p['bytes']) / elapsed
+            last = c.last
+            if hasattr(last, 'time'):
+                stage['lag'] = now - last.time()
+            stages[c.name] = stage
+
+        snap = {
+            'time': now,
+            'stages': stages,
+            'parse_failures': sum(s.invalid for s in self.failure_sources),
+            'gauges': dict((name, func()) for name, func in self.gauges),
+        }
+        self.last_snapshot = snap
+        return snap
+
+    def report_every(self, interval, output=None):
+        """Start a :py:class:`Reporter` thread that reports metrics every
+        interval seconds, and return it."""
+        reporter = Reporter(self, interval, output)
+        reporter.start()
+        return reporter
+
+
+def occupancy(buf):
+    """Return the number of items held in a buffer."""
+    if hasattr(buf, 'heap'):
+        return len(buf.heap)
+    if hasattr(buf, 'buffer'):
+        if buf.buffer is None:
+            return 0
+        return len(buf.buffer.heap)
+    return buf.depth()
+
+
+def format_snapshot(snap):
+    """Format a snapshot as a single line of text."""
+    parts = []
+    for name, s in sorted(snap['stages'].items()):
+        part = '%s: %d lines (%.0f/s)' % (name, s['lines'], s.get('lines_per_sec', 0))
+        if s['bytes']:
+            part += ' %.1fMB (%.2fMB/s)' % (s['bytes'] / 1e6, s.get('bytes_per_sec', 0) / 1e6)
+        if 'lag' in s:
+            part += ' lag %.0fs' % s['lag']
+        parts.append(part)
+    parts.append('%d parse failures' % snap['parse_failures'])
+    for name, value in sorted(snap['gauges'].items()):
+        parts.append('%s: %s' % (name, value))
+    return '; '.join(parts)
+
+
+class Reporter(threading.Thread):
+    """Thread that reports a snapshot of metrics at a regular interval.
+
+    output may be a file-like object (by default sys.stderr), to which a line
+    of text is written for each report; the name of a file, which is
+    replaced with the latest snapshot as JSON; or a callable, which is
+    called with each snapshot dictionary.
+    """
+    def __init__(self, metrics, interval=10, output=None):
+        super(Reporter, self).__init__()
+        self.daemon = True
+        self.metrics = metrics
+        self.interval = interval
+        if output is None:
+            output = sys.stderr
+        self.output = output
+        self.stopped = threading.Event()
+
+    def stop(self):
+        """Stop reporting, after making a final report."""
+        self.stopped.set()
+        self.join()
+
+    def report(self):
+        snap = self.metrics.snapshot()
+        if callable(self.output):
+            self.output(snap)
+        elif isinstance(self.output, basestring):
+            tmpname = self.output + '.tmp'
+            f = open(tmpname, 'w')
+            try:
+                json.dump(snap, f)
+            finally:
+                f.close()
+            os.rename(tmpname, self.output)
+        else:
+            self.output.write(format_snapshot(snap) + '\n')
+            self.output.flush()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+        self.report()
@@ -0,0 +1,106 @@
+# loglab - A library for stream-based log processing
+# Copyright (c) 2010 Crown copyright
+#
+# This file is part of loglab.
+#
+# loglab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# loglab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with loglab.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Read ahead from a source in a background thread.
+
+Reading a log alternates between waiting for I/O or decompression and
+parsing lines in Python. :py:class:`Prefetch` moves the reading into a
+background thread, so that zlib decompression and slow reads, which release
+the GIL, overlap with parsing in the consuming thread.
+"""
+
+import sys
+import threading
+from Queue import Queue, Empty
+from itertools import islice
+
+from .sources import close_source
+
+__all__ = (
+    'Prefetch',
+)
+
+# Marks the end of the source in the queue
+END = object()
+
+
+class Prefetch(object):
+    """Iterates over iterable in a background thread, passing items to the
+    consumer in batches of batch_size.
+
+    At most max_batches batches are queued; once the queue is full, the
+    background thread waits for the consumer to catch up. Exceptions raised
+    by iterable are re-raised in the consumer.
+
+    This works best around a source of raw lines, such as a file, so that
+    parsing stays in the consumer; file sources accept prefetch=True to
+    arrange this.
+    """
+    def __init__(self, iterable, batch_size=1000, max_batches=8):
+        self.source = iterable
+        self.batch_size = batch_size
+        self.queue = Queue(max_batches)
+        self.stopping = False
+        self.thread = None
+
+    def depth(self):
+        """Return the number of batches waiting to be consumed."""
+        return self.queue.qsize()
+
+    def read(self):
+        put = self.queue.put
+        size = self.batch_size
+        try:
+            it = iter(self.source)
+            while not self.stopping:
+                batch = list(islice(it, size))
+                if not batch:
+                    break
+                put(batch)
+        except Exception:
+            put(sys.exc_info())
+        put(END)
+
+    def close(self):
+        """Stop the background thread and close the source."""
+        if self.thread:
+            self.stopping = True
+            # Unblock the thread if it is waiting for space in the queue
+            while self.thread.isAlive():
+                try:
+                    self.queue.get(timeout=0.1)
+                except Empty:
+                    pass
+            self.thread = None
+        close_source(self.source)
+
+    def __iter__(self):
+        self.thread = threading.Thread(target=self.read)
+        self.thread.daemon = True
+        self.thread.start()
+
+        get = self.queue.get
+        while True:
+            batch = get()
+            if batch is END:
+                break
+            if isinstance(batch, tuple):
+                raise batch[0], batch[1], batch[2]
+            for item in batch:
+                yield item
+        self.thread = None
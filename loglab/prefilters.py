@@ -0,0 +1,151 @@
+# loglab - A library for stream-based log processing
+# Copyright (c) 2010 Crown copyright
+#
+# This file is part of loglab.
+#
+# loglab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# loglab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with loglab.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Filters that operate on the raw text of log lines, before parsing."""
+
+import re
+from bisect import bisect_right
+from itertools import islice
+
+from .sources import close_source
+
+__all__ = (
+    'PreFilter', 'Contains', 'Matches', 'DatePrefix'
+)
+
+
+class Contains(object):
+    """Predicate accepting lines that contain a fixed string."""
+    def __init__(self, substring):
+        self.substring = substring
+
+    def __call__(self, line):
+        return self.substring in line
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.substring)
+
+
+class DatePrefix(Contains):
+    """Predicate accepting lines timestamped on the given date.
+
+    Like :py:class:`~loglab.filters.DateFilter`, this looks for the date in
+    the form it takes in the log line's timestamp, eg. ``[24/Apr/2010:``.
+    """
+    def __init__(self, date):
+        super(DatePrefix, self).__init__(date.strftime('[%d/%b/%Y:'))
+
+
+class Matches(object):
+    """Predicate accepting lines that match a regular expression anywhere."""
+    def __init__(self, pattern):
+        if isinstance(pattern, basestring):
+            pattern = re.compile(pattern)
+        self.pattern = pattern
+
+    def __call__(self, line):
+        return self.pattern.search(line) is not None
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.pattern.pattern)
+
+
+class PreFilter(object):
+    """Filter raw log lines, as strings, before they are parsed.
+
+    predicates is a sequence of callables that take a line and return True if
+    it should be accepted; lines are accepted only if all predicates accept
+    them. Predicates such as :py:class:`Contains` that have a ``substring``
+    attribute are treated as fixed-string matches.
+
+    If there is a fixed-string match, lines are processed in blocks of
+    block_size lines. Each block is searched for the substring as one string,
+    so that lines which do not contain it cost nothing more than their share
+    of a single ``find()``; only lines containing the substring are tested
+    with the remaining predicates.
+    """
+    def __init__(self, iterable, predicates, block_size=1000):
+        self.source = iterable
+        self.iterable = iter(iterable)
+        if callable(predicates):
+            predicates = [predicates]
+        predicates = list(predicates)
+
+        # Search blocks for the longest fixed string, as it is likely to be
+        # the most selective
+        fixed = [p for p in predicates if hasattr(p, 'substring')]
+        if fixed:
+            self.substring = max(fixed, key=lambda p: len(p.substring)).substring
+            predicates = [p for p in predicates if getattr(p, 'substring', None) != self.substring]
+        else:
+            self.substring = None
+        self.predicates = predicates
+        self.block_size = block_size
+
+    def close(self):
+        close_source(self.source)
+
+    def accept(self, line):
+        for p in self.predicates:
+            if not p(line):
+                return False
+        return True
+
+    def __iter__(self):
+        if self.substring is None:
+            return self.iter_lines()
+        return self.iter_blocks()
+
+    def iter_lines(self):
+        accept = self.accept
+        for l in self.iterable:
+            if accept(l):
+                yield l
+
+    def iter_blocks(self):
+        sub = self.substring
+        accept = self.accept
+        while True:
+            block = list(islice(self.iterable, self.block_size))
+            if not block:
+                break
+
+            # Lines are joined with newlines, which only occur at the end of
+            # a line. A line may end with a newline of its own, so the line
+            # containing a match is found from the offsets of the ends of
+            # the lines, which are only computed for blocks with a match.
+            text = '\n'.join(block)
+            pos = text.find(sub)
+            if pos == -1:
+                continue
+            ends = []
+            end = -1
+            for n in map(len, block):
+                end += n + 1
+                ends.append(end)
+            n = len(sub)
+            while pos != -1:
+                i = bisect_right(ends, pos)
+                if pos + n > ends[i] or (i and pos == ends[i - 1]):
+                    # The match spans the end of a line
+                    pos = text.find(sub, pos + 1)
+                    continue
+                if accept(block[i]):
+                    yield block[i]
+                # skip to the start of the next line
+                pos = text.find(sub, ends[i] + 1)
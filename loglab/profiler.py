@@ -0,0 +1,308 @@
+# loglab - A library for stream-based log processing
+# Copyright (c) 2010 Crown copyright
+#
+# This file is part of loglab.
+#
+# loglab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# loglab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with loglab.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Attribute the time spent in a pipeline to its stages.
+
+A pipeline is a chain of nested generators, so a general-purpose profiler
+shows little more than a tower of __iter__ frames. Here each stage of
+interest is wrapped with :py:meth:`Profiler.stage`, and time is attributed
+to the innermost stage running when it is spent; time spent outside all
+stages is attributed to the sink consuming the pipeline.
+
+By default every item pulled through a stage is timed, which measures wall
+and CPU time exactly but costs a few microseconds per item per stage. With
+a sample_interval, a background thread instead samples which stage is
+running, which costs almost nothing per item.
+"""
+
+import sys
+import time
+import gzip
+import thread
+import threading
+
+from .sources import LogLineSource, LogBuffer, close_source
+from .lineformats import LogLine
+
+__all__ = (
+    'Profiler',
+)
+
+BLOCK_SIZE = 1 << 16
+
+
+class StageStats(object):
+    """Exclusive time spent in one stage."""
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.samples = 0
+
+
+class ProfiledStage(object):
+    """Iterable that attributes the time spent fetching items from iterable
+    to a stage of a Profiler."""
+    def __init__(self, profiler, iterable, stats):
+        self.profiler = profiler
+        self.source = iterable
+        self.stats = stats
+
+    def close(self):
+        close_source(self.source)
+
+    def __iter__(self):
+        self.profiler.starting()
+        if self.profiler.sample_interval:
+            return self.sampled_iter()
+        return self.timed_iter()
+
+    def timed_iter(self):
+        stats = self.stats
+        stack = self.profiler.stack
+        now = time.time
+        clock = time.clock
+
+        first = True
+        while True:
+            # Time spent in nested stages is accumulated in child, and
+            # subtracted from the time spent in this one.
+            child = [0.0, 0.0]
+            stack.append(child)
+            w = now()
+            c = clock()
+            try:
+                if first:
+                    # Starting iteration may do real work, such as filling
+                    # a LogBuffer
+                    next = iter(self.source).next
+                else:
+                    item = next()
+            finally:
+                w = now() - w
+                c = clock() - c
+                stack.pop()
+                stats.calls += 1
+                stats.wall += w - child[0]
+                stats.cpu += c - child[1]
+                if stack:
+                    parent = stack[-1]
+                    parent[0] += w
+                    parent[1] += c
+            if first:
+                first = False
+            else:
+                yield item
+
+    def sampled_iter(self):
+        # The sampler identifies this stage by this generator's frame
+        frame = sys._getframe()
+        frames = self.profiler.frames
+        frames[frame] = self.stats
+        try:
+            for item in self.source:
+                yield item
+        finally:
+            del frames[frame]
+
+
+class Sampler(threading.Thread):
+    """Thread that periodically samples which stage a thread is running."""
+    def __init__(self, profiler, thread_id):
+        super(Sampler, self).__init__()
+        self.daemon = True
+        self.profiler = profiler
+        self.thread_id = thread_id
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        frames = self.profiler.frames
+        while frame is not None:
+            stats = frames.get(frame)
+            if stats is not None:
+                stats.samples += 1
+                return
+            frame = frame.f_back
+        self.profiler.sink.samples += 1
+
+    def run(self):
+        while not self.stopped.wait(self.profiler.sample_interval):
+            self.sample()
+
+
+class Profiler(object):
+    """Attributes exclusive wall and CPU time to the stages of a pipeline.
+
+    Wrap each stage with :py:meth:`stage`, run the pipeline, then call
+    :py:meth:`report` to print a breakdown. Timing starts when the first
+    stage starts iterating, or when :py:meth:`start` is called.
+
+    If sample_interval is given, the stage running is sampled at that
+    interval (in seconds) instead of timing every item. Times are then
+    estimated from the proportion of samples in each stage, and CPU time is
+    divided in the same proportions as wall time.
+
+    CPU time is that of the whole process, so it includes any threads
+    compressing or decompressing in the background.
+    """
+    def __init__(self, sample_interval=None):
+        self.sample_interval = sample_interval
+        self.stages = []
+        self.by_name = {}
+        self.sink = StageStats('sink')
+        self.stack = []
+        self.frames = {}
+        self.sampler = None
+        self.started = None
+        self.elapsed = None
+        self.cpu = None
+
+    def stage(self, iterable, name):
+        """Wrap iterable as a stage of the pipeline called name.
+
+        Several iterables may share a name, such as the same stage in
+        pipelines for several files, in which case their times are summed.
+        """
+        try:
+            stats = self.by_name[name]
+        except KeyError:
+            stats = self.by_name[name] = StageStats(name)
+            self.stages.append(stats)
+        return ProfiledStage(self, iterable, stats)
+
+    def log_file(self, filename, window_size=1000, line_class=LogLine, ignore_invalid=True):
+        """Construct a sorted source of LogLines from a log file, like
+        :py:class:`~loglab.file_sources.GZipLogFile`, with stages for
+        decompression, line splitting, parsing and the sort buffer.
+
+        Files not ending in .gz are read uncompressed; the first stage is
+        then called 'read'.
+        """
+        if filename.endswith('.gz'):
+            f = gzip.open(filename)
+            name = 'decompression'
+        else:
+            f = open(filename)
+            name = 'read'
+        source = self.stage(read_blocks(f), name)
+        source = self.stage(split_lines(source), 'line splitting')
+        source = self.stage(LogLineSource(source, line_class=line_class, ignore_invalid=ignore_invalid), 'parse')
+        return self.stage(SortBuffer(source, window_size), 'sort buffer')
+
+    def starting(self):
+        if self.started is None:
+            self.start()
+
+    def start(self):
+        """Start timing the pipeline."""
+        self.started = time.time()
+        self.started_cpu = time.clock()
+        if self.sample_interval:
+            self.sampler = Sampler(self, thread.get_ident())
+            self.sampler.start()
+
+    def stop(self):
+        """Stop timing the pipeline."""
+        if self.sampler:
+            self.sampler.stop()
+        self.elapsed = time.time() - self.started
+        self.cpu = time.clock() - self.started_cpu
+
+    def breakdown(self):
+        """Return a list of (name, wall, cpu) tuples for each stage, and the
+        sink, in seconds."""
+        if self.elapsed is None:
+            self.stop()
+        stages = self.stages + [self.sink]
+        if self.sample_interval:
+            total = float(sum(s.samples for s in stages)) or 1.0
+            return [(s.name, self.elapsed * s.samples / total, self.cpu * s.samples / total) for s in stages]
+
+        rows = [(s.name, s.wall, s.cpu) for s in self.stages]
+        wall = self.elapsed - sum(s.wall for s in self.stages)
+        cpu = self.cpu - sum(s.cpu for s in self.stages)
+        rows.append(('sink', max(wall, 0.0), max(cpu, 0.0)))
+        return rows
+
+    def report(self, out=None):
+        """Print a table of the time spent in each stage."""
+        if out is None:
+            out = sys.stderr
+        rows = self.breakdown()
+        total_wall = sum(r[1] for r in rows) or 1.0
+        total_cpu = sum(r[2] for r in rows) or 1.0
+        width = max(len(r[0]) for r in rows + [('stage',)])
+
+        out.write('%-*s %10s %6s %10s %6s\n' % (width, 'stage', 'wall (s)', '%', 'cpu (s)', '%'))
+        for name, wall, cpu in rows:
+            out.write('%-*s %10.3f %5.1f%% %10.3f %5.1f%%\n' % (
+                width, name, wall, 100 * wall / total_wall, cpu, 100 * cpu / total_cpu
+            ))
+        out.write('%-*s %10.3f %6s %10.3f\n' % (width, 'total', self.elapsed, '', self.cpu))
+        if self.sample_interval:
+            samples = sum(s.samples for s in self.stages + [self.sink])
+            out.write('(estimated from %d samples)\n' % samples)
+
+
+class SortBuffer(object):
+    """A LogBuffer that is constructed when iteration starts, so that the
+    time to fill it is attributed to its stage."""
+    def __init__(self, iterable, window_size=1000):
+        self.source = iterable
+        self.window_size = window_size
+
+    def close(self):
+        close_source(self.source)
+
+    def __iter__(self):
+        return iter(LogBuffer(self.source, self.window_size))
+
+
+def read_blocks(f, block_size=BLOCK_SIZE):
+    """Read f in blocks of block_size bytes."""
+    read = f.read
+    try:
+        while True:
+            block = read(block_size)
+            if not block:
+                break
+            yield block
+    finally:
+        f.close()
+
+
+def split_lines(blocks):
+    """Split an iterable of blocks of text into lines."""
+    pending = ''
+    try:
+        for block in blocks:
+            lines = block.split('\n')
+            lines[0] = pending + lines[0]
+            pending = lines.pop()
+            for l in lines:
+                yield l + '\n'
+    finally:
+        close_source(blocks)
+    if pending:
+        yield pending
@@ -0,0 +1,392 @@
+# loglab - A library for stream-based log processing
+# Copyright (c) 2010 Crown copyright
+#
+# This file is part of loglab.
+#
+# loglab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# loglab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with loglab.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Declarative conditions on log line fields.
+
+Conditions are given as keyword arguments naming a field and, optionally, a
+lookup, separated by a double underscore::
+
+    >>> q = where(code=503, verb='GET', req__startswith='/api/')
+
+The query is planned to do as little work per line as possible: conditions
+are first checked against the raw line text where they imply a fixed string
+that must be present, then by parsing only as much of the line as is needed
+to extract the fields referenced, and only failing that with a full parse.
+"""
+
+import os
+import re
+import operator
+
+from .lineformats import LogLine, LogLineParseError
+from .filters import Filter
+from .prefilters import Contains
+
+__all__ = (
+    'where', 'Query', 'Condition', 'Where'
+)
+
+
+LOOKUPS = {
+    'exact': lambda v: lambda f: f == v,
+    'ne': lambda v: lambda f: f != v,
+    'in': lambda v: lambda f: f in v,
+    'startswith': lambda v: lambda f: f.startswith(v),
+    'endswith': lambda v: lambda f: f.endswith(v),
+    'contains': lambda v: lambda f: v in f,
+    'regex': lambda v: lambda f: v.search(f) is not None,
+    'gt': lambda v: compare(operator.gt, v),
+    'gte': lambda v: compare(operator.ge, v),
+    'lt': lambda v: compare(operator.lt, v),
+    'lte': lambda v: compare(operator.le, v),
+}
+
+
+def compare(op, v):
+    """Return a test that compares a field numerically with v using op.
+
+    Fields that are not numeric, such as '-', fail the test.
+    """
+    v = float(v)
+    def test(f):
+        try:
+            return op(float(f), v)
+        except ValueError:
+            return False
+    return test
+
+
+class Condition(object):
+    """A test of one field of a log line.
+
+    lookup is one of the names in LOOKUPS. If value is callable, it is
+    called with the field value instead, and lookup is ignored.
+    """
+    def __init__(self, field, lookup, value):
+        if lookup not in LOOKUPS:
+            raise ValueError("Unknown lookup %r for field %r" % (lookup, field))
+        self.field = field
+        self.lookup = lookup
+        self.value = value
+        if callable(value):
+            self.test = value
+        elif lookup == 'in':
+            self.test = LOOKUPS[lookup](frozenset(str(v) for v in value))
+        elif lookup == 'regex':
+            self.test = LOOKUPS[lookup](re.compile(value))
+        elif lookup in ('gt', 'gte', 'lt', 'lte'):
+            self.test = LOOKUPS[lookup](value)
+        else:
+            self.test = LOOKUPS[lookup](str(value))
+
+    def substring(self, prefix, suffix):
+        """Return a string that must appear in the raw text of any line that
+        passes this condition, given the literal text known to precede and
+        follow the field, or None if there is no such string.
+        """
+        if callable(self.value):
+            return None
+        v = str(self.value)
+        if self.lookup == 'exact':
+            s = (prefix or '') + v + (suffix or '')
+        elif self.lookup == 'startswith':
+            s = (prefix or '') + v
+        elif self.lookup == 'endswith':
+            s = v + (suffix or '')
+        elif self.lookup == 'contains':
+            s = v
+        else:
+            return None
+        return s or None
+
+    def __repr__(self):
+        return 'Condition(%r, %r, %r)' % (self.field, self.lookup, self.value)
+
+
+# Characters with special meaning in regular expressions
+SPECIAL = set('.^$*+?{}[]|()\\')
+QUANTIFIERS = set('*+?{')
+
+
+def scan_groups(pattern):
+    """Find the named groups at the top level of a regular expression.
+
+    Returns a list of (name, start, end, quantified) tuples, where start and
+    end delimit the group, including any quantifier applied to it.
+    """
+    groups = []
+    depth = 0
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '\\':
+            i += 2
+            continue
+        elif c == '[':
+            # skip character class; ']' first in the class is literal
+            i += 1
+            if i < n and pattern[i] == '^':
+                i += 1
+            if i < n and pattern[i] == ']':
+                i += 1
+            while i < n and pattern[i] != ']':
+                if pattern[i] == '\\':
+                    i += 1
+                i += 1
+        elif c == '(':
+            if depth == 0:
+                mo = re.match(r'\(\?P<(\w+)>', pattern[i:])
+                current = (mo.group(1), i) if mo else None
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0 and current:
+                end = i + 1
+                quantified = end < n and pattern[end] in QUANTIFIERS
+                if quantified:
+                    if pattern[end] == '{':
+                        end = pattern.index('}', end)
+                    end += 1
+                    if end < n and pattern[end] == '?':
+                        end += 1
+                groups.append((current[0], current[1], end, quantified))
+        elif c == '|' and depth == 0:
+            # alternation at the top level; no group is certain to match
+            return []
+        i += 1
+    return groups
+
+
+def line_patterns(line_class):
+    """Return the compiled patterns a line class parses lines with, in the
+    order it tries them."""
+    return [line_class.full_pattern] + list(line_class.fallback_patterns)
+
+
+def literal_before(pattern, pos):
+    """Return the literal text that the pattern requires immediately before
+    position pos."""
+    chars = []
+    i = pos - 1
+    while i >= 0:
+        c = pattern[i]
+        if i > 0 and pattern[i - 1] == '\\':
+            if c.isalnum():
+                break
+            chars.append(c)
+            i -= 2
+        elif c in SPECIAL:
+            break
+        else:
+            chars.append(c)
+            i -= 1
+    return ''.join(reversed(chars))
+
+
+def literal_after(pattern, pos):
+    """Return the literal text that the pattern requires immediately from
+    position pos."""
+    chars = []
+    i = pos
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '\\':
+            if i + 1 >= n or pattern[i + 1].isalnum():
+                break
+            c = pattern[i + 1]
+            step = 2
+        elif c in SPECIAL:
+            break
+        else:
+            step = 1
+        if i + step < n and pattern[i + step] in QUANTIFIERS:
+            break
+        chars.append(c)
+        i += step
+    return ''.join(chars)
+
+
+def common_suffix(strings):
+    return os.path.commonprefix([s[::-1] for s in strings])[::-1]
+
+
+class Projection(object):
+    """A regular expression that extracts only some fields of a line class.
+
+    The line class's pattern is cut short after the last field needed (plus
+    the following field and the literal text after it, to anchor any greedy
+    or non-greedy match), and other named groups are made non-capturing. A
+    line that matches the projection might still fail a full parse, if it
+    is malformed after the fields extracted.
+
+    If the line class falls back to other patterns, such as
+    :py:class:`~loglab.lineformats.ApacheLogLine` for lines without a
+    cookie, the pattern is only cut within the text that every pattern
+    shares. Otherwise the whole patterns are tried in turn, as a full parse
+    would. Likewise the literal text known to surround each field, in
+    contexts, is only what every pattern agrees on.
+    """
+    def __init__(self, line_class, fields):
+        sources = [p.pattern for p in line_patterns(line_class)]
+        scanned = [scan_groups(source) for source in sources]
+
+        self.contexts = {}
+        contexts = [
+            dict((name, (literal_before(source, start), literal_after(source, end)))
+                 for name, start, end, quantified in groups if not quantified)
+            for source, groups in zip(sources, scanned)
+        ]
+        for name in contexts[0]:
+            if all(name in c for c in contexts):
+                self.contexts[name] = (
+                    common_suffix([c[name][0] for c in contexts]),
+                    os.path.commonprefix([c[name][1] for c in contexts]),
+                )
+
+        # Groups at the same place in every pattern, after the same text
+        source = sources[0]
+        shared = []
+        for g in scanned[0]:
+            if not all(g in groups and s[:g[2]] == source[:g[2]] for s, groups in zip(sources, scanned)):
+                break
+            shared.append(g)
+
+        names = [g[0] for g in scanned[0]]
+        if fields and all(f in names for f in fields):
+            last = max(names.index(f) for f in fields)
+            if last + 1 < len(shared):
+                # Keep the literal text after the following group, such as
+                # a closing quote, which a greedy match must leave behind
+                end = shared[last + 1][2]
+                literal = os.path.commonprefix([literal_after(s, end) for s in sources])
+                sources = [source[:end] + re.escape(literal)]
+
+        def replace(mo):
+            if mo.group(1) in fields:
+                return mo.group(0)
+            return '(?:'
+        self.patterns = [re.compile(re.sub(r'\(\?P<(\w+)>', replace, s)) for s in sources]
+
+    def match(self, text):
+        """Return a match object whose groupdict() holds the fields of text,
+        or None. Fields missing from the pattern that matched are absent."""
+        for pattern in self.patterns:
+            mo = pattern.match(text)
+            if mo is not None:
+                return mo
+        return None
+
+
+class Query(object):
+    """A conjunction of conditions on the fields of log lines.
+
+    Queries can test LogLine objects, with accept(), or raw lines of text
+    in the format of line_class, by calling the query.
+    """
+    def __init__(self, conditions, line_class=LogLine):
+        self.conditions = list(conditions)
+        self.line_class = line_class
+        self.fields = set(c.field for c in self.conditions)
+        unknown = self.fields - line_class.groups
+        if unknown:
+            raise ValueError("Unknown fields for %s: %s" % (line_class.name, ', '.join(sorted(unknown))))
+        self.projection = Projection(line_class, self.fields)
+        self.tests = [(c.field, c.test) for c in self.conditions]
+
+    def substrings(self):
+        """Return strings that must all appear in the text of any line
+        matching this query."""
+        strings = []
+        for c in self.conditions:
+            prefix, suffix = self.projection.contexts.get(c.field, ('', ''))
+            s = c.substring(prefix, suffix)
+            if s:
+                strings.append(s)
+        return strings
+
+    def prefilter(self):
+        """Return predicates for a :py:class:`~loglab.prefilters.PreFilter`
+        that accept only raw lines matching this query.
+
+        Fixed strings are checked first, then the query itself is tested by
+        parsing only the fields it needs.
+        """
+        return [Contains(s) for s in self.substrings()] + [self]
+
+    def test(self, values):
+        for field, test in self.tests:
+            if not test(values.get(field) or ''):
+                return False
+        return True
+
+    def __call__(self, text):
+        """Test a raw line of text."""
+        mo = self.projection.match(text)
+        if mo is not None:
+            return self.test(mo.groupdict())
+        try:
+            return self.accept(self.line_class(text))
+        except LogLineParseError:
+            return False
+
+    def accept(self, line):
+        """Test a LogLine."""
+        if line._parsed is None:
+            mo = self.projection.match(line.line)
+            if mo is not None:
+                return self.test(mo.groupdict())
+        for field, test in self.tests:
+            if not test(getattr(line, field)):
+                return False
+        return True
+
+
+def where(line_class=LogLine, **conditions):
+    """Construct a Query from keyword arguments of the form field=value or
+    field__lookup=value.
+
+    Lookups are exact (the default), ne, in, startswith, endswith, contains,
+    regex, and the numeric comparisons gt, gte, lt and lte. A callable value
+    is called with the field's value.
+    """
+    conds = []
+    for k, v in sorted(conditions.items()):
+        if '__' in k:
+            field, lookup = k.split('__', 1)
+        else:
+            field, lookup = k, 'exact'
+        conds.append(Condition(field, lookup, v))
+    return Query(conds, line_class=line_class)
+
+
+class Where(Filter):
+    """Filter to include only lines matching a query.
+
+    The query can be a :py:class:`Query`, or given as keyword arguments as
+    for :py:func:`where`.
+    """
+    stateless = True
+
+    def __init__(self, iterable, query=None, **conditions):
+        super(Where, self).__init__(iterable)
+        if query is None:
+            query = where(**conditions)
+        self.query = query
+        self.accept = query.accept
@@ -0,0 +1,309 @@
+# loglab - A library for stream-based log processing
+# Copyright (c) 2010 Crown copyright
+#
+# This file is part of loglab.
+#
+# loglab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# loglab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with loglab.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A persistent store of aggregated buckets, updated incrementally.
+
+Regenerating a report over months of logs by reading them all again takes
+ever longer. A :py:class:`RollupStore` keeps the buckets of an
+:py:class:`~loglab.aggregate.Aggregator` in an SQLite database, rolled up
+into hours and days, and records which input files it has read, so that
+each run only reads new or changed logs::
+
+    >>> agg = Aggregator([Count('requests'), CountWhere('error503s', code='503')], interval=60)
+    >>> store = RollupStore('uptime.db', agg)
+    >>> store.update(glob.glob('varnish/*/varnishncsa.log-*'), GZipLogFile)
+    >>> for start, values in store.query(interval=3600):
+    ...     print start, values['requests']
+"""
+
+import json
+import sqlite3
+
+from .incremental import file_signature
+
+__all__ = (
+    'RollupStore',
+)
+
+HOUR = 3600
+DAY = 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS inputs (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL
+);
+CREATE TABLE IF NOT EXISTS buckets (
+    level INTEGER,
+    start INTEGER,
+    input TEXT,
+    state TEXT,
+    PRIMARY KEY (level, start, input)
+);
+"""
+
+
+class RollupStore(object):
+    """Buckets of aggregator's columns for a set of input files, stored in
+    the SQLite database at path.
+
+    Buckets are stored at the aggregator's interval and at each of levels,
+    which must be multiples of it; as buckets start at multiples of their
+    interval since the epoch, days are UTC days. Buckets are stored
+    separately for each input, so that an input that changes, such as the
+    log currently being written, can be read again and its buckets replaced.
+
+    Inputs are identified by their path, size and modification time, so
+    logs should be rotated to names that do not change afterwards, such as
+    with logrotate's dateext option. With numbered names, such as .log.1,
+    the content at every path changes on each rotation, so every log is read
+    again and the buckets of the oldest are lost when it is overwritten.
+
+    A store can only be reopened with an aggregator with the same columns,
+    including the parameters that shape their state, such as a
+    :py:class:`~loglab.aggregate.Distinct` column's precision, and the same
+    interval.
+    """
+    def __init__(self, path, aggregator, levels=(HOUR, DAY)):
+        self.path = path
+        self.aggregator = aggregator
+        interval = aggregator.interval
+        for l in levels:
+            if l % interval:
+                raise ValueError("Rollup levels must be multiples of the aggregator's interval")
+        self.levels = sorted(set([interval] + list(levels)))
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.check_meta()
+        self.empty = self.encode(aggregator.empty())
+
+    def check_meta(self):
+        meta = {
+            'columns': [
+                {'name': c.name, 'type': type(c).__name__, 'params': c.params()}
+                for c in self.aggregator.columns
+            ],
+            'levels': self.levels,
+            'grouped': self.aggregator.group_by is not None,
+        }
+        db = self.db
+        row = db.execute("SELECT value FROM meta WHERE key = 'layout'").fetchone()
+        if row is None:
+            with db:
+                db.execute("INSERT INTO meta VALUES ('layout', ?)", (json.dumps(meta),))
+        elif json.loads(row[0]) != meta:
+            raise ValueError("%s was built with different columns, column parameters or levels" % self.path)
+
+    def encode(self, state):
+        return json.dumps(self.aggregator.dump(state), separators=(',', ':'), sort_keys=True)
+
+    def decode(self, data):
+        return self.aggregator.load(json.loads(data))
+
+    def is_current(self, path):
+        """Return True if path has been read and has not changed since."""
+        row = self.db.execute("SELECT size, mtime FROM inputs WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return False
+        sig = file_signature(path)
+        return row == (sig['size'], sig['mtime'])
+
+    def changed(self, paths):
+        """Return the paths in paths that are new or have changed."""
+        return [p for p in paths if not self.is_current(p)]
+
+    def inputs(self):
+        """Return the list of input paths that have been read."""
+        return [r[0] for r in self.db.execute("SELECT path FROM inputs ORDER BY path")]
+
+    def update(self, paths, open_log):
+        """Read the new or changed files among paths into the store.
+
+        open_log(path) should return an iterable of chronologically ordered
+        log lines for the input file path, such as a
+        :py:class:`~loglab.file_sources.GZipLogFile`. Returns the list of
+        paths that were read.
+        """
+        changed = self.changed(paths)
+        for path in changed:
+            # Take the signature first, so that lines written while the file
+            # is being read cause it to be read again next time
+            sig = file_signature(path)
+            self.add(path, open_log(path), sig)
+        return changed
+
+    def add(self, path, lines, signature=None):
+        """Replace the buckets of the input path with the aggregate of lines.
+
+        Each input is replaced in a single transaction, so an interrupted
+        update leaves the store as it was before that input.
+        """
+        agg = self.aggregator
+        base = agg.interval
+        rollups = [(l, {}) for l in self.levels if l != base]
+        merge = agg.merge
+        empty = self.empty
+
+        def rows():
+            for start, state in agg.buckets(lines):
+                data = self.encode(state)
+                if data == empty:
+                    continue
+                yield base, start, path, data
+                for level, buckets in rollups:
+                    k = start // level * level
+                    if k in buckets:
+                        buckets[k] = merge(buckets[k], state)
+                    else:
+                        buckets[k] = state
+
+        db = self.db
+        with db:
+            db.execute("DELETE FROM buckets WHERE input = ?", (path,))
+            db.executemany("INSERT INTO buckets VALUES (?, ?, ?, ?)", rows())
+            for level, buckets in rollups:
+                db.executemany(
+                    "INSERT INTO buckets VALUES (?, ?, ?, ?)",
+                    ((level, k, path, self.encode(s)) for k, s in buckets.iteritems())
+                )
+            if signature is None:
+                signature = file_signature(path)
+            db.execute(
+                "INSERT OR REPLACE INTO inputs VALUES (?, ?, ?)",
+                (path, signature['size'], signature['mtime'])
+            )
+
+    def forget(self, path):
+        """Remove the buckets of the input path from the store."""
+        db = self.db
+        with db:
+            db.execute("DELETE FROM buckets WHERE input = ?", (path,))
+            db.execute("DELETE FROM inputs WHERE path = ?", (path,))
+
+    def level_for(self, interval):
+        """Return the largest stored level that interval is a multiple of."""
+        levels = [l for l in self.levels if interval % l == 0]
+        if not levels:
+            raise ValueError("Interval must be a multiple of %d seconds" % self.levels[0])
+        return levels[-1]
+
+    def states(self, level, start=None, end=None):
+        """Generate (start, state) for the stored buckets of level between
+        start and end, in order, merging those of different inputs."""
+        sql = "SELECT start, state FROM buckets WHERE level = ?"
+        args = [level]
+        if start is not None:
+            sql += " AND start >= ?"
+            args.append(start)
+        if end is not None:
+            sql += " AND start < ?"
+            args.append(end)
+        sql += " ORDER BY start"
+
+        decode = self.decode
+        merge = self.aggregator.merge
+        current = None
+        state = None
+        for s, data in self.db.execute(sql, args):
+            if s != current:
+                if current is not None:
+                    yield current, state
+                current, state = s, decode(data)
+            else:
+                state = merge(state, decode(data))
+        if current is not None:
+            yield current, state
+
+    def query(self, start=None, end=None, interval=None):
+        """Generate (start, values) for buckets of interval seconds from
+        start up to end, as an Aggregator reading all of the inputs would.
+
+        interval defaults to the aggregator's interval, and must be a
+        multiple of it; buckets are read from the coarsest level that fits.
+        """
+        agg = self.aggregator
+        interval = interval or agg.interval
+        level = self.level_for(interval)
+        if start is not None:
+            start = start // interval * interval
+        result = agg.result
+        merge = agg.merge
+        current = None
+        state = None
+        for s, st in self.states(level, start, end):
+            b = s // interval * interval
+            if b != current:
+                if current is not None:
+                    yield current, result(state)
+                    if agg.fill_gaps:
+                        for gap in xrange(current + interval, b, interval):
+                            yield gap, result(agg.empty())
+                current, state = b, st
+            else:
+                state = merge(state, st)
+        if current is not None:
+            yield current, result(state)
+
+    def total(self, start=None, end=None):
+        """Return the values of the columns over all lines from start up to
+        end, which are rounded to the aggregator's interval.
+
+        The range is covered with as few stored buckets as possible: whole
+        days, then whole hours at either end, and so on.
+        """
+        agg = self.aggregator
+        base = self.levels[0]
+        if start is None or end is None:
+            lo, hi = self.db.execute(
+                "SELECT MIN(start), MAX(start) FROM buckets WHERE level = ?", (base,)
+            ).fetchone()
+            if lo is None:
+                return agg.result(agg.empty())
+            if start is None:
+                start = lo
+            if end is None:
+                end = hi + base
+        start = start // base * base
+        end = -(-end // base) * base
+
+        state = agg.empty()
+        for level, a, b in cover(start, end, self.levels[::-1]):
+            for s, st in self.states(level, a, b):
+                state = agg.merge(state, st)
+        return agg.result(state)
+
+    def close(self):
+        self.db.close()
+
+
+def cover(start, end, levels):
+    """Return a list of (level, start, end) ranges covering start to end,
+    using buckets of the largest of levels (in descending order) that fit."""
+    if start >= end or not levels:
+        return []
+    level = levels[0]
+    a = -(-start // level) * level
+    b = end // level * level
+    if a >= b:
+        return cover(start, end, levels[1:])
+    return cover(start, a, levels[1:]) + [(level, a, b)] + cover(b, end, levels[1:])
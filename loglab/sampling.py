@@ -0,0 +1,182 @@
+# loglab - A library for stream-based log processing
+# Copyright (c) 2010 Crown copyright
+#
+# This file is part of loglab.
+#
+# loglab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# loglab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with loglab.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Sampling of log lines, for making small previews of large logs.
+
+Samplers work equally on raw lines of text, as prefilters, and on parsed
+LogLines.
+"""
+
+import math
+import random
+import struct
+import hashlib
+from itertools import islice
+
+from .lineformats import LogLine
+from .filters import Filter
+from .query import Projection
+
+__all__ = (
+    'HashSampler', 'HashSample', 'RandomSampler', 'RandomSample',
+    'ReservoirSample'
+)
+
+
+class HashSampler(object):
+    """Deterministically select a fraction rate of lines by a key.
+
+    Each line's key is hashed, and the line is selected if the hash falls in
+    the bottom rate of the range of hash values. All lines with the same key
+    are therefore selected or not together, and repeated runs, or runs over
+    logs from different servers, select the same keys. A different salt
+    selects a different subset.
+
+    key may be the name of a field of line_class, a tuple of field names, or
+    a function that takes a raw line of text and returns a key string.
+
+    Calling a HashSampler with a raw line tests it without parsing more of
+    the line than is needed to extract the key fields, so it can be used as
+    a :py:class:`~loglab.prefilters.PreFilter` predicate.
+    """
+    def __init__(self, rate, key='ip', line_class=LogLine, salt=''):
+        if not 0 <= rate <= 1:
+            raise ValueError("rate must be between 0 and 1")
+        self.rate = rate
+        self.threshold = int(rate * 0x100000000)
+        self.salt = salt
+        if callable(key):
+            self.key = key
+            self.fields = None
+        else:
+            if isinstance(key, basestring):
+                key = (key,)
+            self.fields = tuple(key)
+            self.projection = Projection(line_class, self.fields)
+            self.key = self.raw_key
+
+    def raw_key(self, text):
+        mo = self.projection.match(text)
+        if mo is None:
+            # unparseable lines are sampled as a whole
+            return text
+        values = mo.groupdict()
+        return '\0'.join(values.get(f) or '' for f in self.fields)
+
+    def selects(self, key):
+        """Return True if lines with the given key are selected."""
+        digest = hashlib.md5(self.salt + key).digest()
+        return struct.unpack('<I', digest[:4])[0] < self.threshold
+
+    def __call__(self, text):
+        return self.selects(self.key(text))
+
+    def accept(self, line):
+        if self.fields is None:
+            return self.selects(self.key(str(line)))
+        return self.selects('\0'.join(getattr(line, f) for f in self.fields))
+
+
+class HashSample(Filter):
+    """Filter selecting lines with a :py:class:`HashSampler`.
+
+    The input may be raw lines or LogLines.
+    """
+    stateless = True
+
+    def __init__(self, iterable, rate, key='ip', line_class=LogLine, salt=''):
+        super(HashSample, self).__init__(iterable)
+        self.sampler = HashSampler(rate, key, line_class, salt)
+
+    def accept(self, line):
+        if isinstance(line, basestring):
+            return self.sampler(line)
+        return self.sampler.accept(line)
+
+
+class RandomSampler(object):
+    """Select each line independently with probability rate.
+
+    Given the same seed, the same lines of the same input are selected.
+    """
+    def __init__(self, rate, seed=None):
+        if not 0 <= rate <= 1:
+            raise ValueError("rate must be between 0 and 1")
+        self.rate = rate
+        self.random = random.Random(seed).random
+
+    def __call__(self, line):
+        return self.random() < self.rate
+
+    accept = __call__
+
+
+class RandomSample(Filter):
+    """Filter selecting each line independently with probability rate."""
+    def __init__(self, iterable, rate, seed=None):
+        super(RandomSample, self).__init__(iterable)
+        self.accept = RandomSampler(rate, seed)
+
+
+class ReservoirSample(object):
+    """Select exactly n lines uniformly at random from the input, or all of
+    the lines if there are fewer than n.
+
+    The whole input is read before any lines are yielded; the sample is then
+    yielded in its original order. Lines that are not selected are skipped
+    in runs without being examined, using Li's Algorithm L.
+    """
+    def __init__(self, iterable, n, seed=None):
+        self.iterable = iterable
+        self.n = n
+        self.random = random.Random(seed)
+
+    def sample(self):
+        """Return a list of the selected lines."""
+        n = self.n
+        if n <= 0:
+            return []
+        def rand():
+            # a uniform random number in (0, 1), as its log is taken
+            u = 0.0
+            while u == 0.0:
+                u = self.random.random()
+            return u
+
+        it = iter(self.iterable)
+        reservoir = list(enumerate(islice(it, n)))
+        if len(reservoir) < n:
+            return [l for i, l in reservoir]
+
+        i = n - 1
+        w = math.exp(math.log(rand()) / n)
+        while True:
+            skip = int(math.log(rand()) / math.log(1 - w))
+            for l in islice(it, skip, skip + 1):
+                break
+            else:
+                break
+            i += skip + 1
+            reservoir[self.random.randrange(n)] = (i, l)
+            w *= math.exp(math.log(rand()) / n)
+
+        reservoir.sort()
+        return [l for i, l in reservoir]
+
+    def __iter__(self):
+        return iter(self.sample())
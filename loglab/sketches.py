@@ -0,0 +1,365 @@
+# loglab - A library for stream-based log processing
+# Copyright (c) 2010 Crown copyright
+#
+# This file is part of loglab.
+#
+# loglab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# loglab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with loglab.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compact, mergeable summaries of large streams of values.
+
+Sketches use a small, bounded amount of memory however many values they
+summarise, and sketches of different parts of a stream, for example from
+different servers or worker processes, can be merged into exactly the
+sketch that would have been built from the whole stream.
+"""
+
+import math
+import heapq
+import base64
+import struct
+import hashlib
+
+__all__ = (
+    'QuantileSketch', 'HyperLogLog', 'SpaceSaving',
+)
+
+
+class QuantileSketch(object):
+    """Estimates quantiles of a stream of non-negative values to within a
+    relative accuracy.
+
+    Values are counted in buckets whose boundaries grow geometrically, so
+    that any quantile is estimated to within relative_accuracy of a value
+    actually at that rank. Values below min_value, including zero, are
+    counted in a single bucket and estimated as zero. Memory depends on the
+    range of the values, not their number: at 1% accuracy, values from 1
+    to 10^9 need at most about a thousand buckets.
+
+    As buckets only hold counts, merging sketches is exact.
+    """
+    def __init__(self, relative_accuracy=0.01, min_value=1e-9):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def index(self, x):
+        """Return the index of the bucket containing x."""
+        return int(math.ceil(math.log(x) / self.log_gamma))
+
+    def add(self, x, n=1):
+        """Add n occurrences of the value x."""
+        if x < 0:
+            raise ValueError("QuantileSketch only accepts non-negative values")
+        if x < self.min_value:
+            self.zeros += n
+        else:
+            i = self.index(x)
+            self.buckets[i] = self.buckets.get(i, 0) + n
+        self.count += n
+        self.sum += x * n
+        if self.min is None or x < self.min:
+            self.min = x
+        if self.max is None or x > self.max:
+            self.max = x
+
+    def compatible(self, other):
+        return (self.relative_accuracy, self.min_value) == (other.relative_accuracy, other.min_value)
+
+    def merge(self, other):
+        """Add the values summarised by other to this sketch."""
+        if not self.compatible(other):
+            raise ValueError("Cannot merge sketches with different parameters")
+        buckets = self.buckets
+        for i, n in other.buckets.iteritems():
+            buckets[i] = buckets.get(i, 0) + n
+        self.zeros += other.zeros
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def copy(self):
+        s = QuantileSketch(self.relative_accuracy, self.min_value)
+        s.merge(self)
+        return s
+
+    def value(self, i):
+        """Return the estimate for values in bucket i."""
+        return 2 * self.gamma ** i / (self.gamma + 1)
+
+    def quantile(self, q):
+        """Return an estimate of the q-quantile (0 <= q <= 1) of the values,
+        or None if there are none."""
+        if not self.count:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if seen > rank:
+            return 0.0
+        for i in sorted(self.buckets):
+            seen += self.buckets[i]
+            if seen > rank:
+                # Estimates never lie outside the values actually seen
+                return min(max(self.value(i), self.min), self.max)
+        return self.max
+
+    def quantiles(self, qs):
+        """Return a list of estimates of each of the quantiles qs."""
+        return [self.quantile(q) for q in qs]
+
+    def mean(self):
+        if not self.count:
+            return None
+        return float(self.sum) / self.count
+
+    def to_dict(self):
+        """Return the sketch as a dictionary that can be serialised as JSON."""
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'min_value': self.min_value,
+            'buckets': dict((str(i), n) for i, n in self.buckets.iteritems()),
+            'zeros': self.zeros,
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        """Reconstruct a sketch from the output of to_dict()."""
+        s = cls(d['relative_accuracy'], d['min_value'])
+        s.buckets = dict((int(i), n) for i, n in d['buckets'].iteritems())
+        s.zeros = d['zeros']
+        s.count = d['count']
+        s.sum = d['sum']
+        s.min = d['min']
+        s.max = d['max']
+        return s
+
+    def __eq__(self, other):
+        return isinstance(other, QuantileSketch) and self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class HyperLogLog(object):
+    """Estimates the number of distinct strings in a stream.
+
+    The sketch holds 2 ** precision one-byte registers, whatever the number
+    of strings added, and its estimates have a relative standard error of
+    about 1.04 / sqrt(2 ** precision): 0.8% with the default precision of
+    14, using 16KB. Merging sketches is exact: the merged sketch is the one
+    that would have been built from all of the strings.
+    """
+    def __init__(self, precision=14):
+        if not 4 <= precision <= 18:
+            raise ValueError("precision must be between 4 and 18")
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+        self.width = 64 - precision
+        self.mask = (1 << self.width) - 1
+        if self.m >= 128:
+            self.alpha = 0.7213 / (1 + 1.079 / self.m)
+        else:
+            self.alpha = {16: 0.673, 32: 0.697, 64: 0.709}[self.m]
+
+    def add(self, value):
+        """Add the string value."""
+        h, = struct.unpack('<Q', hashlib.md5(value).digest()[:8])
+        i = h >> self.width
+        rank = self.width - (h & self.mask).bit_length() + 1
+        if rank > self.registers[i]:
+            self.registers[i] = rank
+
+    def merge(self, other):
+        """Add the strings counted by other to this sketch."""
+        if self.precision != other.precision:
+            raise ValueError("Cannot merge sketches with different precisions")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def copy(self):
+        s = HyperLogLog(self.precision)
+        s.registers = bytearray(self.registers)
+        return s
+
+    def count(self):
+        """Return the estimated number of distinct strings added."""
+        m = self.m
+        registers = self.registers
+        estimate = self.alpha * m * m / sum(2.0 ** -r for r in registers)
+        if estimate <= 2.5 * m:
+            # Small cardinalities are estimated better by linear counting
+            zeros = registers.count('\0')
+            if zeros:
+                estimate = m * math.log(float(m) / zeros)
+        return int(round(estimate))
+
+    def to_dict(self):
+        """Return the sketch as a dictionary that can be serialised as JSON."""
+        return {
+            'precision': self.precision,
+            'registers': base64.b64encode(str(self.registers)),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        """Reconstruct a sketch from the output of to_dict()."""
+        s = cls(d['precision'])
+        s.registers = bytearray(base64.b64decode(d['registers']))
+        return s
+
+    def __eq__(self, other):
+        return isinstance(other, HyperLogLog) and (self.precision, self.registers) == (other.precision, other.registers)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class SpaceSaving(object):
+    """Finds the most frequent strings in a stream, in bounded memory.
+
+    At most capacity strings are counted. When a new string arrives and the
+    table is full, the string with the smallest count is evicted and the new
+    string takes over its count, recording that count as its possible
+    error. Each string's count is therefore an upper bound on its true
+    frequency, and its count less its error a lower bound; no string's
+    count is overestimated by more than total / capacity.
+
+    Eviction finds the smallest count with a heap that is only brought up
+    to date lazily, so counting a string that is already in the table costs
+    a single dictionary update.
+    """
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.heap = []
+        self.total = 0
+
+    def add(self, key, n=1):
+        """Count n occurrences of key."""
+        self.total += n
+        counts = self.counts
+        if key in counts:
+            counts[key] += n
+            return
+        if len(counts) < self.capacity:
+            counts[key] = n
+            self.errors[key] = 0
+            heapq.heappush(self.heap, (n, key))
+            return
+
+        # Evict the key with the smallest count. Counts only increase, so
+        # heap entries whose count has changed are pushed back with their
+        # current count until the smallest is found.
+        heap = self.heap
+        while True:
+            c, k = heap[0]
+            current = counts[k]
+            if current == c:
+                break
+            heapq.heapreplace(heap, (current, k))
+        heapq.heapreplace(heap, (c + n, key))
+        del counts[k]
+        del self.errors[k]
+        counts[key] = c + n
+        self.errors[key] = c
+
+    def min_count(self):
+        """Return the largest count a string not in the table could have."""
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.itervalues())
+
+    def top(self, n=None):
+        """Return a list of up to n (key, count, error) tuples for the most
+        frequent strings, most frequent first.
+
+        The true frequency of each string lies between count - error and
+        count.
+        """
+        errors = self.errors
+        items = sorted(self.counts.iteritems(), key=lambda kv: (-kv[1], kv[0]))
+        if n is not None:
+            items = items[:n]
+        return [(k, c, errors[k]) for k, c in items]
+
+    def merge(self, other):
+        """Add the strings counted by other to this sketch.
+
+        A string missing from either table may have been counted up to that
+        table's smallest count, so that is added to its count and its error.
+        The bounds on each string's frequency still hold, and the error is
+        at most the combined total divided by the capacity.
+        """
+        min_self = self.min_count()
+        min_other = other.min_count()
+        counts = {}
+        errors = {}
+        for k in set(self.counts) | set(other.counts):
+            counts[k] = self.counts.get(k, min_self) + other.counts.get(k, min_other)
+            errors[k] = self.errors.get(k, min_self) + other.errors.get(k, min_other)
+        if len(counts) > self.capacity:
+            keep = sorted(counts, key=lambda k: (-counts[k], k))[:self.capacity]
+            counts = dict((k, counts[k]) for k in keep)
+            errors = dict((k, errors[k]) for k in keep)
+        self.counts = counts
+        self.errors = errors
+        self.heap = [(c, k) for k, c in counts.iteritems()]
+        heapq.heapify(self.heap)
+        self.total += other.total
+
+    def copy(self):
+        s = SpaceSaving(self.capacity)
+        s.counts = dict(self.counts)
+        s.errors = dict(self.errors)
+        s.heap = list(self.heap)
+        s.total = self.total
+        return s
+
+    def to_dict(self):
+        """Return the sketch as a dictionary that can be serialised as JSON."""
+        return {
+            'capacity': self.capacity,
+            'total': self.total,
+            'counts': [[k, c, self.errors[k]] for k, c in self.counts.iteritems()],
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        """Reconstruct a sketch from the output of to_dict()."""
+        s = cls(d['capacity'])
+        s.total = d['total']
+        for k, c, e in d['counts']:
+            s.counts[k] = c
+            s.errors[k] = e
+        s.heap = [(c, k) for k, c in s.counts.iteritems()]
+        heapq.heapify(s.heap)
+        return s
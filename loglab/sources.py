@@ -2,21 +2,41 @@ import heapq
 from .lineformats import LogLineParseError, LogLine
 
 __all__ = (
-    'LogLineSource', 'LogBuffer', 'OrderedSource'
+    'LogLineSource', 'LogBuffer', 'OrderedSource', 'close_source'
 )
 
 
+def close_source(source):
+    """Close source, if it is an object that can be closed.
+
+    This allows a consumer that has stopped reading from a pipeline to
+    release any files or processes held open by the sources feeding it.
+    """
+    try:
+        close = source.close
+    except AttributeError:
+        return
+    close()
+
+
 class LogLineSource(object):
     """Reads log lines from an iterable and wraps it in LogLine"""
     def __init__(self, iterable, line_class=LogLine, ignore_invalid=True):
         """Construct a LogLine source that wraps lines from iterable in LogLine,
         skipping lines that do not contain a timestamp if ignore_invalid is True.
 
+        The number of lines skipped is counted in the attribute invalid.
+
         """
+        self.invalid = 0
+        self.source = iterable
         self.iterable = enumerate(iterable)
         self.line_class = line_class
         self.ignore_invalid = ignore_invalid
 
+    def close(self):
+        close_source(self.source)
+
     def __iter__(self):
         """Return the next parsable log line.
 
@@ -29,6 +49,7 @@ class LogLineSource(object):
             except LogLineParseError:
                 if not self.ignore_invalid:
                     raise
+                self.invalid += 1
 
 
 class LogBuffer(object):
@@ -41,6 +62,7 @@ class LogBuffer(object):
 
     def __init__(self, iterable, window_size=1000):
         """Construct an LogBuffer around an iterable sequence of log lines"""
+        self.source = iterable
         self.iterable = iter(iterable)
 
         self.window_size = window_size
@@ -60,6 +82,9 @@ class LogBuffer(object):
             self.heap.append(l)
         heapq.heapify(self.heap)
 
+    def close(self):
+        close_source(self.source)
+
     def __iter__(self):
         """Iterate through log lines in sorted order"""
         while True:
@@ -84,9 +109,21 @@ class OrderedSource(object):
         self.window_size = window_size
         self.line_class = line_class
         self.ignore_invalid = ignore_invalid
+        self.line_source = None
+        self.buffer = None
+
+    def close(self):
+        close_source(self.iterable)
+
+    @property
+    def invalid(self):
+        """The number of lines that could not be parsed so far."""
+        if self.line_source is None:
+            return 0
+        return self.line_source.invalid
 
     def __iter__(self):
-        source = LogLineSource(self.iterable, line_class=self.line_class, ignore_invalid=self.ignore_invalid)
-        log = LogBuffer(source, window_size=self.window_size)
-        return iter(log)
+        self.line_source = LogLineSource(self.iterable, line_class=self.line_class, ignore_invalid=self.ignore_invalid)
+        self.buffer = LogBuffer(self.line_source, window_size=self.window_size)
+        return iter(self.buffer)
 
@@ -0,0 +1,348 @@
+# loglab - A library for stream-based log processing
+# Copyright (c) 2010 Crown copyright
+#
+# This file is part of loglab.
+#
+# loglab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# loglab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with loglab.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Serve the recent output of a live aggregation to monitoring.
+
+A :py:class:`BucketRing` keeps the last few buckets output by an
+:py:class:`~loglab.aggregate.Aggregator` in memory, and a
+:py:class:`StatsServer` answers HTTP requests for them from an
+:py:class:`~loglab.events.EventLoop`, as JSON or in the Prometheus text
+format::
+
+    >>> ring = BucketRing(agg, size=60)
+    >>> server = StatsServer(loop, ring, ('127.0.0.1', 8053))
+    >>> for start, values in ring.record(agg.aggregate(log)):
+    ...     pass
+
+Requests are read and answered in the loop's thread between lines,
+without blocking, so they see a consistent state and a slow client cannot
+hold up the log.
+"""
+
+import os
+import re
+import time
+import json
+import errno
+import socket
+import urlparse
+from collections import deque
+
+__all__ = (
+    'BucketRing', 'StatsServer',
+)
+
+
+class BucketRing(object):
+    """Holds the last size buckets output by aggregator.
+
+    Buckets are added by passing the aggregator's output through
+    :py:meth:`record`, or by calling :py:meth:`append`. The bucket still
+    being filled is read from the aggregator itself.
+    """
+    def __init__(self, aggregator, size=60):
+        self.aggregator = aggregator
+        self.buckets = deque(maxlen=size)
+        self.updated = None
+
+    def append(self, start, values):
+        self.buckets.append((start, values))
+        self.updated = time.time()
+
+    def record(self, stream):
+        """Generate the (start, values) of stream, keeping each bucket."""
+        for start, values in stream:
+            self.append(start, values)
+            yield start, values
+
+    def recent(self, n=None):
+        """Return a list of the last n complete buckets, oldest first."""
+        buckets = list(self.buckets)
+        if n is not None:
+            buckets = buckets[-n:] if n > 0 else []
+        return buckets
+
+    def partial(self):
+        """Return (start, values) for the bucket being filled, or None."""
+        return self.aggregator.partial()
+
+    def staleness(self, now=None):
+        """Return the number of seconds since the time of the newest line
+        aggregated, or None if there have been no lines."""
+        latest = self.aggregator.latest
+        if latest is None:
+            return None
+        if now is None:
+            now = time.time()
+        return now - latest
+
+    def snapshot(self, n=None, now=None):
+        """Return the recent buckets as a dictionary that can be serialised
+        as JSON."""
+        if now is None:
+            now = time.time()
+        partial = self.partial()
+        if partial is not None:
+            partial = {'start': partial[0], 'values': partial[1]}
+        return {
+            'interval': self.aggregator.interval,
+            'now': now,
+            'latest': self.aggregator.latest,
+            'staleness': self.staleness(now),
+            'updated': self.updated,
+            'buckets': [{'start': s, 'values': v} for s, v in self.recent(n)],
+            'partial': partial,
+        }
+
+    def prometheus(self, prefix='loglab', now=None):
+        """Return the latest complete bucket and the bucket being filled in
+        the Prometheus text exposition format.
+
+        Numeric columns become gauges labelled with bucket="complete" or
+        bucket="partial", and group="..." if the aggregator groups lines.
+        Quantiles are labelled with quantile="0.99" and so on; other values,
+        such as the lists of top values, are omitted.
+        """
+        samples = {}
+        names = []
+        buckets = []
+        if self.buckets:
+            buckets.append(('complete', self.buckets[-1]))
+        partial = self.partial()
+        if partial is not None:
+            buckets.append(('partial', partial))
+
+        def add(name, labels, value):
+            if name not in samples:
+                samples[name] = []
+                names.append(name)
+            samples[name].append((labels, value))
+
+        grouped = self.aggregator.group_by is not None
+        for label, (start, values) in buckets:
+            labels = [('bucket', label)]
+            add('bucket_start_seconds', labels, start)
+            if grouped:
+                for group, vs in sorted(values.iteritems()):
+                    add_values(add, labels + [('group', group)], vs)
+            else:
+                add_values(add, labels, values)
+
+        staleness = self.staleness(now)
+        if staleness is not None:
+            add('staleness_seconds', [], staleness)
+
+        out = []
+        for name in names:
+            metric = re.sub(r'[^a-zA-Z0-9_]', '_', '%s_%s' % (prefix, name))
+            out.append('# TYPE %s gauge\n' % metric)
+            for labels, value in samples[name]:
+                if labels:
+                    labels = '{%s}' % ','.join('%s="%s"' % (k, escape_label(v)) for k, v in labels)
+                else:
+                    labels = ''
+                out.append('%s%s %s\n' % (metric, labels, format_value(value)))
+        return ''.join(out)
+
+
+def add_values(add, labels, values):
+    for name, value in sorted(values.iteritems()):
+        if isinstance(value, dict):
+            for q, v in sorted(value.iteritems()):
+                if isinstance(v, (int, long, float)):
+                    add(name, labels + [('quantile', quantile_label(q))], v)
+        elif isinstance(value, (int, long, float)) and not isinstance(value, bool):
+            add(name, labels, value)
+
+
+def quantile_label(key):
+    """Return the Prometheus quantile label for a key of a Quantiles
+    column's value, e.g. 0.99 for p99."""
+    if key.startswith('p'):
+        try:
+            return '%g' % (float(key[1:]) / 100)
+        except ValueError:
+            pass
+    return key
+
+
+def escape_label(v):
+    return unicode(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(v):
+    if isinstance(v, float):
+        return repr(v)
+    return str(v)
+
+
+# Reason phrases for the statuses sent
+RESPONSES = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+}
+
+
+def handle_request(ring, request):
+    """Answer the request line of an HTTP request for ring's buckets,
+    returning (status, content_type, body).
+
+    GET /stats returns JSON and GET /metrics the Prometheus text format.
+    /stats accepts a parameter n, the number of complete buckets to return.
+    """
+    words = request.split()
+    if len(words) not in (2, 3):
+        return 400, 'text/plain', 'Bad request\n'
+    method, target = words[:2]
+    if method not in ('GET', 'HEAD'):
+        return 405, 'text/plain', 'Method not allowed\n'
+    path, _, query = target.partition('?')
+    params = urlparse.parse_qs(query)
+    if path in ('/', '/stats', '/stats.json'):
+        try:
+            n = int(params['n'][0]) if 'n' in params else None
+        except ValueError:
+            return 400, 'text/plain', 'n must be an integer\n'
+        return 200, 'application/json', json.dumps(ring.snapshot(n))
+    elif path == '/metrics':
+        return 200, 'text/plain; version=0.0.4', ring.prometheus().encode('utf8')
+    return 404, 'text/plain', 'Not found\n'
+
+
+class StatsConnection(object):
+    """A connection to a StatsServer. The request is read and the response
+    written as the socket becomes ready, so a slow or idle client never
+    blocks the loop; a connection still open after the server's timeout is
+    dropped."""
+
+    # Longest request head read before giving up
+    max_request = 8192
+
+    def __init__(self, server, sock):
+        self.server = server
+        self.loop = server.loop
+        self.sock = sock
+        self.request = ''
+        self.response = ''
+        sock.setblocking(0)
+        self.loop.add_reader(sock, self.readable)
+        self.timer = self.loop.call_later(server.timeout, self.close)
+
+    def readable(self):
+        try:
+            data = self.sock.recv(4096)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            self.close()
+            return
+        if not data:
+            self.close()
+            return
+        self.request += data
+        head = re.split(r'\r?\n\r?\n', self.request, 1)
+        if len(head) == 2:
+            self.respond(*handle_request(self.server.ring, head[0].split('\n', 1)[0]))
+        elif len(self.request) > self.max_request:
+            self.respond(400, 'text/plain', 'Request too long\n')
+
+    def respond(self, status, content_type, body):
+        self.loop.remove_reader(self.sock)
+        head = 'HTTP/1.0 %d %s\r\n' % (status, RESPONSES[status])
+        head += 'Content-Type: %s\r\n' % content_type
+        head += 'Content-Length: %d\r\n' % len(body)
+        head += 'Connection: close\r\n\r\n'
+        if self.request.startswith('HEAD '):
+            body = ''
+        self.response = head + body
+        self.loop.add_writer(self.sock, self.writable)
+
+    def writable(self):
+        try:
+            sent = self.sock.send(self.response)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            self.close()
+            return
+        self.response = self.response[sent:]
+        if not self.response:
+            self.close()
+
+    def close(self):
+        self.loop.remove_reader(self.sock)
+        self.loop.remove_writer(self.sock)
+        self.timer.cancel()
+        self.sock.close()
+        self.server.connections.discard(self)
+
+
+class StatsServer(object):
+    """Serves the buckets in ring over HTTP from loop.
+
+    address is a (host, port) tuple to listen on TCP, or the path of a Unix
+    socket. Connections are accepted, read and written without blocking as
+    their sockets become ready, and closed if not complete within timeout
+    seconds.
+    """
+    def __init__(self, loop, ring, address, timeout=5, backlog=16):
+        self.loop = loop
+        self.ring = ring
+        self.timeout = timeout
+        self.connections = set()
+        if isinstance(address, basestring):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            # Remove the socket left behind by a previous run
+            if os.path.exists(address):
+                os.unlink(address)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(address)
+        self.sock.listen(backlog)
+        self.sock.setblocking(0)
+        loop.add_reader(self.sock, self.accept)
+
+    @property
+    def address(self):
+        """The address listened on, including the port chosen if 0 was
+        given."""
+        return self.sock.getsockname()
+
+    def accept(self):
+        try:
+            sock, address = self.sock.accept()
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR, errno.ECONNABORTED):
+                return
+            raise
+        self.connections.add(StatsConnection(self, sock))
+
+    def close(self):
+        for connection in list(self.connections):
+            connection.close()
+        self.loop.remove_reader(self.sock)
+        address = self.address
+        self.sock.close()
+        if isinstance(address, basestring):
+            try:
+                os.unlink(address)
+            except OSError:
+                pass
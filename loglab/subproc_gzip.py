@@ -32,9 +32,9 @@ GZIP = '/bin/gzip'
 
 
 def open(filename, mode='rb'):
-    if mode[0] in ['w', 'wb']:
+    if mode[0] in ['w', 'a']:
         return Writer(filename, mode)
-    elif mode[0] in ['r', 'rb']:
+    elif mode[0] == 'r':
         return Reader(filename, mode)
     else:
         raise NotImplementedError("subproc_gzip.open() does not support mode '%s'" % mode)
@@ -43,7 +43,14 @@ def open(filename, mode='rb'):
 class Writer(object):
     def __init__(self, filename, mode):
         self.closed = False
-        self.fd = os.open(filename, os.O_WRONLY | os.O_CREAT)
+        flags = os.O_WRONLY | os.O_CREAT
+        if mode[0] == 'a':
+            # gzip concatenates members, so appending a new gzip stream
+            # extends the existing one
+            flags |= os.O_APPEND
+        else:
+            flags |= os.O_TRUNC
+        self.fd = os.open(filename, flags)
         self.proc = subprocess.Popen([GZIP, '-'], stdin=subprocess.PIPE, stdout=self.fd)
         os.close(self.fd)
 
@@ -85,7 +92,11 @@ class Reader(object):
     def close(self):
         if self.closed:
             raise OSError("subproc_gzip.Reader is already closed")
+        if self.proc.poll() is None:
+            # Closed before the end of the file; stop gzip rather than let it
+            # fail writing to a closed pipe
+            self.proc.terminate()
         self._stdout.close()
         self.proc.stdout.close()
-        #self.proc.wait()
+        self.proc.wait()
         self.closed = True
@@ -17,15 +17,49 @@
 # along with loglab.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import select
 import time
+import heapq
+import errno
+import select
+
+from . import inotify
+from .lineformats import LogLine, LogLineParseError
+
+__all__ = (
+    'TailSource', 'MultiTailSource',
+)
+
+# Maximum number of bytes to read at a time
+CHUNK_SIZE = 1 << 16
+
+# Seconds between checks for new data when inotify is not available
+POLL_INTERVAL = 2
 
 
 class TailSource(object):
     """Tails a logfile, yielding lines in real time.
+
+    Where inotify is available, the tail wakes up as soon as the file is
+    written to, and uses no CPU while it is idle; otherwise it polls the file
+    every poll_interval seconds. Pass use_inotify=False to force polling.
+
+    The file is read at most chunk_size bytes at a time, so a large backlog
+    is processed in bounded pieces.
+
+    If follow is True, the tail follows the log through rotation. When the
+    file is renamed or deleted and a new file created in its place, the rest
+    of the old file is read before switching to the new one, which is read
+    from the start. When the file is truncated in place, as by logrotate's
+    copytruncate option, it is read again from the start. Lines written to a
+    truncated file before the truncation is noticed can still be lost, as
+    with any tail of a file rotated with copytruncate.
     """
-    def __init__(self, logfile, from_start=False):
+    def __init__(self, logfile, from_start=False, chunk_size=CHUNK_SIZE, poll_interval=POLL_INTERVAL, use_inotify=True, follow=True):
+        self.logfile = logfile
         self.f = open(logfile, 'r')
+        self.chunk_size = chunk_size
+        self.poll_interval = poll_interval
+        self.follow = follow
 
         self.keeprunning = True
 
@@ -40,77 +74,390 @@ class TailSource(object):
             except IOError:
                 self.f.seek(0, os.SEEK_END)
 
-            # skip the first line in case it is incomplete
-            self.started = False
+            # skip the first line in case it is incomplete, unless we are
+            # at the start of the file
+            self.started = self.f.tell() == 0
+
+        # holder for incomplete final line
+        self.incomplete = ''
+
+        self.inotify = None
+        self.wd = None
+        if use_inotify:
+            try:
+                self.inotify = inotify.INotify()
+            except inotify.INotifyUnavailable:
+                pass
+            else:
+                self.wd = self.inotify.add_watch(logfile, inotify.IN_MODIFY)
+                if follow:
+                    # Wake up when a new log is created in place of this one
+                    directory = os.path.dirname(logfile) or '.'
+                    self.inotify.add_watch(directory, inotify.IN_CREATE | inotify.IN_MOVED_TO)
+
+        # stop() writes to this pipe to wake up a blocked iterator
+        self.wakeup_r, self.wakeup_w = os.pipe()
 
     def stop(self):
+        """Stop iterating, waking up the iterator if it is waiting."""
         self.keeprunning = False
+        try:
+            os.write(self.wakeup_w, 'x')
+        except OSError:
+            pass
 
-    def __iter__(self):
-        """Iterate over lines added to the file since it was opened.
+    def close(self):
+        self.stop()
+        if self.inotify:
+            self.inotify.close()
+        for fd in (self.wakeup_r, self.wakeup_w):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self.f.close()
 
-        Blocks until new lines are available to read, so must be wrapped as
-        a thread if non-blocking behaviour is required.
+    def wait(self, timeout=None):
+        """Block until the file may have been written to or rotated, or
+        until timeout seconds have elapsed.
+
+        Without inotify, this waits for the poll interval (or timeout, if
+        shorter).
+        """
+        if self.inotify:
+            fds = [self.inotify, self.wakeup_r]
+        else:
+            fds = [self.wakeup_r]
+            if timeout is None or timeout > self.poll_interval:
+                timeout = self.poll_interval
+        try:
+            if timeout is None:
+                r, w, x = select.select(fds, [], [])
+            else:
+                r, w, x = select.select(fds, [], [], timeout)
+        except select.error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return
+        if self.inotify in r:
+            self.inotify.read_events()
+
+    def read_chunk(self):
+        """Read up to chunk_size bytes, returning a list of the complete
+        lines read, or None if there was no new data to read.
 
         This method takes care not to output a partial line by only outputting
         lines that are terminated by a newline. It also skips the first line as
         it does not know whether this is the start of a line.
         """
-        # holder for incomplete final line
-        incomplete = ''
+        buf = os.read(self.f.fileno(), self.chunk_size)
+        if not buf:
+            return None
 
-        while self.keeprunning:
-            # Minimum time to wait for some data to accrue
-            #
-            # This is necessary so that we're not using CPU time
-            # processing very small chunks of data
-            time.sleep(2)
+        # split the block we've read into lines
+        #
+        # NB. splitlines() has the wrong semantics:
+        #
+        # '\n'.splitlines() == [''] but '\n'.split('\n') == ['', '']
+        #
+        ls = buf.split('\n')
 
-            # block until the file has data
-            r, w, x = select.select([self.f], [], [self.f])
+        # the first line is part of the same line as in the incomplete buffer
+        self.incomplete += ls.pop(0)
 
-            if x:
-                break
+        # if we still haven't received a new line, the incomplete buffer is
+        # still incomplete
+        if len(ls) == 0:
+            # line still incomplete
+            return []
 
-            buf = self.f.read()
-            if not buf:
-                continue
+        # otherwise, we can output the incomplete buffer (but only if we've read
+        # at least one line)
+        lines = []
+        if self.started and self.incomplete:
+            lines.append(self.incomplete)
+        self.started = True
+
+        # The last line has not been terminated by a newline, and so goes
+        # into our incomplete line buffer
+        #
+        # This is why we need split() above - so that if buf ends with a
+        # newline, the last item will be the empty string and thus clears
+        # the incomplete buffer
+        self.incomplete = ls.pop()
+
+        lines.extend(ls)
+        return lines
 
-            # split the block we've read into lines
-            #
-            # NB. splitlines() has the wrong semantics:
-            #
-            # '\n'.splitlines() == [''] but '\n'.split('\n') == ['', '']
-            #
-            ls = buf.split('\n')
-
-            # the first line is part of the same line as in the incomplete buffer
-            incomplete += ls.pop(0)
-
-            # if we still haven't received a new line, the incomplete buffer is
-            # still incomplete
-            if len(ls) == 0:
-                # line still incomplete
+    def rotated(self):
+        """Check whether the log has been rotated.
+
+        Returns 'moved' if a different file now exists at the log's path,
+        'truncated' if the file has been truncated below the current read
+        position, or None.
+        """
+        try:
+            st = os.stat(self.logfile)
+        except OSError:
+            # The log has been moved away but not yet replaced
+            return None
+        fd = self.f.fileno()
+        fst = os.fstat(fd)
+        if (st.st_ino, st.st_dev) != (fst.st_ino, fst.st_dev):
+            return 'moved'
+        if fst.st_size < os.lseek(fd, 0, os.SEEK_CUR):
+            return 'truncated'
+        return None
+
+    def reopen(self):
+        """Follow the log if it has been rotated.
+
+        This should only be called once the old file has been read to the
+        end. Returns a list of lines to output, which contains any
+        unterminated final line of the old file, or None if the log has not
+        been rotated.
+        """
+        rotation = self.rotated()
+        if rotation is None:
+            return None
+
+        if rotation == 'moved':
+            try:
+                f = open(self.logfile, 'r')
+            except IOError:
+                return None
+            # Drain anything written to the old file since it was last read
+            lines = self.read_lines(follow=False)
+            self.f.close()
+            self.f = f
+            if self.inotify:
+                try:
+                    self.inotify.rm_watch(self.wd)
+                except OSError:
+                    # The watch was removed when the old file was deleted
+                    pass
+                self.wd = self.inotify.add_watch(self.logfile, inotify.IN_MODIFY)
+        else:
+            lines = []
+            os.lseek(self.f.fileno(), 0, os.SEEK_SET)
+
+        # The unterminated last line of the old file will never be completed
+        if self.started and self.incomplete:
+            lines.append(self.incomplete)
+        self.incomplete = ''
+        self.started = True
+        return lines
+
+    def read_lines(self, follow=None):
+        """Return a list of the complete lines that are available to read,
+        without blocking.
+
+        If the log has been rotated, lines are also read from the new file,
+        unless follow is False.
+        """
+        if follow is None:
+            follow = self.follow
+        lines = []
+        while True:
+            chunk = self.read_chunk()
+            if chunk is None:
+                if follow:
+                    chunk = self.reopen()
+                    if chunk is not None:
+                        lines.extend(chunk)
+                        continue
+                return lines
+            lines.extend(chunk)
+
+    def __iter__(self):
+        """Iterate over lines added to the file since it was opened.
+
+        Blocks until new lines are available to read, so must be wrapped as
+        a thread if non-blocking behaviour is required; alternatively, call
+        read_lines() when wait() returns.
+        """
+        while self.keeprunning:
+            lines = self.read_chunk()
+            if lines is None and self.follow:
+                lines = self.reopen()
+            if lines is None:
+                self.wait()
                 continue
+            for l in lines:
+                yield l
 
-            # otherwise, we can output the incomplete buffer (but only if we've read
-            # at least one line)
-            if self.started and incomplete:
-                yield incomplete
-                incomplete = ''
-            self.started = True
 
-            # The last line has not been terminated by a newline, and so goes
-            # into our incomplete line buffer
-            #
-            # This is why we need split() above - so that if buf ends with a
-            # newline, the last item will be the empty string and thus clears
-            # the incomplete buffer
+class MultiTailSource(object):
+    """Tails several logfiles, yielding LogLines from all of them in
+    chronological order.
+
+    Each log has a watermark, the latest timestamp read from it. A line is
+    held back until every active log's watermark is at least lateness
+    seconds past it, so that lines up to lateness seconds out of order
+    between logs are still output in order. A log counts as active until no
+    lines have been read from it for idle_timeout seconds, so a quiet log
+    does not hold back the others. A line is also output once it has been
+    held back for idle_timeout seconds.
+
+    Lines that arrive too late to be output in order are output as soon as
+    they are read, and counted in the attribute late.
+
+    The logs are followed from a single thread, waiting on all of them at
+    once. Other arguments are as for :py:class:`TailSource`.
+    """
+    def __init__(self, logfiles, line_class=LogLine, lateness=2, idle_timeout=5,
+            from_start=False, ignore_invalid=True, **kwargs):
+        self.tails = [TailSource(f, from_start=from_start, **kwargs) for f in logfiles]
+        self.line_class = line_class
+        self.lateness = lateness
+        self.idle_timeout = idle_timeout
+        self.ignore_invalid = ignore_invalid
+
+        n = len(self.tails)
+        self.watermarks = [None] * n
+        self.last_read = [None] * n
+        self.heap = []
+        self.seq = 0
+        self.emitted = None
+        self.late = 0
+        self.invalid = 0
+
+        self.keeprunning = True
+        self.wakeup_r, self.wakeup_w = os.pipe()
+
+    def stop(self):
+        """Stop iterating, waking up the iterator if it is waiting."""
+        self.keeprunning = False
+        try:
+            os.write(self.wakeup_w, 'x')
+        except OSError:
+            pass
+
+    def close(self):
+        self.stop()
+        for t in self.tails:
+            t.close()
+        for fd in (self.wakeup_r, self.wakeup_w):
             try:
-                incomplete = ls.pop()
-            except IndexError:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def watermark(self, now):
+        """Return the earliest watermark of the active logs, or None if no
+        log is active."""
+        marks = [
+            w for w, last in zip(self.watermarks, self.last_read)
+            if last is not None and now - last < self.idle_timeout
+        ]
+        if not marks:
+            return None
+        return min(marks)
+
+    def read(self, now):
+        """Read and buffer the lines available from every log, returning a
+        list of lines that are too late to be buffered."""
+        late = []
+        for i, tail in enumerate(self.tails):
+            lines = tail.read_lines()
+            if not lines:
                 continue
+            self.last_read[i] = now
+            for l in lines:
+                try:
+                    line = self.line_class(l)
+                except LogLineParseError:
+                    if not self.ignore_invalid:
+                        raise
+                    self.invalid += 1
+                    continue
+                t = line.time()
+                if self.watermarks[i] is None or t > self.watermarks[i]:
+                    self.watermarks[i] = t
+                if self.emitted is not None and t < self.emitted:
+                    self.late += 1
+                    late.append(line)
+                    continue
+                self.seq += 1
+                heapq.heappush(self.heap, (t, self.seq, now, line))
+        return late
+
+    def ready(self, now):
+        """Remove and return a list of the buffered lines that can be
+        output."""
+        out = []
+        heap = self.heap
+        mark = self.watermark(now)
+        if mark is not None:
+            mark -= self.lateness
+        expired = now - self.idle_timeout
+        while heap:
+            t, seq, read, line = heap[0]
+            if (mark is None or t > mark) and read > expired:
+                break
+            heapq.heappop(heap)
+            self.emitted = t
+            out.append(line)
+        return out
+
+    def next_deadline(self, now):
+        """Return the number of seconds until the buffered lines may next
+        become ready without new input, or None if nothing is buffered."""
+        if not self.heap:
+            return None
+        deadlines = [self.heap[0][2] + self.idle_timeout]
+        # A log becoming idle lowers the watermark's constraint
+        for last in self.last_read:
+            if last is not None and now - last < self.idle_timeout:
+                deadlines.append(last + self.idle_timeout)
+        return max(min(deadlines) - now, 0)
+
+    def wait(self, timeout=None):
+        """Block until any of the logs may have been written to, or until
+        timeout seconds have elapsed."""
+        fds = [self.wakeup_r]
+        for t in self.tails:
+            if t.inotify:
+                fds.append(t.inotify)
+            elif timeout is None or timeout > t.poll_interval:
+                timeout = t.poll_interval
+        try:
+            if timeout is None:
+                r, w, x = select.select(fds, [], [])
+            else:
+                r, w, x = select.select(fds, [], [], timeout)
+        except select.error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return
+        for t in self.tails:
+            if t.inotify in r:
+                t.inotify.read_events()
+
+    def read_lines(self):
+        """Return a list of the LogLines that can be output now, without
+        blocking."""
+        now = time.time()
+        late = self.read(now)
+        return late + self.ready(now)
+
+    def flush(self):
+        """Remove and return all buffered lines, in order."""
+        out = [l[3] for l in sorted(self.heap)]
+        del self.heap[:]
+        return out
 
-            # Yield all the remaining (complete) lines.
-            for l in ls:
+    def __iter__(self):
+        """Iterate over LogLines added to the logs, in chronological order.
+
+        Blocks until lines are available, and outputs any lines still
+        buffered when stopped.
+        """
+        while self.keeprunning:
+            lines = self.read_lines()
+            for l in lines:
                 yield l
+            if not lines:
+                self.wait(self.next_deadline(time.time()))
+        for l in self.flush():
+            yield l
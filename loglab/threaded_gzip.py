@@ -0,0 +1,139 @@
+# loglab - A library for stream-based log processing
+# Copyright (c) 2010 Crown copyright
+# 
+# This file is part of loglab.
+# 
+# loglab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# loglab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with loglab.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Implements gzip writing with compression spread over a pool of threads.
+
+Output is buffered into blocks, and each block is compressed as a complete
+gzip member by a worker thread. zlib releases the GIL while compressing, so
+several blocks can be compressed at once while the main thread carries on
+producing output. Members are written to the file in order, producing a
+standard multi-member gzip file that gzip, zcat and Python's gzip module all
+read as a single stream.
+
+This is the same approach as taken by pigz.
+"""
+
+import struct
+import time
+import zlib
+import __builtin__
+from collections import deque
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+# Size of the uncompressed blocks handed to the compression threads
+BLOCK_SIZE = 1 << 20
+
+_pool = None
+
+
+def default_pool():
+    """Return a thread pool shared by all writers that are not given one."""
+    global _pool
+    if _pool is None:
+        _pool = ThreadPool(cpu_count())
+    return _pool
+
+
+def open(filename, mode='wb', **kwargs):
+    if mode[0] in ['w', 'a']:
+        return Writer(filename, mode, **kwargs)
+    else:
+        raise NotImplementedError("threaded_gzip.open() does not support mode '%s'" % mode)
+
+
+def compress_member(data, level=6, mtime=0):
+    """Compress data as a single, complete gzip member."""
+    c = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    body = c.compress(data) + c.flush()
+    header = '\x1f\x8b\x08\x00' + struct.pack('<I', mtime) + '\x00\xff'
+    trailer = struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data) & 0xffffffff)
+    return header + body + trailer
+
+
+class Writer(object):
+    """A file-like object that writes gzip data compressed by a thread pool.
+
+    At most max_pending blocks are queued for compression at once; beyond
+    that, write() waits for the oldest block to be written out.
+    """
+    def __init__(self, filename, mode='wb', level=6, block_size=BLOCK_SIZE, pool=None, max_pending=None):
+        self.closed = False
+        if 'b' not in mode:
+            mode += 'b'
+        self.f = __builtin__.open(filename, mode)
+        self.level = level
+        self.block_size = block_size
+        self.pool = pool or default_pool()
+        if max_pending is None:
+            max_pending = 2 * cpu_count()
+        self.max_pending = max_pending
+        self.mtime = int(time.time())
+
+        self.buf = []
+        self.buf_size = 0
+        self.pending = deque()
+        self.empty = True
+
+    def write(self, data):
+        self.buf.append(data)
+        self.buf_size += len(data)
+        if self.buf_size >= self.block_size:
+            self._submit()
+
+    def writelines(self, lines):
+        for l in lines:
+            self.write(l)
+
+    def _submit(self):
+        """Queue the buffered data for compression as one gzip member."""
+        if not self.buf:
+            return
+        data = ''.join(self.buf)
+        self.empty = False
+        self.buf = []
+        self.buf_size = 0
+        self.pending.append(self.pool.apply_async(compress_member, (data, self.level, self.mtime)))
+
+        # Write out any members that are ready, in order, blocking only if
+        # too many blocks are outstanding
+        while self.pending and (self.pending[0].ready() or len(self.pending) > self.max_pending):
+            self.f.write(self.pending.popleft().get())
+
+    def flush(self):
+        """Compress and write out all data written so far."""
+        self._submit()
+        while self.pending:
+            self.f.write(self.pending.popleft().get())
+        self.f.flush()
+
+    def __del__(self):
+        if hasattr(self, 'f') and not self.closed:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            raise OSError("threaded_gzip.Writer is already closed")
+        try:
+            self.flush()
+            if self.empty:
+                # a gzip file must contain at least one member
+                self.f.write(compress_member('', self.level, self.mtime))
+        finally:
+            self.f.close()
+            self.closed = True
@@ -1,5 +1,8 @@
 import sys
+import random
+
 from .filters import Filter
+from .sources import close_source
 
 __all__ = (
     'LineDisplay', 'RandomLineFilter', 'AssertLogNotEmpty'
@@ -13,9 +16,13 @@ class LineDisplay(object):
     """
 
     def __init__(self, iterable):
+        self.source = iterable
         self.iterable = self.instrument(iterable)
         self.count = 1
 
+    def close(self):
+        close_source(self.source)
+
     def __iter__(self):
         """Run the main iterator. Only this instrument will output the total
         number of lines afterwards."""
@@ -37,13 +44,13 @@ class LineDisplay(object):
 class RandomLineFilter(Filter):
     """Select a random subset of lines from a log.
 
-    Useful for shortening a 1e6-line logfile for testing.
+    Useful for shortening a 1e6-line logfile for testing. See
+    :py:mod:`loglab.sampling` for samplers with a configurable rate.
 
     """
     skip = 0
 
     def accept(self, line):
-        import random
         if self.skip == 0:
             self.skip = random.randint(0, 15)
             return True
@@ -57,6 +64,9 @@ class AssertLogNotEmpty(object):
     def __init__(self, iterable):
         self.iterable = iterable
 
+    def close(self):
+        close_source(self.iterable)
+
     def __iter__(self):
         haslines = False
         for l in self.iterable:
@@ -27,8 +27,26 @@ loader = unittest.defaultTestLoader
 if len(sys.argv) == 1:
     import tests.lumberjacktest
     import tests.magpietests
+    import tests.splittertests
+    import tests.filtertests
+    import tests.utiltests
+    import tests.tailtests
+    import tests.eventtests
+    import tests.aggregatetests
+    import tests.downtimetests
+    import tests.statservertests
+    import tests.rolluptests
     all_tests.addTests(loader.loadTestsFromModule(tests.lumberjacktest))
     all_tests.addTests(loader.loadTestsFromModule(tests.magpietests))
+    all_tests.addTests(loader.loadTestsFromModule(tests.splittertests))
+    all_tests.addTests(loader.loadTestsFromModule(tests.filtertests))
+    all_tests.addTests(loader.loadTestsFromModule(tests.utiltests))
+    all_tests.addTests(loader.loadTestsFromModule(tests.tailtests))
+    all_tests.addTests(loader.loadTestsFromModule(tests.eventtests))
+    all_tests.addTests(loader.loadTestsFromModule(tests.aggregatetests))
+    all_tests.addTests(loader.loadTestsFromModule(tests.downtimetests))
+    all_tests.addTests(loader.loadTestsFromModule(tests.statservertests))
+    all_tests.addTests(loader.loadTestsFromModule(tests.rolluptests))
 else:
     for arg in sys.argv[1:]:
         all_tests.addTest(loader.loadTestsFromName(arg))
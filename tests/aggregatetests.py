@@ -0,0 +1,244 @@
+# loglab - A library for stream-based log processing
+# Copyright (c) 2010 Crown copyright
+# 
+# This file is part of loglab.
+# 
+# loglab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# loglab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with loglab.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import random
+import unittest
+from collections import defaultdict
+
+from loglab.lineformats import CombinedLogLine
+from loglab.aggregate import Aggregator, Count, CountWhere, Sum, Quantiles, Distinct, TopK, status_class
+from loglab.sketches import QuantileSketch, HyperLogLog, SpaceSaving
+
+
+LINE = '10.0.0.1 - - [01/Apr/2010:12:%02d:%02d +0000] "GET / HTTP/1.1" %s %s "-" "-"'
+
+
+def make_lines(*lines):
+    """Construct log lines from (minute, second, code, size) tuples."""
+    return [CombinedLogLine(LINE % l, line_number=i + 1) for i, l in enumerate(lines)]
+
+
+START = int(time.mktime((2010, 4, 1, 12, 0, 0, 0, 0, -1)))
+
+
+class AggregatorTest(unittest.TestCase):
+    def testBuckets(self):
+        """Lines are counted in buckets, and gaps are filled"""
+        lines = make_lines((0, 1, 200, 10), (0, 59, 503, '-'), (1, 0, 503, 5), (3, 30, 200, 7))
+        agg = Aggregator([Count('requests'), CountWhere('errors', code='503'), Sum('size')])
+        self.failUnlessEqual(list(agg.aggregate(lines)), [
+            (START, {'requests': 2, 'errors': 1, 'size': 10}),
+            (START + 60, {'requests': 1, 'errors': 1, 'size': 5}),
+            (START + 120, {'requests': 0, 'errors': 0, 'size': 0}),
+            (START + 180, {'requests': 1, 'errors': 0, 'size': 7}),
+        ])
+
+    def testNoGapFilling(self):
+        lines = make_lines((0, 1, 200, 10), (3, 30, 200, 7))
+        agg = Aggregator([Count()], fill_gaps=False)
+        self.failUnlessEqual([s for s, v in agg.aggregate(lines)], [START, START + 180])
+
+    def testInterval(self):
+        """Buckets start at multiples of the interval since the epoch"""
+        lines = make_lines((0, 0, 200, 1), (6, 59, 200, 1), (7, 0, 200, 1))
+        agg = Aggregator([Count()], interval=7 * 60)
+        buckets = list(agg.aggregate(lines))
+        for start, values in buckets:
+            self.failUnlessEqual(start % (7 * 60), 0)
+        self.failUnlessEqual(sum(v['count'] for s, v in buckets), 3)
+
+    def testGroupBy(self):
+        lines = make_lines((0, 1, 200, 10), (0, 2, 503, 1), (0, 3, 500, 1), (2, 0, 304, 1))
+        agg = Aggregator([Count()], group_by=status_class)
+        self.failUnlessEqual(list(agg.aggregate(lines)), [
+            (START, {'2xx': {'count': 1}, '5xx': {'count': 2}}),
+            (START + 60, {}),
+            (START + 120, {'3xx': {'count': 1}}),
+        ])
+
+    def testLateness(self):
+        """Lines out of order are counted if within lateness"""
+        lines = make_lines((0, 50, 200, 1), (1, 5, 200, 1), (0, 55, 200, 1), (2, 30, 200, 1), (0, 58, 200, 1))
+        agg = Aggregator([Count()], lateness=10)
+        self.failUnlessEqual([v['count'] for s, v in agg.aggregate(lines)], [2, 1, 1])
+        self.failUnlessEqual(agg.late, 1)
+
+    def testMerge(self):
+        agg = Aggregator([Count(), Sum('size')])
+        self.failUnlessEqual(agg.merge([1, 10], [2, 5]), [3, 15])
+
+
+    def testCombine(self):
+        """Aggregates of parts of a log combine into the aggregate of all of it"""
+        lines = make_lines(*[(i // 60, i % 60, 200 + (i % 7 == 0) * 303, i) for i in range(0, 600, 7)])
+        agg = Aggregator([Count(), Sum('size'), Quantiles('size')], group_by=status_class)
+        parts = [lines[0::3], lines[1::3], lines[2::3]]
+        combined = list(agg.combine(*[agg.buckets(p) for p in parts]))
+        self.failUnlessEqual(combined, list(agg.aggregate(lines)))
+
+    def testParams(self):
+        """Column parameters describe how the state is built, and can be
+        serialised as JSON"""
+        self.failUnlessEqual(Count().params(), {})
+        self.failUnlessEqual(CountWhere('errors', code__in=['500', '503']).params(),
+                             {'conditions': [['code__in', ['500', '503']]], 'line_class': 'loglab.lineformats.CombinedLogLine'})
+        self.failUnlessEqual(CountWhere('errors', status_class).params(),
+                             {'predicate': 'loglab.aggregate.status_class'})
+        self.failUnlessEqual(Quantiles('size', quantiles=(0.9,)).params(), Quantiles('size').params())
+        self.failIfEqual(Quantiles('size', relative_accuracy=0.02).params(), Quantiles('size').params())
+        self.failUnlessEqual(Distinct('clients', ('ip', 'ua')).params(), {'fields': ['ip', 'ua'], 'precision': 14})
+        self.failUnlessEqual(TopK('urls', 'req', k=5).params(), {'field': 'req', 'capacity': 50})
+
+
+class QuantileSketchTest(unittest.TestCase):
+    def values(self, n=10000):
+        r = random.Random(2)
+        return [r.lognormvariate(8, 2) for i in xrange(n)]
+
+    def testAccuracy(self):
+        values = self.values()
+        sketch = QuantileSketch(relative_accuracy=0.01)
+        for v in values:
+            sketch.add(v)
+        values.sort()
+        for q in (0.01, 0.5, 0.95, 0.99):
+            exact = values[int(q * (len(values) - 1))]
+            estimate = sketch.quantile(q)
+            self.failUnless(abs(estimate - exact) <= 0.01 * exact, (q, exact, estimate))
+        self.failUnlessEqual(sketch.quantile(0), values[0])
+        self.failUnlessEqual(sketch.quantile(1), values[-1])
+        self.failUnless(len(sketch.buckets) < 1000)
+
+    def testMerge(self):
+        """Merged sketches are identical to a sketch of all the values"""
+        values = [int(v) for v in self.values()] + [0] * 10
+        whole = QuantileSketch()
+        parts = [QuantileSketch() for i in range(4)]
+        for i, v in enumerate(values):
+            whole.add(v)
+            parts[i % 4].add(v)
+        merged = QuantileSketch()
+        for p in parts:
+            merged.merge(p)
+        self.failUnlessEqual(merged, whole)
+        self.failUnlessEqual(QuantileSketch.from_dict(whole.to_dict()), whole)
+
+    def testIncompatible(self):
+        self.failUnlessRaises(ValueError, QuantileSketch(0.01).merge, QuantileSketch(0.02))
+        self.failUnlessRaises(ValueError, QuantileSketch().add, -1)
+
+    def testColumn(self):
+        lines = make_lines((0, 1, 200, 100), (0, 2, 200, '-'), (0, 3, 200, 300))
+        agg = Aggregator([Quantiles('size', quantiles=(0.5, 1))])
+        [(start, values)] = list(agg.aggregate(lines))
+        self.failUnlessAlmostEqual(values['size']['p50'], 100, delta=1)
+        self.failUnlessAlmostEqual(values['size']['p100'], 300)
+
+
+class HyperLogLogTest(unittest.TestCase):
+    def testAccuracy(self):
+        for n in (10, 1000, 50000):
+            hll = HyperLogLog(precision=12)
+            for i in xrange(n):
+                hll.add('10.0.%d.%d' % (i // 256, i % 256))
+                hll.add('10.0.%d.%d' % (i // 256, i % 256))
+            # 1.04 / sqrt(4096) is a standard error of 1.6%
+            self.failUnless(abs(hll.count() - n) <= max(0.05 * n, 1), (n, hll.count()))
+
+    def testMerge(self):
+        """Merged sketches are identical to a sketch of all the strings"""
+        whole = HyperLogLog()
+        parts = [HyperLogLog(), HyperLogLog()]
+        for i in xrange(5000):
+            s = str(i)
+            whole.add(s)
+            parts[i % 2].add(s)
+        parts[0].merge(parts[1])
+        self.failUnlessEqual(parts[0], whole)
+        self.failUnlessEqual(HyperLogLog.from_dict(whole.to_dict()), whole)
+        self.failUnlessRaises(ValueError, whole.merge, HyperLogLog(10))
+
+    def testColumn(self):
+        """Distinct values, or combinations of fields, are counted per bucket
+        and can be rolled up"""
+        lines = [
+            CombinedLogLine('10.0.0.%d - - [01/Apr/2010:%02d:00:%02d +0000] "GET /%d HTTP/1.1" 200 1 "-" "-"' % (ip, h, s, ip % 3))
+            for h in (12, 13)
+            for s, ip in enumerate([1, 2, 2, 3, 4][:4 + h - 12])
+        ]
+        agg = Aggregator([Distinct('ips', 'ip'), Distinct('pairs', ('ip', 'req'))], interval=3600)
+        buckets = list(agg.buckets(lines))
+        self.failUnlessEqual([agg.result(s)['ips'] for t, s in buckets], [3, 4])
+        daily = agg.merge(buckets[0][1], buckets[1][1])
+        self.failUnlessEqual(agg.result(daily), {'ips': 4, 'pairs': 4})
+
+
+class SpaceSavingTest(unittest.TestCase):
+    def stream(self, n=20000, seed=3):
+        """A Zipf-like stream of URLs."""
+        r = random.Random(seed)
+        return ['/page/%d' % int(r.paretovariate(1.2)) for i in xrange(n)]
+
+    def exact(self, stream):
+        counts = defaultdict(int)
+        for k in stream:
+            counts[k] += 1
+        return counts
+
+    def checkBounds(self, sketch, exact):
+        for k, c, e in sketch.top():
+            self.failUnless(c - e <= exact[k] <= c, (k, c, e, exact[k]))
+            self.failUnless(e <= sketch.total / sketch.capacity)
+
+    def testTop(self):
+        stream = self.stream()
+        exact = self.exact(stream)
+        sketch = SpaceSaving(capacity=100)
+        for k in stream:
+            sketch.add(k)
+        self.failUnlessEqual(len(sketch.counts), 100)
+        self.checkBounds(sketch, exact)
+        expected = sorted(exact, key=lambda k: -exact[k])[:10]
+        self.failUnlessEqual([k for k, c, e in sketch.top(10)], expected)
+
+    def testMerge(self):
+        streams = [self.stream(seed=s) for s in range(4)]
+        sketches = []
+        for stream in streams:
+            sketch = SpaceSaving(capacity=100)
+            for k in stream:
+                sketch.add(k)
+            sketches.append(sketch)
+        merged = sketches[0]
+        for other in sketches[1:]:
+            merged.merge(other)
+        exact = self.exact(sum(streams, []))
+        self.failUnlessEqual(merged.total, 80000)
+        self.failUnless(len(merged.counts) <= 100)
+        self.checkBounds(merged, exact)
+        expected = sorted(exact, key=lambda k: -exact[k])[:5]
+        self.failUnlessEqual([k for k, c, e in merged.top(5)], expected)
+        self.failUnlessEqual(SpaceSaving.from_dict(merged.to_dict()).top(), merged.top())
+
+    def testColumn(self):
+        paths = ['/a', '/b', '/a', '/c', '/a']
+        lines = make_lines(*[(0, i, 200, 1) for i in range(5)])
+        agg = Aggregator([TopK('urls', lambda l: paths[l.line_number - 1], k=2)])
+        [(start, values)] = list(agg.aggregate(lines))
+        self.failUnlessEqual(values['urls'], [('/a', 3, 0), ('/b', 1, 0)])
@@ -0,0 +1,140 @@
+# loglab - A library for stream-based log processing
+# Copyright (c) 2010 Crown copyright
+# 
+# This file is part of loglab.
+# 
+# loglab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# loglab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with loglab.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+import unittest
+
+from loglab import downtime
+from loglab.downtime import (
+    DowntimeDetector, WindowedDowntimeDetector, TimeWindowDowntimeDetector,
+    detect_windowed, backfill
+)
+
+
+class Line(object):
+    """Stub log line with a time and status code."""
+    def __init__(self, t, code):
+        self.t = t
+        self.code = code
+
+    def time(self):
+        return self.t
+
+
+def make_log(codes, interval=1):
+    return [Line(i * interval, c) for i, c in enumerate(codes)]
+
+
+def naive_transitions(lines, window_size, threshold):
+    """The original list-based windowed detector, for comparison."""
+    isup = True
+    window = [True] * window_size
+    out = []
+    for l in lines:
+        try:
+            s = downtime.check_line(l)
+        except downtime.UnknownStatus:
+            continue
+        window = window[1:] + [s]
+        up = len([s for s in window if s]) > threshold
+        if up != isup:
+            out.append(('up' if up else 'down', l.time()))
+        isup = up
+    return out
+
+
+class DowntimeTest(unittest.TestCase):
+    def random_log(self, n=2000):
+        r = random.Random(1)
+        codes = []
+        p_error = 0.1
+        for i in xrange(n):
+            if i % 200 == 0:
+                p_error = r.choice([0.1, 0.5, 0.9])
+            if r.random() < 0.05:
+                codes.append('404')
+            else:
+                codes.append('503' if r.random() < p_error else '200')
+        return make_log(codes)
+
+    def testWindowed(self):
+        """The ring buffer gives the same transitions as the original"""
+        log = self.random_log()
+        expected = naive_transitions(log, 50, 30)
+        self.failUnless(expected)
+        self.failUnlessEqual(list(WindowedDowntimeDetector(log).transitions()), expected)
+
+    def testBatch(self):
+        log = self.random_log()
+        expected = naive_transitions(log, 20, 10)
+        self.failUnlessEqual(backfill(log, 20, 10), expected)
+
+    def testBatchWithoutNumpy(self):
+        log = self.random_log()
+        numpy, downtime.numpy = downtime.numpy, None
+        try:
+            self.failUnlessEqual(backfill(log, 20, 10), naive_transitions(log, 20, 10))
+        finally:
+            downtime.numpy = numpy
+        self.failUnlessEqual(detect_windowed([], []), [])
+
+    def testNumpyMatchesRingBuffer(self):
+        """The vectorised and streaming batch detectors agree"""
+        if downtime.numpy is None:
+            self.skipTest("numpy is not installed")
+        log = self.random_log(5000)
+        times = [l.time() for l in log if l.code != '404']
+        statuses = [l.code != '503' for l in log if l.code != '404']
+        for window_size, threshold in [(1, 0), (20, 10), (50, 30), (200, 150), (10000, 9000)]:
+            vectorised = detect_windowed(times, statuses, window_size, threshold)
+            numpy, downtime.numpy = downtime.numpy, None
+            try:
+                streaming = detect_windowed(times, statuses, window_size, threshold)
+            finally:
+                downtime.numpy = numpy
+            self.failUnlessEqual(vectorised, streaming)
+        self.failUnless(vectorised)
+        self.failUnlessEqual(detect_windowed([], []), [])
+
+    def testInvalidWindow(self):
+        self.failUnlessRaises(ValueError, TimeWindowDowntimeDetector, [], window=0)
+        self.failUnlessRaises(ValueError, TimeWindowDowntimeDetector, [], window=-5)
+        self.failUnlessRaises(ValueError, WindowedDowntimeDetector, [], window_size=0)
+
+    def testTimeWindow(self):
+        log = make_log(['200'] * 10 + ['503'] * 10 + ['200'] * 10, interval=10)
+        detector = TimeWindowDowntimeDetector(log, window=60, threshold=0.5)
+        self.failUnlessEqual(list(detector.transitions()), [('down', 120), ('up', 230)])
+
+    def testTimeout(self):
+        log = make_log(['200', '200', '503', '503', '200'], interval=30)
+        self.failUnlessEqual(list(DowntimeDetector(log).transitions()), [('down', 30), ('up', 120)])
+
+    def testScan(self):
+        events = []
+
+        class Detector(WindowedDowntimeDetector):
+            def on_up(self, t):
+                events.append(('up', t))
+
+            def on_down(self, t):
+                events.append(('down', t))
+
+        log = make_log(['503'] * 30 + ['200'] * 40)
+        Detector(log, window_size=50, threshold=30).scan()
+        self.failUnlessEqual(events, naive_transitions(log, 50, 30))
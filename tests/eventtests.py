@@ -0,0 +1,187 @@
+# loglab - A library for stream-based log processing
+# Copyright (c) 2010 Crown copyright
+# 
+# This file is part of loglab.
+# 
+# loglab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# loglab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with loglab.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from loglab.events import EventLoop, TailReader, Channel, feed, filter_lines, parse_lines, broadcast
+from loglab.tail import TailSource, MultiTailSource
+
+from tailtests import log_line
+
+
+class EventLoopTest(unittest.TestCase):
+    def testTimers(self):
+        loop = EventLoop()
+        calls = []
+        loop.call_later(0.02, calls.append, 'later')
+        loop.call_later(0.01, calls.append, 'sooner')
+        loop.call_later(0.01, calls.append, 'cancelled').cancel()
+        loop.run()
+        self.failUnlessEqual(calls, ['sooner', 'later'])
+
+    def testRepeatingTimer(self):
+        loop = EventLoop()
+        calls = []
+
+        def tick():
+            calls.append(time.time())
+            if len(calls) == 3:
+                timer.cancel()
+        timer = loop.call_every(0.01, tick)
+        loop.run()
+        self.failUnlessEqual(len(calls), 3)
+
+    def testReader(self):
+        loop = EventLoop()
+        r, w = os.pipe()
+        received = []
+
+        def readable():
+            received.append(os.read(r, 100))
+            loop.remove_reader(r)
+        loop.add_reader(r, readable)
+        loop.call_later(0.01, os.write, w, 'hello')
+        loop.run()
+        self.failUnlessEqual(received, ['hello'])
+        os.close(r)
+        os.close(w)
+
+    def testWriter(self):
+        loop = EventLoop()
+        r, w = os.pipe()
+
+        def writable():
+            os.write(w, 'hello')
+            loop.remove_writer(w)
+        loop.add_writer(w, writable)
+        self.failUnless(loop.pending())
+        loop.run()
+        self.failUnlessEqual(os.read(r, 100), 'hello')
+        os.close(r)
+        os.close(w)
+
+
+    def testCancelledTimers(self):
+        """Cancelled timers are not counted as pending, and do not build up
+        in the heap"""
+        loop = EventLoop()
+        for i in range(1000):
+            loop.call_later(60, lambda: None).cancel()
+        self.failIf(loop.pending())
+        self.failUnless(len(loop.timers) < 130)
+
+        timer = loop.call_later(0, lambda: None)
+        self.failUnless(loop.pending())
+        loop.run_once()
+        # Cancelling a timer that has already run changes nothing
+        timer.cancel()
+        loop.call_later(60, lambda: None)
+        self.failUnless(loop.pending())
+
+
+class CoroutineTest(unittest.TestCase):
+    def testPipeline(self):
+        """Lines can be parsed, filtered and broadcast to several targets"""
+        loop = EventLoop()
+        errors = Channel(loop)
+        everything = Channel(loop)
+        target = parse_lines(broadcast(
+            everything,
+            filter_lines(lambda l: l.req.startswith('/error'), errors),
+        ))
+        feed([log_line(0, 'a'), 'garbage', log_line(1, 'error'), log_line(2, 'b')], target)
+        self.failUnlessEqual([l.req for l in everything], ['/a', '/error', '/b'])
+        self.failUnlessEqual([l.req for l in errors], ['/error'])
+        self.failUnless(errors.closed)
+
+
+class TailReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_later(self, loop, delay, fname, data):
+        def write():
+            f = open(fname, 'a')
+            f.write(data)
+            f.close()
+        loop.call_later(delay, write)
+
+    def testTail(self):
+        """Lines written to tailed logs are pushed as they are written"""
+        loop = EventLoop()
+        fnames = [os.path.join(self.dir, n) for n in 'ab']
+        for f in fnames:
+            open(f, 'w').close()
+
+        channel = Channel(loop)
+        readers = [
+            TailReader(loop, TailSource(fnames[0], poll_interval=0.01), channel),
+            TailReader(loop, TailSource(fnames[1], poll_interval=0.01, use_inotify=False), channel),
+        ]
+        self.write_later(loop, 0.01, fnames[0], 'one\n')
+        self.write_later(loop, 0.02, fnames[1], 'two\n')
+        loop.call_later(0.1, readers[0].close)
+        loop.call_later(0.1, readers[1].close)
+        self.failUnlessEqual(list(channel), ['one', 'two'])
+
+    def testDeadlineTimer(self):
+        """Reading a busy log keeps one deadline timer, however often the
+        deadline moves"""
+        class BusyTail(object):
+            inotify = None
+            poll_interval = 60
+            deadline = 10.0
+
+            def read_lines(self):
+                return []
+
+            def next_deadline(self, now):
+                self.deadline += 0.001
+                return self.deadline
+
+        loop = EventLoop()
+        reader = TailReader(loop, BusyTail(), Channel(loop))
+        for i in range(1000):
+            reader.read()
+        live = [t for w, s, t in loop.timers if not t.cancelled]
+        self.failUnlessEqual(len(loop.timers), 3)
+        self.failUnless(reader.deadline in live)
+        self.failUnless(reader.due > reader.deadline.when)
+
+    def testMultiTail(self):
+        """Buffered lines from a MultiTailSource are released by timers"""
+        loop = EventLoop()
+        fname = os.path.join(self.dir, 'a')
+        open(fname, 'w').close()
+
+        channel = Channel(loop)
+        reader = TailReader(loop, MultiTailSource([fname], idle_timeout=0.05), channel)
+        self.write_later(loop, 0.01, fname, log_line(0, 'a') + log_line(1, 'b'))
+        received = []
+        for l in channel:
+            received.append((l.req, time.time()))
+            if len(received) == 2:
+                reader.close()
+        self.failUnlessEqual([r for r, t in received], ['/a', '/b'])
@@ -0,0 +1,389 @@
+# loglab - A library for stream-based log processing
+# Copyright (c) 2010 Crown copyright
+# 
+# This file is part of loglab.
+# 
+# loglab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# loglab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with loglab.  If not, see <http://www.gnu.org/licenses/>.
+
+import gzip
+import datetime
+import unittest
+
+from loglab.lineformats import CombinedLogLine, ApacheLogLine, S3LogLine
+from loglab.sources import LogLineSource
+from loglab.query import where, Where
+from loglab.sampling import HashSampler, HashSample, RandomSample, ReservoirSample
+from loglab.blocklist import IPSet, StringSet, BlocklistFilter
+from loglab.filters import Filter, DateFilter, DateRangeFilter, FusedFilter, fuse_filters
+from loglab.prefilters import PreFilter, Contains, Matches, DatePrefix
+from loglab.file_sources import GZipLogFile
+from loglab.utils import RandomLineFilter
+
+
+LINE = '10.0.0.1 - - [%02d/Apr/2010:12:00:00 +0000] "GET /%s HTTP/1.1" %d %d "-" "%s"'
+
+
+def make_line(day=1, path='index.html', code=200, size=100, ua='-', line_number=None):
+    """Construct a combined log line dated on the given day of April 2010."""
+    return CombinedLogLine(LINE % (day, path, code, size, ua), line_number=line_number)
+
+
+class CountingSource(object):
+    """A closeable source that counts the lines read from it."""
+    def __init__(self, lines):
+        self.lines = lines
+        self.read = 0
+        self.closed = False
+
+    def __iter__(self):
+        for l in self.lines:
+            self.read += 1
+            yield l
+
+    def close(self):
+        self.closed = True
+
+
+class DateRangeFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.source = CountingSource([make_line(d, line_number=d) for d in range(1, 11)])
+
+    def testUnordered(self):
+        """Without ordered=True the whole input is read"""
+        log = DateRangeFilter(self.source, end_date=datetime.date(2010, 4, 4))
+        self.failUnlessEqual(len(list(log)), 3)
+        self.failUnlessEqual(self.source.read, 10)
+
+    def testOrdered(self):
+        """With ordered=True iteration stops at the first line past end_date"""
+        log = DateRangeFilter(self.source, datetime.date(2010, 4, 2), datetime.date(2010, 4, 4), ordered=True)
+        self.failUnlessEqual([l.line_number for l in log], [2, 3])
+        self.failUnlessEqual(self.source.read, 4)
+        self.failUnless(self.source.closed)
+
+    def testLateness(self):
+        """Lines up to lateness seconds past end_date are read but not accepted"""
+        log = DateRangeFilter(self.source, end_date=datetime.date(2010, 4, 4), ordered=True, lateness=86400)
+        self.failUnlessEqual([l.line_number for l in log], [1, 2, 3])
+        self.failUnlessEqual(self.source.read, 5)
+
+
+class IterableOnlyFilter(Filter):
+    """A filter in the style of older subclasses, which only set iterable."""
+    stateless = True
+
+    def __init__(self, iterable):
+        self.iterable = iterable
+
+    def accept(self, line):
+        return True
+
+
+class FilterCloseTest(unittest.TestCase):
+    def testIterableOnly(self):
+        """Filters that only set iterable close it"""
+        source = CountingSource([])
+        IterableOnlyFilter(source).close()
+        self.failUnless(source.closed)
+
+    def testUncloseable(self):
+        """Sources without close() are skipped"""
+        IterableOnlyFilter([]).close()
+        IterableOnlyFilter(iter([])).close()
+
+
+class PreFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.lines = [
+            str(make_line(day=1 + i % 3, path=['index.html', 'api/x', 'api/y'][i % 3], code=[200, 503][i % 2]))
+            for i in range(50)
+        ]
+
+    def testContains(self):
+        """Fixed-string matches find the same lines as a per-line test"""
+        for block_size in (1, 7, 1000):
+            log = PreFilter(self.lines, [Contains('" 503 ')], block_size=block_size)
+            self.failUnlessEqual(list(log), [l for l in self.lines if '" 503 ' in l])
+
+    def testCombined(self):
+        """Lines must pass every predicate"""
+        preds = [Contains('/api/'), Matches(r'"GET /\w+/y'), DatePrefix(datetime.date(2010, 4, 3))]
+        log = PreFilter(self.lines, preds, block_size=10)
+        expected = [l for l in self.lines if '/api/y' in l and '[03/Apr/2010:' in l]
+        self.failUnless(expected)
+        self.failUnlessEqual(list(log), expected)
+
+    def testNulCharacters(self):
+        """Lines containing NUL, as in crash-truncated logs, are handled"""
+        log = PreFilter(['a\0b 503 x', 'c', 'd 503'], [Contains(' 503')])
+        self.failUnlessEqual(list(log), ['a\0b 503 x', 'd 503'])
+
+    def testLineEndings(self):
+        """Lines ending with newlines, as read from files, are matched"""
+        lines = ['a 503\n', 'b\n', 'c 503\n', 'd 503']
+        for sub in (' 503', '503\n', '\n', '\nb', '\n\n'):
+            for block_size in (1, 2, 1000):
+                log = PreFilter(lines, [Contains(sub)], block_size=block_size)
+                self.failUnlessEqual(list(log), [l for l in lines if sub in l])
+
+    def testRegexOnly(self):
+        log = PreFilter(self.lines, Matches(' 200 '))
+        self.failUnlessEqual(len(list(log)), 25)
+
+    def testGZipLogFile(self):
+        """GZipLogFile can prefilter lines before parsing them"""
+        log = GZipLogFile('tests/logs/testlog1.gz', prefilter=[Contains('" 404 ')])
+        codes = set(l.code for l in log)
+        self.failUnlessEqual(codes, set(['404']))
+
+
+class CodeFilter(Filter):
+    stateless = True
+
+    def __init__(self, iterable, code):
+        super(CodeFilter, self).__init__(iterable)
+        self.code = code
+
+    def accept(self, line):
+        return line.code == self.code
+
+
+class FuseFiltersTest(unittest.TestCase):
+    def setUp(self):
+        self.lines = [make_line(day=1 + i % 5, code=[200, 503][i % 2], line_number=i) for i in range(100)]
+
+    def chain(self):
+        log = DateRangeFilter(self.lines, start_date=datetime.date(2010, 4, 2))
+        log = CodeFilter(log, '503')
+        return DateFilter(log, datetime.date(2010, 4, 4))
+
+    def testFusedOutput(self):
+        """A fused chain yields the same lines as the original chain"""
+        expected = [l.line_number for l in self.chain()]
+        self.failUnless(expected)
+        for sample_size in (0, 3, 1000):
+            fused = fuse_filters(self.chain(), sample_size=sample_size)
+            self.failUnless(isinstance(fused, FusedFilter))
+            self.failUnlessEqual(len(fused.predicates), 3)
+            self.failUnlessEqual([l.line_number for l in fused], expected)
+
+    def testSelectivityOrder(self):
+        """The predicate that rejects most lines is evaluated first"""
+        fused = fuse_filters(self.chain(), sample_size=50)
+        list(fused)
+        self.failUnlessEqual(fused.predicates[0].im_self.__class__, DateFilter)
+
+    def testUnfusable(self):
+        """Filters with their own iteration are not fused"""
+        log = DateRangeFilter(self.lines, end_date=datetime.date(2010, 4, 2), ordered=True)
+        log = CodeFilter(log, '503')
+        self.failUnless(fuse_filters(log) is log)
+
+    def testStateful(self):
+        """Filters that are not stateless, such as RandomLineFilter, are not
+        fused, as reordering their predicates would change their output"""
+        log = CodeFilter(RandomLineFilter(self.lines), '503')
+        self.failUnless(fuse_filters(log) is log)
+        log = RandomSample(CodeFilter(self.lines, '503'), 0.5, seed=1)
+        self.failUnless(fuse_filters(log) is log)
+
+    def testIterableOnly(self):
+        """Filters that only set iterable can be fused"""
+        log = CodeFilter(IterableOnlyFilter(self.lines), '503')
+        log = DateFilter(log, datetime.date(2010, 4, 4))
+        expected = [l.line_number for l in DateFilter(CodeFilter(self.lines, '503'), datetime.date(2010, 4, 4))]
+        fused = fuse_filters(log)
+        self.failUnless(isinstance(fused, FusedFilter))
+        self.failUnlessEqual(len(fused.predicates), 3)
+        self.failUnlessEqual([l.line_number for l in fused], expected)
+
+
+class QueryTest(unittest.TestCase):
+    def setUp(self):
+        self.lines = [
+            str(make_line(path=p, code=c, size=s))
+            for p in ('index.html', 'api/x', 'apix')
+            for c in (200, 503)
+            for s in (10, 1000)
+        ]
+        self.lines.append('not a log line')
+
+    def check(self, expected, **conditions):
+        """Check that a query finds the expected lines by each method"""
+        q = where(**conditions)
+        expected = [l for l in self.lines if expected(l)]
+        self.failUnless(expected)
+        self.failUnlessEqual(list(PreFilter(self.lines, q.prefilter())), expected)
+        parsed = LogLineSource(self.lines)
+        self.failUnlessEqual([str(l) for l in Where(parsed, q)], expected)
+
+    def testExact(self):
+        self.check(lambda l: '" 503 ' in l, code=503)
+
+    def testLookups(self):
+        self.check(lambda l: '/api/' in l and ' 200 ' in l, req__startswith='/api/', code__ne='503')
+        self.check(lambda l: ' 1000 ' in l, size__gt=100)
+        self.check(lambda l: 'apix' in l or 'index' in l, req__regex='^/(apix|index)')
+        self.check(lambda l: 'api/x' in l, req__in=['/api/x', '/api/y'])
+
+    def testCallable(self):
+        self.check(lambda l: ' 503 ' in l, code=lambda c: c.startswith('5'))
+
+    def testSubstrings(self):
+        """Conditions imply strings found next to the field in the raw line"""
+        q = where(code=503, verb='GET', req__startswith='/api')
+        self.failUnlessEqual(sorted(q.substrings()), sorted(['" 503 ', '] "GET ', ' /api']))
+
+    def testRealLogs(self):
+        """Queries on raw lines, including on the last field, agree with a
+        full parse of the test logs"""
+        logs = [
+            ('tests/logs/testlog1.gz', CombinedLogLine),
+            ('tests/logs/testlog2.gz', CombinedLogLine),
+            ('tests/logs/s3testlog.gz', S3LogLine),
+            ('tests/logs/testlog2.gz', ApacheLogLine),
+        ]
+        queries = [
+            {'ua': '-'}, {'ua__endswith': ')'}, {'ua__contains': 'Firefox'},
+            {'ref': '-'}, {'ref__startswith': 'http://'},
+        ]
+        # ApacheLogLine falls back to the combined format for lines without
+        # a cookie, so text after the user agent is not always present
+        cookie_queries = [{'cookie': ''}, {'cookie': '-'}, {'cookie__endswith': '*'}, {'ua': '-', 'ip__startswith': '1'}]
+        for fname, line_class in logs:
+            raw = gzip.open(fname).readlines()
+            parsed = []
+            for text in raw:
+                l = line_class(text)
+                l._full_parse()
+                parsed.append(l)
+            if line_class is ApacheLogLine:
+                queries = queries + cookie_queries
+            for conditions in queries:
+                q = where(line_class, **conditions)
+                expected = [i for i, l in enumerate(parsed) if q.accept(l)]
+                self.failUnlessEqual([i for i, text in enumerate(raw) if q(text)], expected)
+                self.failUnlessEqual([i for i, text in enumerate(raw) if q.accept(line_class(text))], expected)
+                self.failUnlessEqual(len(list(PreFilter(raw, q.prefilter()))), len(expected))
+        # Check that the comparison is not vacuous
+        raw = gzip.open('tests/logs/testlog1.gz').readlines()
+        self.failUnless([text for text in raw if where(ua='-')(text)])
+        self.failUnless([text for text in raw if where(ua__endswith=')')(text)])
+        raw = gzip.open('tests/logs/testlog2.gz').readlines()
+        self.failUnless([text for text in raw if where(ApacheLogLine, cookie='')(text)])
+        self.failUnless([text for text in raw if where(ApacheLogLine, cookie__endswith='*')(text)])
+
+    def testUnknownField(self):
+        self.failUnlessRaises(ValueError, where, bucket='x')
+        self.failUnless(where(S3LogLine, bucket='x'))
+
+
+class SamplingTest(unittest.TestCase):
+    def setUp(self):
+        self.lines = [
+            '10.0.%d.%d - - [01/Apr/2010:12:00:00 +0000] "GET /%d HTTP/1.1" 200 100 "-" "-"' % (i % 7, i % 100, i)
+            for i in range(2000)
+        ]
+
+    def testHashSampleDeterministic(self):
+        """Hash sampling selects whole keys, consistently between runs"""
+        a = list(HashSample(self.lines, 0.3))
+        b = list(HashSample(reversed(self.lines), 0.3))
+        self.failUnlessEqual(sorted(a), sorted(b))
+        ips = set(l.split()[0] for l in a)
+        self.failUnlessEqual(a, [l for l in self.lines if l.split()[0] in ips])
+        self.failUnless(0 < len(a) < len(self.lines))
+
+    def testHashSampleParsed(self):
+        """Parsed lines are selected exactly as their raw text"""
+        raw = list(HashSample(self.lines, 0.5, key=('ip', 'req')))
+        parsed = [str(l) for l in HashSample(LogLineSource(self.lines), 0.5, key=('ip', 'req'))]
+        self.failUnlessEqual(raw, parsed)
+        self.failUnless(800 < len(raw) < 1200)
+
+    def testHashSampleApache(self):
+        """Raw and parsed Apache lines, with and without a cookie, are keyed
+        on the same fields"""
+        raw = gzip.open('tests/logs/testlog2.gz').readlines()
+        for key in ('ua', 'cookie', ('ref', 'ua')):
+            sampler = HashSampler(0.5, key=key, line_class=ApacheLogLine)
+            selected = [i for i, text in enumerate(raw) if sampler(text)]
+            self.failUnlessEqual(selected, [i for i, text in enumerate(raw) if sampler.accept(ApacheLogLine(text))])
+            self.failUnless(0 < len(selected) < len(raw))
+
+    def testRandomSample(self):
+        a = list(RandomSample(self.lines, 0.1, seed=1))
+        self.failUnlessEqual(a, list(RandomSample(self.lines, 0.1, seed=1)))
+        self.failUnless(100 < len(a) < 300)
+
+    def testReservoir(self):
+        """Reservoir sampling yields exactly n lines in their original order"""
+        sample = list(ReservoirSample(self.lines, 50, seed=3))
+        self.failUnlessEqual(len(sample), 50)
+        self.failUnlessEqual(sample, [l for l in self.lines if l in set(sample)])
+        self.failUnlessEqual(list(ReservoirSample(self.lines[:10], 50)), self.lines[:10])
+
+
+class BlocklistTest(unittest.TestCase):
+    def testIPSet(self):
+        ips = IPSet(['10.0.0.0/8', '192.168.1.4/31', '192.168.1.6'])
+        self.failUnlessEqual(len(ips), 2)
+        for ip in ('10.0.0.0', '10.255.255.255', '192.168.1.4', '192.168.1.6'):
+            self.failUnless(ip in ips, ip)
+        for ip in ('9.255.255.255', '11.0.0.0', '192.168.1.3', '192.168.1.7', '-', 'unknown'):
+            self.failIf(ip in ips, ip)
+
+    def testStringSet(self):
+        paths = StringSet(['/api', '/api/x', '/about'], 'prefix')
+        self.failUnless('/api/y' in paths)
+        self.failUnless('/about.html' in paths)
+        self.failIf('/ab' in paths)
+        self.failIf('/x/api' in paths)
+        uas = StringSet(['bot', 'Pingdom'], 'substring')
+        self.failUnless('Googlebot/2.1' in uas)
+        self.failIf('Mozilla/5.0' in uas)
+
+    def testBlocklistFilter(self):
+        lines = LogLineSource([
+            '10.0.0.1 - - [01/Apr/2010:12:00:00 +0000] "GET / HTTP/1.1" 200 100 "-" "Mozilla"',
+            '8.8.8.8, 10.0.0.2 - - [01/Apr/2010:12:00:00 +0000] "GET / HTTP/1.1" 200 100 "-" "Mozilla"',
+            '8.8.8.8 - - [01/Apr/2010:12:00:00 +0000] "GET /health HTTP/1.1" 200 100 "-" "Mozilla"',
+            '8.8.8.8 - - [01/Apr/2010:12:00:00 +0000] "GET / HTTP/1.1" 200 100 "-" "Pingdom.com_bot"',
+            '8.8.8.8 - - [01/Apr/2010:12:00:00 +0000] "GET / HTTP/1.1" 200 100 "-" "Mozilla"',
+        ])
+        log = BlocklistFilter(lines, ips=['10.0.0.0/8'], paths=['/health'], uas=['Pingdom'])
+        self.failUnlessEqual([l.line_number for l in log], [5])
+
+    def testQuotedUserAgents(self):
+        """User agents are compared without their surrounding quotes"""
+        texts = [
+            '8.8.8.8 - - [01/Apr/2010:12:00:00 +0000] "GET / HTTP/1.1" 200 100 "-" "Pingdom.com_bot"',
+            '8.8.8.8 - - [01/Apr/2010:12:00:00 +0000] "GET / HTTP/1.1" 200 100 "-" "Mozilla/5.0 (X11)"',
+            '8.8.8.8 - - [01/Apr/2010:12:00:00 +0000] "GET / HTTP/1.1" 200 100 "-" "-"',
+        ]
+        exact = StringSet(['Pingdom.com_bot', '-'], 'exact')
+        log = BlocklistFilter(LogLineSource(texts), uas=exact, exclude=False)
+        self.failUnlessEqual([l.line_number for l in log], [1, 3])
+
+        # A quote is not part of the value, so cannot cause a match
+        log = BlocklistFilter(LogLineSource(texts), uas=StringSet(['(X11)"', 'bot"'], 'substring'), exclude=False)
+        self.failUnlessEqual([l.line_number for l in log], [])
+
+        # The projection agrees with a full parse of real logs
+        raw = gzip.open('tests/logs/testlog1.gz').readlines()
+        uas = StringSet(['-'], 'exact')
+        expected = sum(1 for text in raw if CombinedLogLine(text).ua == '-')
+        self.failUnless(expected)
+        log = BlocklistFilter(LogLineSource(raw), uas=uas, exclude=False)
+        self.failUnlessEqual(len(list(log)), expected)
@@ -0,0 +1,166 @@
+# loglab - A library for stream-based log processing
+# Copyright (c) 2010 Crown copyright
+#
+# This file is part of loglab.
+#
+# loglab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# loglab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with loglab.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from loglab.aggregate import Aggregator, Count, CountWhere, Distinct
+from loglab.rollup import RollupStore, cover, HOUR, DAY
+from loglab.sources import OrderedSource
+
+
+LINE = '10.0.0.%d - - [%02d/Apr/2010:%02d:%02d:00 +0000] "GET / HTTP/1.1" %d 100 "-" "-"\n'
+
+
+def timestamp(day, hour, minute):
+    return int(time.mktime((2010, 4, day, hour, minute, 0, 0, 0, -1)))
+
+
+class RollupStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = os.path.join(self.dir, 'rollup.db')
+        self.opened = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def aggregator(self, **kwargs):
+        return Aggregator([Count('requests'), CountWhere('errors', code='503')], **kwargs)
+
+    def write_input(self, name, lines, mode='w'):
+        """Write lines given as (ip, day, hour, minute, code) to a log."""
+        fname = os.path.join(self.dir, name)
+        f = open(fname, mode)
+        for l in lines:
+            f.write(LINE % l)
+        f.close()
+        return fname
+
+    def open_log(self, fname):
+        self.opened.append(os.path.basename(fname))
+        return OrderedSource(open(fname))
+
+    def read_all(self, fnames, agg):
+        lines = []
+        for f in fnames:
+            lines.extend(OrderedSource(open(f)))
+        lines.sort(key=lambda l: l.time())
+        return list(agg.aggregate(lines))
+
+    def make_inputs(self):
+        a = self.write_input('a.log', [(1, 1, 23, 59, 200), (2, 2, 0, 0, 503), (3, 2, 0, 0, 200), (1, 2, 13, 5, 200)])
+        b = self.write_input('b.log', [(4, 2, 0, 0, 200), (4, 2, 0, 1, 503), (5, 3, 9, 30, 200)])
+        return [a, b]
+
+    def testQuery(self):
+        """Queries at each level match aggregating all of the inputs"""
+        inputs = self.make_inputs()
+        store = RollupStore(self.db, self.aggregator())
+        store.update(inputs, self.open_log)
+        self.failUnlessEqual(list(store.query()), self.read_all(inputs, self.aggregator()))
+        self.failUnlessEqual(list(store.query(interval=HOUR)), self.read_all(inputs, self.aggregator(interval=HOUR)))
+        self.failUnlessEqual(list(store.query(interval=DAY)), self.read_all(inputs, self.aggregator(interval=DAY)))
+
+        # Intervals between the stored levels are merged from the level below
+        self.failUnlessEqual(
+            list(store.query(interval=2 * HOUR)),
+            self.read_all(inputs, self.aggregator(interval=2 * HOUR))
+        )
+        self.failUnlessRaises(ValueError, lambda: list(store.query(interval=90)))
+
+        start = timestamp(2, 0, 0)
+        self.failUnlessEqual(
+            list(store.query(start, start + 120)),
+            [(start, {'requests': 3, 'errors': 1}), (start + 60, {'requests': 1, 'errors': 1})]
+        )
+
+    def testTotal(self):
+        inputs = self.make_inputs()
+        store = RollupStore(self.db, self.aggregator())
+        store.update(inputs, self.open_log)
+        self.failUnlessEqual(store.total(), {'requests': 7, 'errors': 2})
+        self.failUnlessEqual(store.total(timestamp(2, 0, 0), timestamp(3, 0, 0)), {'requests': 5, 'errors': 2})
+        self.failUnlessEqual(store.total(timestamp(1, 23, 59), timestamp(2, 0, 1)), {'requests': 4, 'errors': 1})
+        self.failUnlessEqual(store.total(timestamp(5, 0, 0), timestamp(6, 0, 0)), {'requests': 0, 'errors': 0})
+
+    def testCover(self):
+        """Ranges are covered with the coarsest buckets that fit"""
+        self.failUnlessEqual(cover(DAY - 120, 2 * DAY + HOUR + 60, [DAY, HOUR, 60]), [
+            (60, DAY - 120, DAY),
+            (DAY, DAY, 2 * DAY),
+            (HOUR, 2 * DAY, 2 * DAY + HOUR),
+            (60, 2 * DAY + HOUR, 2 * DAY + HOUR + 60),
+        ])
+
+    def testIncremental(self):
+        """Only new or changed inputs are read again"""
+        a, b = self.make_inputs()
+        store = RollupStore(self.db, self.aggregator())
+        self.failUnlessEqual(store.update([a, b], self.open_log), [a, b])
+        store.close()
+
+        store = RollupStore(self.db, self.aggregator())
+        self.failUnlessEqual(store.update([a, b], self.open_log), [])
+
+        self.write_input('b.log', [(5, 3, 10, 0, 503)], mode='a')
+        c = self.write_input('c.log', [(6, 4, 0, 0, 200)])
+        self.opened = []
+        self.failUnlessEqual(store.update([a, b, c], self.open_log), [b, c])
+        self.failUnlessEqual(self.opened, ['b.log', 'c.log'])
+        self.failUnlessEqual(store.total(), {'requests': 9, 'errors': 3})
+        self.failUnlessEqual(store.inputs(), [a, b, c])
+
+        store.forget(c)
+        self.failUnlessEqual(store.total(), {'requests': 8, 'errors': 3})
+
+    def testLayout(self):
+        """A store cannot be reopened with different columns"""
+        RollupStore(self.db, self.aggregator()).close()
+        self.failUnlessRaises(ValueError, RollupStore, self.db, Aggregator([Count()]))
+        self.failUnlessRaises(ValueError, RollupStore, self.db, self.aggregator(), levels=(HOUR,))
+
+    def testColumnParams(self):
+        """A store cannot be reopened with columns of the same names but
+        different parameters"""
+        columns = lambda **kw: [
+            CountWhere('errors', code=kw.get('code', '503')),
+            Distinct('clients', 'ip', precision=kw.get('precision', 14)),
+        ]
+        RollupStore(self.db, Aggregator(columns())).close()
+        RollupStore(self.db, Aggregator(columns())).close()
+        self.failUnlessRaises(ValueError, RollupStore, self.db, Aggregator(columns(code='500')))
+        self.failUnlessRaises(ValueError, RollupStore, self.db, Aggregator(columns(precision=10)))
+        self.failUnlessRaises(ValueError, RollupStore, self.db, Aggregator([Count('errors'), Distinct('clients', 'ip')]))
+
+    def testSketchColumns(self):
+        """Sketch columns are stored and merged across inputs and levels"""
+        inputs = self.make_inputs()
+        store = RollupStore(self.db, Aggregator([Distinct('clients', 'ip')]))
+        store.update(inputs, self.open_log)
+        self.failUnlessEqual(store.total(), {'clients': 5})
+        self.failUnlessEqual(store.total(timestamp(2, 0, 0), timestamp(3, 0, 0)), {'clients': 4})
+
+    def testGroupBy(self):
+        inputs = self.make_inputs()
+        store = RollupStore(self.db, Aggregator([Count()], group_by='code'))
+        store.update(inputs, self.open_log)
+        self.failUnlessEqual(store.total(), {'200': {'count': 5}, '503': {'count': 2}})
@@ -0,0 +1,287 @@
+# loglab - A library for stream-based log processing
+# Copyright (c) 2010 Crown copyright
+# 
+# This file is part of loglab.
+# 
+# loglab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# loglab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with loglab.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import os.path
+import gzip
+import datetime
+import shutil
+import tempfile
+import unittest
+
+from loglab.lineformats import CombinedLogLine
+from loglab import threaded_gzip
+from loglab.date_splitter import LogSplitter, PartitionedWriter, Partitioner
+from loglab.incremental import IncrementalSplitter, Manifest
+from loglab.sources import OrderedSource
+from loglab.filters import DateRangeFilter
+
+
+LINE = '10.0.0.1 - - [%02d/Apr/2010:%02d:00:00 +0000] "GET /%d HTTP/1.1" %d 100 "-" "-"'
+
+
+def make_lines(days, hours=None, codes=None):
+    """Construct log lines dated on the given days of April 2010."""
+    hours = hours or [12] * len(days)
+    codes = codes or [200] * len(days)
+    return [
+        CombinedLogLine(LINE % (d, h, i, c), line_number=i + 1)
+        for i, (d, h, c) in enumerate(zip(days, hours, codes))
+    ]
+
+
+def read_log(fname):
+    if fname.endswith('.gz'):
+        f = gzip.open(fname)
+    else:
+        f = open(fname)
+    try:
+        return f.read().splitlines()
+    finally:
+        f.close()
+
+
+class LogSplitterTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def split(self, days, template='log-%Y-%m-%d.gz', **kwargs):
+        lines = make_lines(days)
+        LogSplitter(os.path.join(self.dir, template), **kwargs).split(lines)
+        return lines
+
+    def testSplit(self):
+        """Each line is written to the file for its date"""
+        lines = self.split([1, 1, 2, 3, 3])
+        self.failUnlessEqual(sorted(os.listdir(self.dir)), [
+            'log-2010-04-01.gz', 'log-2010-04-02.gz', 'log-2010-04-03.gz'
+        ])
+        self.failUnlessEqual(read_log(os.path.join(self.dir, 'log-2010-04-03.gz')), [str(l) for l in lines[3:]])
+
+    def testEvictedFilesAreAppended(self):
+        """Files closed to stay under max_open are reopened without loss"""
+        days = [1, 2, 3, 1, 2, 3, 1]
+        lines = self.split(days, max_open=2)
+        for d in (1, 2, 3):
+            expected = [str(l) for l, day in zip(lines, days) if day == d]
+            got = read_log(os.path.join(self.dir, 'log-2010-04-%02d.gz' % d))
+            self.failUnlessEqual(got, expected)
+
+    def testUncompressedAppend(self):
+        days = [1, 2, 1]
+        lines = self.split(days, template='log-%Y-%m-%d', max_open=1)
+        got = read_log(os.path.join(self.dir, 'log-2010-04-01'))
+        self.failUnlessEqual(got, [str(lines[0]), str(lines[2])])
+
+    def testSmallFlushSize(self):
+        """Lines are written intact whatever the flush size"""
+        days = [1, 2, 1, 1, 2]
+        lines = self.split(days, flush_size=1, max_open=1)
+        got = read_log(os.path.join(self.dir, 'log-2010-04-02.gz'))
+        self.failUnlessEqual(got, [str(lines[1]), str(lines[4])])
+
+    def testCompressors(self):
+        """All compressors produce readable gzip files, including when appending"""
+        days = [1, 2, 1]
+        for compressor in ('gzip', 'threaded', 'subproc'):
+            template = compressor + '-%Y-%m-%d.gz'
+            lines = self.split(days, template=template, max_open=1, compressor=compressor)
+            got = read_log(os.path.join(self.dir, compressor + '-2010-04-01.gz'))
+            self.failUnlessEqual(got, [str(lines[0]), str(lines[2])])
+
+
+class ThreadedGzipTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.dir, 'out.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testMultipleBlocks(self):
+        """Data spanning many blocks is written as one readable gzip stream"""
+        lines = ['line %d\n' % i for i in xrange(5000)]
+        f = threaded_gzip.open(self.fname, 'wb', block_size=1000)
+        f.writelines(lines)
+        f.close()
+        self.failUnlessEqual(gzip.open(self.fname).read(), ''.join(lines))
+
+    def testEmpty(self):
+        threaded_gzip.open(self.fname, 'wb').close()
+        self.failUnlessEqual(gzip.open(self.fname).read(), '')
+
+
+class PartitionedWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testHourAndField(self):
+        """Lines can be partitioned by hour and by field in one pass"""
+        lines = make_lines([1, 1, 1, 1], hours=[10, 10, 11, 10], codes=[200, 503, 200, 200])
+        template = os.path.join(self.dir, '{code}', '%Y%m%d-%H')
+        writer = PartitionedWriter(template, Partitioner('hour', ['code']))
+        written = writer.split(lines)
+        self.failUnlessEqual(len(written), 3)
+        self.failUnlessEqual(read_log(os.path.join(self.dir, '200', '20100401-10')), [str(lines[0]), str(lines[3])])
+        self.failUnlessEqual(read_log(os.path.join(self.dir, '503', '20100401-10')), [str(lines[1])])
+        self.failUnlessEqual(read_log(os.path.join(self.dir, '200', '20100401-11')), [str(lines[2])])
+
+    def testUnsafeFieldValues(self):
+        """Field values cannot name files outside the output directory"""
+        writer = PartitionedWriter(os.path.join(self.dir, 'out', '{req}', '%Y.gz'), Partitioner('day', ['req']))
+        for value, expected in [('..', '_.'), ('.', '_'), ('.hidden', '_hidden'), ('a/../b', 'a_.._b'), ('', '-')]:
+            key = (None, (('req', value),))
+            self.failUnlessEqual(writer.filename(key), os.path.join(self.dir, 'out', expected, '%Y.gz'))
+
+    def testAtomic(self):
+        """Output files do not appear until the split is complete"""
+        seen = []
+
+        def lines():
+            for l in make_lines([1, 2, 1]):
+                yield l
+                seen.append(sorted(f for f in os.listdir(self.dir) if not f.endswith('.tmp')))
+
+        LogSplitter(os.path.join(self.dir, 'log-%Y-%m-%d.gz')).split(lines())
+        self.failUnlessEqual(seen, [[], [], []])
+        self.failUnlessEqual(sorted(os.listdir(self.dir)), ['log-2010-04-01.gz', 'log-2010-04-02.gz'])
+
+    def testFailure(self):
+        """No files are left behind if the input fails"""
+        def lines():
+            for l in make_lines([1, 2]):
+                yield l
+            raise IOError("input failed")
+
+        splitter = LogSplitter(os.path.join(self.dir, 'log-%Y-%m-%d.gz'))
+        self.failUnlessRaises(IOError, splitter.split, lines())
+        self.failUnlessEqual(os.listdir(self.dir), [])
+
+
+class IncrementalSplitterTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.template = os.path.join(self.dir, 'out-%Y-%m-%d')
+        self.manifest = os.path.join(self.dir, 'manifest')
+        self.opened = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_input(self, name, days):
+        fname = os.path.join(self.dir, name)
+        f = open(fname, 'w')
+        for l in make_lines(days):
+            f.write(str(l) + '\n')
+        f.close()
+        return fname
+
+    def open_log(self, fname):
+        self.opened.append(os.path.basename(fname))
+        return OrderedSource(open(fname))
+
+    def split(self, inputs, end_day=None):
+        self.opened = []
+        if end_day:
+            end = datetime.date(2010, 4, end_day)
+            pipeline = lambda source: DateRangeFilter(source, end_date=end, ordered=True)
+            key = [None, end.isoformat()]
+        else:
+            pipeline = key = None
+        splitter = IncrementalSplitter(LogSplitter(self.template), self.manifest, self.open_log, pipeline, key)
+        written = splitter.split(inputs)
+        return sorted(os.path.basename(f) for f in written)
+
+    def count(self, day):
+        fname = self.template.replace('%Y-%m-%d', '2010-04-%02d' % day)
+        if not os.path.exists(fname):
+            return 0
+        return len(read_log(fname))
+
+    def testIncremental(self):
+        """Only new inputs, and the outputs they affect, are processed"""
+        inputs = [self.write_input('a', [1, 2]), self.write_input('b', [2, 3])]
+        self.failUnlessEqual(self.split(inputs), ['out-2010-04-01', 'out-2010-04-02', 'out-2010-04-03'])
+
+        # Nothing to do on a rerun
+        self.failUnlessEqual(self.split(inputs), [])
+        self.failUnlessEqual(self.opened, [])
+
+        # A new input for day 3 rebuilds only day 3, from both contributors
+        inputs.append(self.write_input('c', [3]))
+        self.failUnlessEqual(self.split(inputs), ['out-2010-04-03'])
+        self.failUnlessEqual(sorted(set(self.opened)), ['b', 'c'])
+        self.failUnlessEqual(len(read_log(self.template.replace('%Y-%m-%d', '2010-04-03'))), 2)
+        self.failUnlessEqual(len(read_log(self.template.replace('%Y-%m-%d', '2010-04-02'))), 2)
+
+    def testInputsNotGiven(self):
+        """Recorded inputs contribute to rebuilt outputs even if they are not
+        among the inputs given, as when only a date range is processed"""
+        self.split([self.write_input('a', [1, 2]), self.write_input('b', [2, 3])])
+        self.failUnlessEqual(self.split([self.write_input('c', [3])]), ['out-2010-04-03'])
+        self.failUnlessEqual(sorted(set(self.opened)), ['b', 'c'])
+        self.failUnlessEqual([self.count(d) for d in (1, 2, 3)], [1, 2, 2])
+
+    def testKey(self):
+        """Inputs processed with a different key are processed again,
+        without disturbing what they produced before"""
+        inputs = [self.write_input('a', [1, 2, 3]), self.write_input('b', [3])]
+        self.failUnlessEqual(self.split(inputs, end_day=3), ['out-2010-04-01', 'out-2010-04-02'])
+        self.failUnlessEqual(self.split(inputs, end_day=3), [])
+
+        # A wider range splits the days left out before
+        self.failUnless('out-2010-04-03' in self.split(inputs))
+        self.failUnlessEqual([self.count(d) for d in (1, 2, 3)], [1, 1, 2])
+
+        # A narrower range keeps them
+        self.split(inputs, end_day=2)
+        self.failUnlessEqual([self.count(d) for d in (1, 2, 3)], [1, 1, 2])
+        self.failUnlessEqual(self.split(inputs, end_day=2), [])
+
+    def testAppendedDuringRun(self):
+        """Lines appended to an input while it is read are split next time"""
+        a = self.write_input('a', [1])
+        open_log = self.open_log
+
+        def appending_open_log(fname):
+            # Append a line the first time the input is opened
+            if not self.opened:
+                f = open(fname, 'a')
+                f.write(str(make_lines([2])[0]) + '\n')
+                f.close()
+            return open_log(fname)
+        self.open_log = appending_open_log
+        self.split([a])
+        self.open_log = open_log
+        self.failUnless('out-2010-04-02' in self.split([a]))
+        self.failUnlessEqual(len(read_log(self.template.replace('%Y-%m-%d', '2010-04-01'))), 1)
+        self.failUnlessEqual(len(read_log(self.template.replace('%Y-%m-%d', '2010-04-02'))), 1)
+
+    def testPrune(self):
+        """Inputs that no longer exist are dropped from the manifest"""
+        inputs = [self.write_input('a', [1]), self.write_input('b', [2])]
+        self.split(inputs)
+        os.unlink(inputs[0])
+        self.split(inputs[1:])
+        self.failUnlessEqual(Manifest(self.manifest).inputs.keys(), [inputs[1]])
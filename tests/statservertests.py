@@ -0,0 +1,213 @@
+# loglab - A library for stream-based log processing
+# Copyright (c) 2010 Crown copyright
+# 
+# This file is part of loglab.
+# 
+# loglab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# loglab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with loglab.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import socket
+import shutil
+import tempfile
+import unittest
+
+from loglab.aggregate import Aggregator, Count, CountWhere, Quantiles, TopK, status_class
+from loglab.events import EventLoop
+from loglab.statserver import BucketRing, StatsServer
+
+from aggregatetests import make_lines, START
+
+
+def connect(server):
+    address = server.address
+    if isinstance(address, basestring):
+        s = socket.socket(socket.AF_UNIX)
+    else:
+        s = socket.socket()
+    s.connect(address)
+    return s
+
+
+def get(server, path):
+    """Request path from server, running its loop until it has answered."""
+    s = connect(server)
+    s.sendall('GET %s HTTP/1.0\r\n\r\n' % path)
+    before = len(server.connections)
+    server.loop.run_once(timeout=1)
+    for i in range(10):
+        if len(server.connections) <= before:
+            break
+        server.loop.run_once(timeout=1)
+    response = ''
+    while True:
+        data = s.recv(4096)
+        if not data:
+            break
+        response += data
+    s.close()
+    head, body = response.split('\r\n\r\n', 1)
+    return int(head.split()[1]), body
+
+
+class Waiting(Exception):
+    pass
+
+
+def feed_live(ring, lines):
+    """Aggregate lines into ring, stopping as if waiting for more lines from
+    a live log."""
+    def source():
+        for l in lines:
+            yield l
+        raise Waiting()
+    try:
+        for item in ring.record(ring.aggregator.aggregate(source())):
+            pass
+    except Waiting:
+        pass
+
+
+class BucketRingTest(unittest.TestCase):
+    def setUp(self):
+        self.agg = Aggregator([Count('requests'), CountWhere('errors', code='503')])
+        self.ring = BucketRing(self.agg, size=2)
+
+    def testRecent(self):
+        """Only the last size complete buckets are kept"""
+        lines = make_lines((0, 1, 200, 1), (1, 0, 503, 1), (2, 0, 200, 1), (3, 0, 200, 1))
+        list(self.ring.record(self.agg.aggregate(lines)))
+        self.failUnlessEqual([s for s, v in self.ring.recent()], [START + 120, START + 180])
+        self.failUnlessEqual(self.ring.recent(1), [(START + 180, {'requests': 1, 'errors': 0})])
+        self.failUnlessEqual(self.ring.recent(0), [])
+
+    def testPartial(self):
+        """The bucket being filled is available before it is output"""
+        lines = make_lines((0, 1, 200, 1), (1, 0, 503, 1), (1, 30, 503, 1))
+        feed_live(self.ring, lines)
+        self.failUnlessEqual(self.ring.recent(), [(START, {'requests': 1, 'errors': 0})])
+        self.failUnlessEqual(self.ring.partial(), (START + 60, {'requests': 2, 'errors': 2}))
+
+        list(self.ring.record(self.agg.aggregate(lines)))
+        self.failUnlessEqual(self.ring.partial(), None)
+
+    def testSnapshot(self):
+        feed_live(self.ring, make_lines((0, 1, 200, 1), (1, 0, 503, 1)))
+        snapshot = self.ring.snapshot(now=START + 75)
+        self.failUnlessEqual(snapshot['staleness'], 15)
+        self.failUnlessEqual(snapshot['interval'], 60)
+        self.failUnlessEqual(snapshot['buckets'], [{'start': START, 'values': {'requests': 1, 'errors': 0}}])
+        self.failUnlessEqual(snapshot['partial'], {'start': START + 60, 'values': {'requests': 1, 'errors': 1}})
+        json.dumps(snapshot)
+
+    def testPrometheus(self):
+        agg = Aggregator([Count('requests'), Quantiles('size'), TopK('urls', 'req')], group_by=status_class)
+        ring = BucketRing(agg)
+        feed_live(ring, make_lines((0, 1, 200, 10), (0, 2, 503, 20), (1, 0, 200, 1)))
+        text = ring.prometheus(now=START + 61)
+        lines = text.splitlines()
+        self.failUnless('# TYPE loglab_requests gauge' in lines)
+        self.failUnless('loglab_requests{bucket="complete",group="5xx"} 1' in lines)
+        self.failUnless('loglab_requests{bucket="partial",group="2xx"} 1' in lines)
+        self.failUnless('loglab_size{bucket="complete",group="2xx",quantile="0.5"} 10.0' in lines)
+        self.failUnless('loglab_bucket_start_seconds{bucket="complete"} %d' % START in lines)
+        self.failUnless('loglab_staleness_seconds 1' in lines)
+        self.failIf('urls' in text)
+
+
+class StatsServerTest(unittest.TestCase):
+    def setUp(self):
+        self.agg = Aggregator([Count('requests')])
+        self.ring = BucketRing(self.agg)
+        self.loop = EventLoop()
+        lines = make_lines((0, 1, 200, 1), (1, 0, 503, 1))
+        list(self.ring.record(self.agg.aggregate(lines)))
+
+    def testHTTP(self):
+        server = StatsServer(self.loop, self.ring, ('127.0.0.1', 0))
+        try:
+            status, body = get(server, '/stats?n=1')
+            self.failUnlessEqual(status, 200)
+            stats = json.loads(body)
+            self.failUnlessEqual(stats['buckets'], [{'start': START + 60, 'values': {'requests': 1}}])
+
+            status, body = get(server, '/metrics')
+            self.failUnlessEqual(status, 200)
+            self.failUnless('loglab_requests{bucket="complete"} 1\n' in body)
+
+            status, body = get(server, '/stats?n=x')
+            self.failUnlessEqual(status, 400)
+            status, body = get(server, '/nothing')
+            self.failUnlessEqual(status, 404)
+        finally:
+            server.close()
+        self.failIf(self.loop.pending())
+
+    def testUnixSocket(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'stats.sock')
+            server = StatsServer(self.loop, self.ring, path)
+            status, body = get(server, '/stats')
+            self.failUnlessEqual(status, 200)
+            self.failUnlessEqual(len(json.loads(body)['buckets']), 2)
+            server.close()
+            self.failIf(os.path.exists(path))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testIdleClient(self):
+        """A client that sends nothing does not hold up other requests, and
+        is dropped after the timeout"""
+        server = StatsServer(self.loop, self.ring, ('127.0.0.1', 0), timeout=0.2)
+        try:
+            idle = connect(server)
+            partial = connect(server)
+            partial.sendall('GET /stats HTTP/1.0\r\n')
+            self.loop.run_once(timeout=0.1)
+            self.loop.run_once(timeout=0.1)
+            self.failUnlessEqual(len(server.connections), 2)
+
+            status, body = get(server, '/metrics')
+            self.failUnlessEqual(status, 200)
+            self.failUnlessEqual(len(server.connections), 2)
+
+            while server.connections:
+                self.loop.run_once(timeout=1)
+            self.failUnlessEqual(idle.recv(100), '')
+            self.failUnlessEqual(partial.recv(100), '')
+            idle.close()
+            partial.close()
+        finally:
+            server.close()
+        self.failIf(self.loop.pending())
+
+    def testPartialRequest(self):
+        """A request arriving in pieces is answered once it is complete"""
+        server = StatsServer(self.loop, self.ring, ('127.0.0.1', 0))
+        try:
+            s = connect(server)
+            s.sendall('GET /stats?n=1 HT')
+            self.loop.run_once(timeout=0.1)
+            self.loop.run_once(timeout=0.1)
+            s.sendall('TP/1.0\r\nHost: localhost\r\n\r\n')
+            while server.connections:
+                self.loop.run_once(timeout=1)
+            response = s.makefile().read()
+            s.close()
+            self.failUnless(response.startswith('HTTP/1.0 200 OK\r\n'))
+            head, body = response.split('\r\n\r\n', 1)
+            self.failUnlessEqual(len(json.loads(body)['buckets']), 1)
+        finally:
+            server.close()
@@ -0,0 +1,280 @@
+# loglab - A library for stream-based log processing
+# Copyright (c) 2010 Crown copyright
+# 
+# This file is part of loglab.
+# 
+# loglab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# loglab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with loglab.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+from loglab import inotify
+from loglab.tail import TailSource, MultiTailSource
+
+
+LINE = '10.0.0.1 - - [01/Apr/2010:12:%02d:%02d +0000] "GET /%s HTTP/1.1" 200 100 "-" "-"\n'
+
+
+def log_line(seconds, path=''):
+    return LINE % (seconds // 60, seconds % 60, path)
+
+
+class TailSourceTest(unittest.TestCase):
+    use_inotify = True
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.dir, 'access_log')
+        self.f = open(self.fname, 'w')
+        self.f.write('old line\n')
+        self.f.flush()
+
+    def tearDown(self):
+        self.f.close()
+        shutil.rmtree(self.dir)
+
+    def tail(self, **kwargs):
+        kwargs.setdefault('use_inotify', self.use_inotify)
+        kwargs.setdefault('poll_interval', 0.05)
+        return TailSource(self.fname, **kwargs)
+
+    def write(self, data):
+        self.f.write(data)
+        self.f.flush()
+
+    def testReadLines(self):
+        """Only complete new lines are returned"""
+        tail = self.tail()
+        self.failUnlessEqual(tail.read_lines(), [])
+        self.write('first\nsecond\nthi')
+        self.failUnlessEqual(tail.read_lines(), ['first', 'second'])
+        self.write('rd\n')
+        self.failUnlessEqual(tail.read_lines(), ['third'])
+        tail.close()
+
+    def testFromStart(self):
+        tail = self.tail(from_start=True)
+        self.failUnlessEqual(tail.read_lines(), ['old line'])
+        tail.close()
+
+    def testChunkedReads(self):
+        """Reads are bounded by chunk_size"""
+        tail = self.tail(chunk_size=10)
+        self.write('x' * 25 + '\n' + 'y\n')
+        self.failUnlessEqual(tail.read_chunk(), [])
+        self.failUnlessEqual(tail.read_lines(), ['x' * 25, 'y'])
+        tail.close()
+
+    def testIteration(self):
+        """Iteration wakes up promptly when lines are written, and stops
+        when stop() is called"""
+        tail = self.tail()
+        received = []
+
+        def consume():
+            for l in tail:
+                received.append((l, time.time()))
+
+        t = threading.Thread(target=consume)
+        t.start()
+        time.sleep(0.1)
+        written = time.time()
+        self.write('new line\n')
+        time.sleep(0.2)
+        tail.stop()
+        t.join(1)
+        self.failIf(t.isAlive())
+        tail.close()
+
+        self.failUnlessEqual([l for l, when in received], ['new line'])
+        self.failUnless(received[0][1] - written < 0.15)
+
+    def testRotation(self):
+        """A rotated log is read to the end before the new log is read"""
+        tail = self.tail()
+        self.write('one\n')
+        self.failUnlessEqual(tail.read_lines(), ['one'])
+        os.rename(self.fname, self.fname + '.1')
+        self.write('two\nthree')
+        self.f.close()
+        self.f = open(self.fname, 'w')
+        self.write('four\n')
+        self.failUnlessEqual(tail.read_lines(), ['two', 'three', 'four'])
+        self.write('five\n')
+        self.failUnlessEqual(tail.read_lines(), ['five'])
+        tail.close()
+
+    def testDeletedLog(self):
+        """The tail waits for a deleted log to be replaced"""
+        tail = self.tail()
+        os.unlink(self.fname)
+        self.failUnlessEqual(tail.read_lines(), [])
+        self.f.close()
+        self.f = open(self.fname, 'w')
+        self.write('new\n')
+        self.failUnlessEqual(tail.read_lines(), ['new'])
+        tail.close()
+
+    def testCopyTruncate(self):
+        """A log truncated in place is read again from the start"""
+        tail = self.tail()
+        self.write('one\ntwo\n')
+        self.failUnlessEqual(tail.read_lines(), ['one', 'two'])
+        self.f.seek(0)
+        self.f.truncate()
+        self.write('three\n')
+        self.failUnlessEqual(tail.read_lines(), ['three'])
+        tail.close()
+
+    def testNoFollow(self):
+        tail = self.tail(follow=False)
+        os.rename(self.fname, self.fname + '.1')
+        self.f.close()
+        self.f = open(self.fname, 'w')
+        self.write('new\n')
+        self.failUnlessEqual(tail.read_lines(), [])
+        tail.close()
+
+    def testIterationThroughRotation(self):
+        tail = self.tail()
+        received = []
+
+        def consume():
+            for l in tail:
+                received.append(l)
+
+        t = threading.Thread(target=consume)
+        t.start()
+        self.write('one\n')
+        time.sleep(0.1)
+        os.rename(self.fname, self.fname + '.1')
+        self.write('two\n')
+        self.f.close()
+        self.f = open(self.fname, 'w')
+        self.write('three\n')
+        time.sleep(0.2)
+        tail.stop()
+        t.join(1)
+        tail.close()
+        self.failUnlessEqual(received, ['one', 'two', 'three'])
+
+
+class PollingTailSourceTest(TailSourceTest):
+    use_inotify = False
+
+    def testPolling(self):
+        tail = self.tail()
+        self.failUnless(tail.inotify is None)
+        tail.close()
+
+
+class MultiTailSourceTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.files = []
+        for name in ['a', 'b']:
+            f = open(os.path.join(self.dir, name), 'w')
+            self.files.append(f)
+        self.tail = MultiTailSource([f.name for f in self.files], lateness=2, idle_timeout=5, poll_interval=0.05)
+
+    def tearDown(self):
+        self.tail.close()
+        for f in self.files:
+            f.close()
+        shutil.rmtree(self.dir)
+
+    def write(self, i, *seconds):
+        f = self.files[i]
+        for s in seconds:
+            f.write(log_line(s, '%d-%d' % (i, s)))
+        f.flush()
+
+    def step(self, now):
+        late = self.tail.read(now)
+        return [l.req for l in late + self.tail.ready(now)]
+
+    def testWatermarks(self):
+        """Lines are held until every active log has passed them"""
+        self.write(0, 0, 10)
+        self.write(1, 5)
+        self.failUnlessEqual(self.step(100), ['/0-0'])
+        self.write(1, 20)
+        self.failUnlessEqual(self.step(101), ['/1-5'])
+        self.failUnlessEqual([l.req for l in self.tail.flush()], ['/0-10', '/1-20'])
+
+    def testIdleLog(self):
+        """A log that has gone quiet does not hold back the others"""
+        self.write(0, 0)
+        self.write(1, 5)
+        self.step(100)
+        self.write(0, 10, 20)
+        self.failUnlessEqual(self.step(101), ['/0-0'])
+        self.failUnlessEqual(self.step(105), ['/1-5', '/0-10'])
+
+    def testTimeout(self):
+        """Lines are output once they have been held for idle_timeout"""
+        self.write(0, 0)
+        self.failUnlessEqual(self.step(100), [])
+        self.failUnlessEqual(self.step(105), ['/0-0'])
+
+    def testLateLines(self):
+        self.write(0, 0, 10, 14)
+        self.write(1, 12)
+        self.failUnlessEqual(self.step(100), ['/0-0', '/0-10'])
+        self.write(1, 5)
+        self.failUnlessEqual(self.step(101), ['/1-5'])
+        self.failUnlessEqual(self.tail.late, 1)
+
+    def testIteration(self):
+        received = []
+
+        def consume():
+            for l in self.tail:
+                received.append(l.req)
+
+        t = threading.Thread(target=consume)
+        t.start()
+        self.write(1, 5)
+        self.write(0, 0, 10)
+        time.sleep(0.2)
+        self.tail.stop()
+        t.join(1)
+        self.failIf(t.isAlive())
+        self.failUnlessEqual(received, ['/0-0', '/1-5', '/0-10'])
+
+
+if inotify.available():
+    class INotifyTest(unittest.TestCase):
+        def testEvents(self):
+            d = tempfile.mkdtemp()
+            try:
+                fname = os.path.join(d, 'log')
+                open(fname, 'w').close()
+                ino = inotify.INotify()
+                wd = ino.add_watch(fname, inotify.IN_MODIFY)
+                self.failUnlessEqual(ino.read_events(), [])
+                f = open(fname, 'a')
+                f.write('x')
+                f.close()
+                events = ino.read_events()
+                self.failUnless(events)
+                self.failUnlessEqual(events[0][0], wd)
+                self.failUnless(events[0][1] & inotify.IN_MODIFY)
+                ino.close()
+            finally:
+                shutil.rmtree(d)
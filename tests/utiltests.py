@@ -0,0 +1,163 @@
+# loglab - A library for stream-based log processing
+# Copyright (c) 2010 Crown copyright
+# 
+# This file is part of loglab.
+# 
+# loglab is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# loglab is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with loglab.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import json
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from loglab.sources import LogLineSource
+from loglab.file_sources import GZipLogFile
+from loglab.metrics import Metrics, Reporter
+from loglab.profiler import Profiler
+from loglab.prefetch import Prefetch
+
+from magpietests import TESTLOG, count_lines
+
+
+class MetricsTest(unittest.TestCase):
+    def testCounts(self):
+        """Lines, bytes and parse failures are counted"""
+        metrics = Metrics()
+        raw = ['garbage\n', '\n', '10.0.0.1 - - [01/Apr/2010:12:00:00 +0000] "GET / HTTP/1.1" 200 100 "-" "-"\n']
+        source = LogLineSource(metrics.count_raw(raw))
+        metrics.watch_failures(source)
+        log = metrics.count(source)
+        self.failUnlessEqual(count_lines(log), 1)
+
+        snap = metrics.snapshot()
+        self.failUnlessEqual(snap['stages']['input']['lines'], len(raw))
+        self.failUnlessEqual(snap['stages']['input']['bytes'], sum(len(l) for l in raw))
+        self.failUnlessEqual(snap['stages']['lines']['lines'], 1)
+        self.failUnless(snap['stages']['lines']['lag'] > 0)
+        self.failUnlessEqual(snap['parse_failures'], 2)
+
+    def testBufferOccupancy(self):
+        metrics = Metrics()
+        source = GZipLogFile(TESTLOG, window_size=100)
+        metrics.watch_buffer('testlog', source)
+        self.failUnlessEqual(metrics.snapshot()['gauges'], {'testlog': 0})
+        it = iter(source)
+        it.next()
+        self.failUnlessEqual(metrics.snapshot()['gauges'], {'testlog': 100})
+
+    def testReporter(self):
+        """A reporter makes a final report when stopped"""
+        snaps = []
+        metrics = Metrics()
+        reporter = metrics.report_every(60, snaps.append)
+        count_lines(metrics.count(range(10), name='numbers'))
+        reporter.stop()
+        self.failUnlessEqual(snaps[-1]['stages']['numbers']['lines'], 10)
+
+    def testReporterOutputs(self):
+        """Reports are written as a line of text to a stream, or as JSON
+        replacing a file"""
+        metrics = Metrics()
+        count_lines(metrics.count(range(10), name='numbers'))
+        stream = StringIO()
+        Reporter(metrics, output=stream).report()
+        self.failUnless(stream.getvalue().startswith('numbers: 10 lines'))
+        self.failUnless(stream.getvalue().endswith('0 parse failures\n'))
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, 'metrics.json')
+            Reporter(metrics, output=fname).report()
+            Reporter(metrics, output=fname).report()
+            self.failUnlessEqual(os.listdir(tmpdir), ['metrics.json'])
+            self.failUnlessEqual(json.load(open(fname))['stages']['numbers']['lines'], 10)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+def busy(iterable, seconds):
+    """Spend seconds of wall time before passing on each item."""
+    for i in iterable:
+        end = time.time() + seconds
+        while time.time() < end:
+            pass
+        yield i
+
+
+class ProfilerTest(unittest.TestCase):
+    def pipeline(self, profiler):
+        source = profiler.stage(busy(range(20), 0.002), 'slow')
+        return profiler.stage(busy(source, 0.0005), 'fast')
+
+    def testExclusiveTime(self):
+        """Time in a nested stage is not attributed to the outer stage"""
+        profiler = Profiler()
+        self.failUnlessEqual(count_lines(self.pipeline(profiler)), 20)
+        times = dict((name, wall) for name, wall, cpu in profiler.breakdown())
+        self.failUnless(0.035 < times['slow'] < 0.06, times)
+        self.failUnless(0.008 < times['fast'] < 0.02, times)
+
+    def testSampling(self):
+        profiler = Profiler(sample_interval=0.001)
+        count_lines(self.pipeline(profiler))
+        profiler.stop()
+        samples = dict((s.name, s.samples) for s in profiler.stages)
+        self.failUnless(samples['slow'] > samples['fast'], samples)
+
+    def testLogFile(self):
+        """log_file() profiles the stages of reading a log"""
+        profiler = Profiler()
+        self.failUnlessEqual(count_lines(profiler.log_file(TESTLOG)), 4999)
+        names = [name for name, wall, cpu in profiler.breakdown()]
+        self.failUnlessEqual(names, ['decompression', 'line splitting', 'parse', 'sort buffer', 'sink'])
+
+
+class PrefetchTest(unittest.TestCase):
+    def testOrder(self):
+        self.failUnlessEqual(list(Prefetch(xrange(2500), batch_size=100)), range(2500))
+
+    def testException(self):
+        """Exceptions in the source are raised in the consumer"""
+        def failing():
+            yield 1
+            raise ValueError("broken")
+        self.failUnlessRaises(ValueError, list, Prefetch(failing()))
+
+    def testBackpressure(self):
+        """The background thread does not read more than max_batches ahead"""
+        read = []
+
+        def source():
+            for i in xrange(10000):
+                read.append(i)
+                yield i
+
+        metrics = Metrics()
+        p = Prefetch(source(), batch_size=10, max_batches=2)
+        metrics.watch_buffer('prefetch', p)
+        it = iter(p)
+        it.next()
+        time.sleep(0.05)
+        self.failUnless(len(read) <= 40, len(read))
+        self.failUnlessEqual(metrics.snapshot()['gauges'], {'prefetch': 2})
+        p.close()
+        self.failUnless(p.thread is None)
+
+    def testFileSource(self):
+        source = GZipLogFile(TESTLOG, prefetch=True)
+        self.failUnlessEqual(count_lines(source), count_lines(GZipLogFile(TESTLOG)))
+        source.close()
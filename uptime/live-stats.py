@@ -20,24 +20,29 @@
 
 
 import sys
-import os
+import json
+import urllib2
 import datetime
 
-LOGFILE = '/home/mauve/uptime/uptime.csv'
+STATS_URL = 'http://127.0.0.1:8053/stats?n=1'
 
-f = open(LOGFILE, 'r')
 try:
-	f.seek(-4096, os.SEEK_END)
-except IOError:
-	f.seek(0)
+	stats = json.load(urllib2.urlopen(STATS_URL, timeout=10))
+except (IOError, ValueError), e:
+	print >>sys.stderr, "Could not read stats: %s. Is log analyser still running?" % e
+	sys.exit(1)
 
-ls = f.read().split('\n')
-if len(ls) > 2:
-	t, hits, error503 = ls[-2].split(',')
-	date = datetime.datetime.strptime(t, '%Y-%m-%d %H:%M:00')
-	if (datetime.datetime.now() - date) > datetime.timedelta(seconds=150):
-		print >>sys.stderr, "Uptime log is out of date. Is log analyser still running?"
-		sys.exit(1)
-	print "Date:", repr(t)
+if stats['staleness'] is None or stats['staleness'] > 150:
+	print >>sys.stderr, "Uptime stats are out of date. Is log analyser still running?"
+	sys.exit(1)
+
+if stats['buckets']:
+	last = stats['buckets'][-1]
+	hits = last['values']['requests']
+	if hits:
+		availability = 100.0 - float(last['values']['error503s']) * 100.0 / hits
+	else:
+		availability = '-'
+	print "Date:", repr(datetime.datetime.fromtimestamp(last['start']).strftime('%Y-%m-%d %H:%M:00'))
 	print "Hits:", hits
-	print "Error503:", error503
+	print "Error503:", availability
@@ -20,74 +20,45 @@
 
 
 import sys
-import os
-import csv
-import time
-import datetime
 
-import threading
-
-from logtools.magpie import LogSanitisationFilter, LogLineSource
-from logtools.reports import ServiceUnavailableReport
-from logtools.tail import TailSource
+from logtools.magpie import LogSanitisationFilter
+from logtools.aggregate import Aggregator, Count, CountWhere
+from logtools.tail import MultiTailSource
+from logtools.events import EventLoop, TailReader, Channel
+from logtools.statserver import BucketRing, StatsServer
 
 
 VARNISHLOG = '/var/log/varnish/varnishncsa.log'
-OUTFILE = 'uptime.csv'
-
-
-class StatLogger(threading.Thread):
-    def __init__(self, from_start=False):
-	super(StatLogger, self).__init__()
-        self.keeprunning = True
-        self.f = open(OUTFILE, 'a')
-        self.tail = TailSource(VARNISHLOG, from_start=from_start)
 
-    def stop(self):
-        self.keeprunning = False
-        self.tail.stop()
+# Logs to follow; give one per host on the command line
+VARNISHLOGS = sys.argv[1:] or [VARNISHLOG]
 
-    def run(self):
-        log = LogSanitisationFilter(LogLineSource(self.tail))
-        scanner = ServiceUnavailableReport(log)
-        cw = csv.writer(self.f)
-        scan = iter(scanner.scan())
-        while self.keeprunning:
-            try:
-                minute, requests, error503s = scan.next()
-            except StopIteration:
-                break
-            if requests:
-                cw.writerow((minute.strftime('%Y-%m-%d %H:%M:00'), requests, 100.0 - float(error503s) * 100.0 / requests))
-            else:
-                cw.writerow((minute.strftime('%Y-%m-%d %H:%M:00'), requests, '-'))
-            self.f.flush()
-        self.f.close()
+# Where live-stats.py and monitoring read the per-minute stats
+STATS_ADDRESS = ('127.0.0.1', 8053)
 
+# Minutes of stats to keep in memory
+HISTORY = 60
 
-logger = StatLogger()
-logger.start()
 
+def log_stats(loop, from_start=False):
+    """Serve per-minute requests and 503s on STATS_ADDRESS as lines arrive.
 
-try:
-    while True:
-        # stat both files
-        try:
-            logstat = os.stat(VARNISHLOG)
-        except OSError:
-            # ignore temporary errors such as race conditions when the
-            # log is rotated
-            time.sleep(2)
-            continue
+    The tails follow their logs through rotation, and are read from the
+    event loop, which also answers requests for the stats, so this runs in
+    a single thread for as long as the process does.
+    """
+    channel = Channel(loop)
+    reader = TailReader(loop, MultiTailSource(VARNISHLOGS, from_start=from_start), channel)
+    aggregator = Aggregator([Count('requests'), CountWhere('error503s', code='503')], interval=60)
+    ring = BucketRing(aggregator, size=HISTORY)
+    server = StatsServer(loop, ring, STATS_ADDRESS)
+    try:
+        log = LogSanitisationFilter(channel)
+        for start, values in ring.record(aggregator.aggregate(log)):
+            pass
+    finally:
+        server.close()
+        reader.close()
 
-        fstat = os.fstat(logger.tail.f.fileno())
 
-        # Check whether the log has been rotated
-        if logstat.st_ino != fstat.st_ino:
-            logger.stop()
-            logger.join()
-            logger = StatLogger(from_start=True)
-            logger.start()
-        time.sleep(30)
-finally:
-    logger.stop()
+log_stats(EventLoop())
@@ -24,29 +24,44 @@ import glob
 import csv
 import datetime
 
-from logtools.magpie import GZipLogFile, UncompressedLogFile, LogMultiplexer, LogSanitisationFilter, LineDisplay
-from logtools.reports import ServiceUnavailableReport
+from logtools.magpie import GZipLogFile, UncompressedLogFile, LogSanitisationFilter, LineDisplay
+from logtools.aggregate import Aggregator, Count, CountWhere
+from logtools.rollup import RollupStore
 
 
 servers = ['grishenko', 'dimitrios']
 
-logs = []
+# Buckets of every log read so far; only new or changed logs are read
+ROLLUPS = 'uptime.db'
 
+
+def open_log(l):
+    if l.endswith('.gz'):
+        log = GZipLogFile(l)
+    else:
+        log = UncompressedLogFile(l)
+    return LogSanitisationFilter(LineDisplay(log))
+
+
+# The store recognises logs by path, size and mtime, so read only the live
+# log and logs rotated to dated names (logrotate's dateext). With numbered
+# names (.log.1, .log.2.gz) the content at every path changes on rotation,
+# and every log would be read again on each run.
+logfiles = []
 for s in servers:
-    logfiles = glob.glob('varnish/%s/varnishncsa*' % s)
-    for l in logfiles:
-        if l.endswith('.gz'):
-            logs.append(GZipLogFile(l))
-        else:
-            logs.append(UncompressedLogFile(l))
+    logfiles.extend(glob.glob('varnish/%s/varnishncsa.log' % s))
+    logfiles.extend(glob.glob('varnish/%s/varnishncsa.log-[0-9]*' % s))
 
+aggregator = Aggregator([Count('requests'), CountWhere('error503s', code='503')], interval=60)
+store = RollupStore(ROLLUPS, aggregator)
+store.update(sorted(logfiles), open_log)
 
-mux = LogMultiplexer(*logs)
-log = LogSanitisationFilter(LineDisplay(mux))
-scanner = ServiceUnavailableReport(log)
 cw = csv.writer(open('uptime.csv', 'w'))
-for minute, requests, error503s in scanner.scan():
+for start, values in store.query():
+    minute = datetime.datetime.fromtimestamp(start)
+    requests = values['requests']
     if requests:
-        cw.writerow((minute.strftime('%Y-%m-%d %H:%M:00'), requests, 100.0 - float(error503s) * 100.0 / requests))
+        cw.writerow((minute.strftime('%Y-%m-%d %H:%M:00'), requests, 100.0 - float(values['error503s']) * 100.0 / requests))
     else:
         cw.writerow((minute.strftime('%Y-%m-%d %H:%M:00'), requests, '-'))
+store.close()